@@ -0,0 +1,213 @@
+# analysis.py
+import numpy as np
+
+from geo import haversine, haversine_array
+from trackstore import latitudes, longitudes
+
+# Upper bound (km/h, exclusive) and colour of each speed band, as drawn on the map
+SPEED_BANDS = ((5.0, 'blue'), (15.0, 'green'), (30.0, 'orange'), (float('inf'), 'red'))
+STOP_RADIUS_METERS = 50.0
+STOP_MIN_DWELL_SECONDS = 300
+
+
+def band_legend(bands=SPEED_BANDS):
+    """``[{color, min_kmh, max_kmh}]`` of the speed bands; the last band has no upper bound (None)."""
+    legend = []
+    low = 0.0
+    for high, color in bands:
+        legend.append({'color': color, 'min_kmh': low, 'max_kmh': None if np.isinf(high) else high})
+        low = high
+    return legend
+
+
+def time_ordered(track):
+    return track[np.argsort(track['t'], kind='stable')]
+
+
+def segment_speeds(track):
+    """
+    Speed in km/h of each segment between consecutive fixes of a time-ordered track.
+
+    Segments between fixes with the same timestamp have no defined speed and are NaN.
+    """
+    lat = latitudes(track)
+    lng = longitudes(track)
+    distance = haversine_array(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    dt = np.diff(track['t']).astype(np.float64)
+    speeds = np.full(len(distance), np.nan)
+    np.divide(distance * 3.6, dt, out=speeds, where=dt > 0)
+    return speeds
+
+
+def speed_bands(speeds, bands=SPEED_BANDS):
+    """
+    Band index of each segment speed.
+
+    A segment without a speed (duplicate timestamp) takes the band of the segment
+    before it, so it never splits a run; leading ones fall in the first band.
+    """
+    limits = np.array([limit for limit, _ in bands[:-1]])
+    band = np.searchsorted(limits, np.nan_to_num(speeds), side='right')
+    known = ~np.isnan(speeds)
+    if not known.all():
+        last_known = np.maximum.accumulate(np.where(known, np.arange(len(speeds)), -1))
+        band = np.where(last_known >= 0, band[np.maximum(last_known, 0)], 0)
+    return band
+
+
+def speed_polylines(track, bands=SPEED_BANDS):
+    """
+    Split a time-ordered track into one polyline per run of consecutive segments in the same speed band.
+
+    Neighbouring polylines share their joining fix, so together they draw the whole track.
+
+    :return: List of ``(band index, latitudes, longitudes)``
+    """
+    if len(track) < 2:
+        return []
+    band = speed_bands(segment_speeds(track), bands)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(band)) + 1])
+    ends = np.concatenate([starts[1:], [len(band)]])
+    lat = latitudes(track)
+    lng = longitudes(track)
+    # Segments first..last-1 of a run span fixes first..last
+    return [(int(band[first]), lat[first:last + 1], lng[first:last + 1]) for first, last in zip(starts, ends)]
+
+
+class StayPointDetector:
+    """
+    Streaming stay-point (stop) detector, O(1) per fix.
+
+    Fixes are fed in time order. A cluster grows while each new fix lies within
+    ``radius_m`` of the cluster's centroid; when a fix falls outside, the cluster
+    is closed and reported as a stop if the device stayed for at least
+    ``min_dwell_s`` seconds, and a new cluster starts at that fix.
+
+    The whole detector state is a small dict (``state``/``from_state``), so it can
+    be checkpointed and resumed on the fixes appended later. The first cluster that
+    was closed is kept as ``leading`` whatever its dwell, so detectors of consecutive
+    days can be joined (``stitch_stops``).
+    """
+
+    def __init__(self, radius_m=STOP_RADIUS_METERS, min_dwell_s=STOP_MIN_DWELL_SECONDS):
+        self.radius_m = radius_m
+        self.min_dwell_s = min_dwell_s
+        self.points = 0        # fixes consumed so far
+        self.last_t = None
+        self.cluster = None    # [fixes, sum of latitudes, sum of longitudes, first t, last t]
+        self.leading = None    # first closed cluster, same layout
+        self.stops = []
+
+    def feed(self, track):
+        """Consume a time-ordered track whose fixes are not older than the last one fed."""
+        cluster = self.cluster
+        for t, lat, lng in zip(track['t'].tolist(), latitudes(track).tolist(), longitudes(track).tolist()):
+            if cluster is not None:
+                if haversine(cluster[1] / cluster[0], cluster[2] / cluster[0], lat, lng) <= self.radius_m:
+                    cluster[0] += 1
+                    cluster[1] += lat
+                    cluster[2] += lng
+                    cluster[4] = t
+                    continue
+                if self.leading is None:
+                    self.leading = cluster
+                if cluster[4] - cluster[3] >= self.min_dwell_s:
+                    self.stops.append(self._stop(cluster))
+            cluster = [1, lat, lng, t, t]
+        self.cluster = cluster
+        self.points += len(track)
+        if len(track):
+            self.last_t = int(track['t'][-1])
+
+    @staticmethod
+    def _stop(cluster, ongoing=False):
+        fixes, sum_lat, sum_lng, arrival, departure = cluster
+        return {
+            'lat': round(sum_lat / fixes, 7),
+            'lng': round(sum_lng / fixes, 7),
+            'arrival': arrival,
+            'departure': departure,
+            'dwell_s': departure - arrival,
+            'points': fixes,
+            'ongoing': ongoing,
+        }
+
+    def result(self, ongoing=False):
+        """
+        Stops found so far, including the current cluster once it has lasted long enough.
+
+        :param ongoing: Whether the fixes fed run up to now, so the current cluster is a stop not yet left
+        """
+        stops = list(self.stops)
+        if self.cluster is not None and self.cluster[4] - self.cluster[3] >= self.min_dwell_s:
+            stops.append(self._stop(self.cluster, ongoing=ongoing))
+        return stops
+
+    def state(self):
+        return {'radius_m': self.radius_m, 'min_dwell_s': self.min_dwell_s, 'points': self.points,
+                'last_t': self.last_t, 'cluster': self.cluster, 'leading': self.leading, 'stops': self.stops}
+
+    @classmethod
+    def from_state(cls, state):
+        detector = cls(state['radius_m'], state['min_dwell_s'])
+        detector.points = state['points']
+        detector.last_t = state['last_t']
+        detector.cluster = list(state['cluster']) if state['cluster'] is not None else None
+        detector.leading = list(state['leading']) if state['leading'] is not None else None
+        detector.stops = list(state['stops'])
+        return detector
+
+
+def detect_stops(track, radius_m=STOP_RADIUS_METERS, min_dwell_s=STOP_MIN_DWELL_SECONDS, ongoing=False):
+    """Stops of a track (any order) as returned by ``StayPointDetector.result``."""
+    detector = StayPointDetector(radius_m, min_dwell_s)
+    detector.feed(time_ordered(track))
+    return detector.result(ongoing)
+
+
+def _centroid(cluster):
+    return cluster[1] / cluster[0], cluster[2] / cluster[0]
+
+
+def stitch_stops(detectors, ongoing=False):
+    """
+    Stops over consecutive days from the detectors that ran on each day separately.
+
+    A day's last cluster is still open at midnight; when the next day's first
+    cluster lies within the radius of it, the two are one stay and are reported
+    once, with the arrival of the first and the departure of the second. Days
+    without fixes do not break a stay.
+
+    :param detectors: ``StayPointDetector`` of each day, in day order, with the same settings
+    :param ongoing: Whether the last day runs up to now (see ``StayPointDetector.result``)
+    """
+    if not detectors:
+        return []
+    radius_m, min_dwell_s = detectors[0].radius_m, detectors[0].min_dwell_s
+
+    def emit(cluster, is_ongoing=False):
+        if cluster is not None and cluster[4] - cluster[3] >= min_dwell_s:
+            stops.append(StayPointDetector._stop(cluster, is_ongoing))
+
+    stops = []
+    carry = None  # cluster still open at the end of the days seen so far
+    for detector in detectors:
+        if not detector.points:
+            continue
+        day_stops = detector.stops
+        first = detector.leading if detector.leading is not None else detector.cluster
+        if carry is not None and haversine(*_centroid(carry), *_centroid(first)) <= radius_m:
+            joined = [carry[0] + first[0], carry[1] + first[1], carry[2] + first[2], carry[3], first[4]]
+            if detector.leading is None:
+                # The stay lasts the whole day
+                carry = joined
+                continue
+            emit(joined)
+            if first[4] - first[3] >= min_dwell_s:
+                day_stops = day_stops[1:]  # reported as part of the joined stay
+        else:
+            emit(carry)
+        stops.extend(day_stops)
+        carry = detector.cluster
+    emit(carry, ongoing)
+    return stops
@@ -2,21 +2,56 @@ import logging
 import threading
 import time
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 from datetime import datetime
-from math import radians, cos, sin, asin, sqrt
 import os
 import json
+import atexit
+import calendar
+import fcntl
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
+import numpy as np
 import paho.mqtt.client as mqtt
 
 from exports import export_bp
 from imports import import_bp
-
-from threading import Lock
-
-latest_coords = {}
-coords_lock = Lock()
+from logwriter import mac_to_file_key, normalize_mac
+from writequeue import WriteQueue
+from parsedcache import ParsedFileCache
+from trackstore import latitudes, longitudes, timestamps, COORD_SCALE, EMPTY_TRACK
+from areaindex import points_in_polygon
+from daysummary import combine_summaries
+from heatgrid import HEAT_LEVELS, heat_level, heat_cells, merge_cells, cells_in_box, cell_centers, cell_degrees
+from storage import open_storage
+from compaction import Compactor
+from geo import haversine
+from lastpoint import LastPointCache
+from shardedingest import ShardedIngest
+from livetable import LatestPositionTable
+from livestream import LiveBroadcaster
+from simplify import SimplificationCache, rdp_mask, zoom_tolerance, MAX_ZOOM
+import wireformat
+import trackquery
+import logtable
+import analysis
+from ingestbatch import BatchError, parse_batch_body, parse_timestamp, prepare_batch, STATUS_OK, STATUS_DUPLICATE, \
+    STATUS_INVALID
+
+# Latest position per device in shared memory: written by the ingest process (or shard
+# workers), read lock-free by every web worker process
+LATEST_TABLE_NAME = os.environ.get("LATEST_TABLE_NAME", "oriiona_latest")
+LATEST_TABLE_CAPACITY = int(os.environ.get("LATEST_TABLE_CAPACITY", 4096))
+latest_table = LatestPositionTable(LATEST_TABLE_NAME, capacity=LATEST_TABLE_CAPACITY)
+atexit.register(latest_table.close)
+
+# Server-Sent Events fan-out of latest-table updates (/gps/stream)
+LIVE_STREAM_POLL_INTERVAL = float(os.environ.get("LIVE_STREAM_POLL_INTERVAL", 0.25))
+LIVE_STREAM_KEEPALIVE = float(os.environ.get("LIVE_STREAM_KEEPALIVE", 15))
+LIVE_STREAM_MAX_MACS = int(os.environ.get("LIVE_STREAM_MAX_MACS", 50))
+live_broadcaster = LiveBroadcaster(latest_table, poll_interval=LIVE_STREAM_POLL_INTERVAL,
+                                   keepalive=LIVE_STREAM_KEEPALIVE)
 
 ROUTES_DIR = 'routes'
 os.makedirs(ROUTES_DIR, exist_ok=True)
@@ -27,8 +62,49 @@ app.register_blueprint(import_bp)
 
 LIVE_THRESHOLD_SECONDS = 30
 NEAR_DISTANCE_METERS = 20
+# Points closer than this to the device's last accepted point are dropped as duplicates
+DUPLICATE_DISTANCE_METERS = float(os.environ.get("DUPLICATE_DISTANCE_METERS", 0.01))
+BATCH_MAX_POINTS = int(os.environ.get("BATCH_MAX_POINTS", 10000))
+COORDS_MAX_LIMIT = int(os.environ.get("COORDS_MAX_LIMIT", 100000))
+COORDS_MAX_MACS = int(os.environ.get("COORDS_MAX_MACS", 50))
+COORDS_MAX_DAYS = int(os.environ.get("COORDS_MAX_DAYS", 366))  # UTC days one from/to window may span
+LOGS_MAX_PAGE = int(os.environ.get("LOGS_MAX_PAGE", 1000))  # rows per /api/logs page, also the cap for "All"
+LOGS_CACHE_DAYS = int(os.environ.get("LOGS_CACHE_DAYS", 4))  # dates /api/logs keeps loaded between draws
+log_day_cache = logtable.LogDayCache(LOGS_CACHE_DAYS)
+COORDS_CHUNK_SIZE = 1000  # points serialized per chunk of a streamed /api/coords body
+QUERY_WORKERS = int(os.environ.get("QUERY_WORKERS", 4))  # threads loading device-days for range queries
+query_executor = ThreadPoolExecutor(QUERY_WORKERS, thread_name_prefix='track-query')
+PARSED_CACHE_BYTES = int(os.environ.get("PARSED_CACHE_BYTES", 256 * 1024 * 1024))  # memory budget of parsed logs
+SIMPLIFY_CACHE_SIZE = int(os.environ.get("SIMPLIFY_CACHE_SIZE", 256))
+simplify_cache = SimplificationCache(SIMPLIFY_CACHE_SIZE)
 MAX_POINTS_PER_FILE = 500
 
+# Background writer: points are queued by the MQTT/HTTP handlers and committed in batches
+WRITE_QUEUE_SIZE = int(os.environ.get("WRITE_QUEUE_SIZE", 10000))
+WRITE_FLUSH_INTERVAL = float(os.environ.get("WRITE_FLUSH_INTERVAL", 0.05))
+WRITE_FSYNC = os.environ.get("WRITE_FSYNC", "interval")  # never | batch | interval
+WRITE_FSYNC_INTERVAL = float(os.environ.get("WRITE_FSYNC_INTERVAL", 1.0))
+WRITE_OVERFLOW = os.environ.get("WRITE_OVERFLOW", "block")  # block | drop_newest | drop_oldest
+
+# Number of ingest worker processes; 0 keeps ingest in this process
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 0))
+
+# Ingest role. Exactly one process may write points, subscribe to MQTT and publish to the latest
+# table: the seqlock of livetable.LatestPositionTable and the per-device log handles assume one
+# writing process per device. Under a multi-worker server (e.g. gunicorn -w N, without --preload)
+# every worker imports this module, so with "auto" only the first to lock INGEST_LOCK_NAME in
+# TRACKS_DIR ingests and the others serve reads, answering point writes with 503; send HTTP ingest
+# to that process, or run a dedicated one with INGEST_PROCESS=1 and the web workers with 0.
+INGEST_PROCESS = os.environ.get("INGEST_PROCESS", "auto")  # auto | 1 | 0
+INGEST_LOCK_NAME = '.ingest.lock'
+
+# Compaction of closed days (opt-in, 0 = off). It replaces the text logs, .trk file and index of
+# every day it compacts with one <MAC>_<day>.trz file in TRACKS_DIR and deletes them (see
+# trackstore.write_compacted for the format), so tools that read logs/*.txt directly stop seeing
+# those days; /export and the API read them through the storage either way.
+COMPACTION_INTERVAL = float(os.environ.get("COMPACTION_INTERVAL", 0))
+COMPACTION_GRACE = float(os.environ.get("COMPACTION_GRACE", 3600))  # seconds after UTC midnight
+
 current_log = None
 last_point = {"lat": None, "lng": None, "ts": None}
 
@@ -39,6 +115,7 @@ logger = logging.getLogger(__name__)
 MQTT_BROKER = "broker.hivemq.com"
 MQTT_PORT = 1883
 MQTT_TOPIC = "orriona-gps"
+MQTT_ENABLED = os.environ.get("MQTT_ENABLED", "1") != "0"  # benchmarks feed on_message directly
 
 
 def on_connect(client, userdata, flags, rc):
@@ -62,49 +139,38 @@ def on_message(client, userdata, msg):
             logger.warning("MQTT message missing MAC address")
             return
 
-        normalized_mac = mac.strip().upper()
+        try:
+            normalized_mac = normalize_mac(mac)
+        except ValueError as e:
+            logger.warning(f"MQTT message dropped: {e}")
+            return
         logger.debug(f"Normalized MAC: {normalized_mac}")
 
         if isinstance(lat, (int, float)) and isinstance(lng, (int, float)):
             logger.info(f"📡 MQTT received -> MAC: {normalized_mac}, Lat: {lat}, Lng: {lng}")
-            with coords_lock:
-                latest_coords[normalized_mac] = {
-                    'lat': float(lat),
-                    'lng': float(lng),
-                    'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-                }
-            write_to_log(normalized_mac, lat, lng)
+            # Persist first: the live table is only a view and must never cost a point
+            if last_points.accept(normalized_mac, float(lat), float(lng)):
+                write_to_log(normalized_mac, lat, lng)
+            else:
+                logger.debug(f"Duplicate MQTT point for {normalized_mac}, not logged")
+            try:
+                latest_table.update(normalized_mac, float(lat), float(lng))
+                live_broadcaster.notify()
+            except Exception:
+                logger.exception(f"Could not publish the live position of {normalized_mac}")
         else:
             logger.warning(f"Incomplete or invalid GPS coordinates in MQTT payload: {payload}")
     except Exception as e:
         logger.exception("Error processing MQTT message")
 
 def write_to_log(mac, lat, lng):
-    today = datetime.utcnow().strftime('%Y-%m-%d')
-    log_dir = './logs'
-    os.makedirs(log_dir, exist_ok=True)
-
-    # Check for existing files for that MAC address
-    log_file_pattern = f'{log_dir}/gps_log_{mac.replace(":", "-").upper()}_{today}_'
-    existing_files = [f for f in os.listdir(log_dir) if f.startswith(log_file_pattern)]
-    log_file = log_file_pattern + '0.txt'  # Default to first file
-
-    # Determine the next available file or split the current one if too many points
-    if existing_files:
-        last_file = sorted(existing_files)[-1]
-        with open(os.path.join(log_dir, last_file), 'r') as f:
-            lines = f.readlines()
-            if len(lines) >= MAX_POINTS_PER_FILE:
-                next_file_num = int(last_file.split('_')[-1].replace('.txt', '')) + 1
-                log_file = f'{log_file_pattern}{next_file_num}.txt'
-
-    # Write each coordinate with its own timestamp
-    timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')  # Generate timestamp for each point
-    logger.debug(f"Timestamp to be written: {timestamp}")  # Debugging line to print the timestamp
-
-    with open(log_file, 'a', encoding='utf-8') as f:
-        f.write(f"{timestamp},{lat},{lng},{mac}\n")
-    logger.debug(f"Data written to: {log_file}")
+    # Timestamp each coordinate on arrival; the writer derives the day file from it
+    timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    logger.debug(f"Timestamp to be written: {timestamp}")
+
+    # Hand the point to the background writer (or the shard worker that owns the MAC);
+    # disk I/O never runs on the caller's thread
+    ingest_sink.put(mac, lat, lng, timestamp)
 
 import requests
 
@@ -126,15 +192,6 @@ def get_utc_time_with_retry(retries=3, delay=5):
                 return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')  # Fallback to local system time
 
 
-def haversine(lat1, lon1, lat2, lon2):
-    logger.debug("Function: haversine()")
-    R = 6371000
-    d_lat = radians(lat2 - lat1)
-    d_lon = radians(lon2 - lon1)
-    a = sin(d_lat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(d_lon / 2) ** 2
-    return R * 2 * asin(sqrt(a))
-
-
 @app.route('/')
 def index():
     logger.debug("Function: index()")
@@ -148,13 +205,103 @@ def show_map():
 
 
 # Define the logs directory one level up from the current directory
-LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.', 'logs')
+LOGS_DIR = os.environ.get("LOGS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '.', 'logs'))
 
 # Ensure the logs directory exists, create it if it doesn't
 if not os.path.exists(LOGS_DIR):
     logger.info(f"Logs directory does not exist. Creating it at: {LOGS_DIR}")
     os.makedirs(LOGS_DIR)
 
+# Binary columnar copy of the logs, read back through mmap by the track endpoints;
+# parsed days are shared through one process-wide cache
+TRACKS_DIR = os.environ.get("TRACKS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracks'))
+parsed_cache = ParsedFileCache(PARSED_CACHE_BYTES)
+
+# Every endpoint reads and writes points through one storage backend:
+# "files" (text logs + track store) or "sqlite" (one WAL-mode database)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "files")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'oriiona.db'))
+storage_config = {
+    'backend': STORAGE_BACKEND,
+    'log_dir': LOGS_DIR,
+    'tracks_dir': TRACKS_DIR,
+    'sqlite_path': SQLITE_PATH,
+    'max_points_per_file': MAX_POINTS_PER_FILE,
+}
+storage = open_storage(cache=parsed_cache, **storage_config)
+atexit.register(storage.close)
+app.config['STORAGE'] = storage
+
+
+def _claim_ingest_role():
+    """
+    Decide whether this process ingests (see INGEST_PROCESS).
+
+    :return: The open lock file while this process holds the role (kept open until exit),
+             True if the role is forced, None if another process ingests or it is disabled
+    """
+    if INGEST_PROCESS != 'auto':
+        return True if INGEST_PROCESS == '1' else None
+    os.makedirs(TRACKS_DIR, exist_ok=True)
+    lock_file = open(os.path.join(TRACKS_DIR, INGEST_LOCK_NAME), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        logger.info(f"Another process holds {INGEST_LOCK_NAME}; this one only serves reads")
+        return None
+    return lock_file
+
+
+ingest_role = _claim_ingest_role()
+
+
+# Multi-process ingest: payloads are sharded by MAC hash over worker processes that own
+# the files of their devices. Started before any background thread so the fork is clean.
+sharded_ingest = None
+if ingest_role and INGEST_WORKERS > 0:
+    sharded_ingest = ShardedIngest(
+        INGEST_WORKERS,
+        storage_config,
+        duplicate_meters=DUPLICATE_DISTANCE_METERS,
+        flush_interval=WRITE_FLUSH_INTERVAL,
+        fsync=WRITE_FSYNC,
+        fsync_interval=WRITE_FSYNC_INTERVAL,
+        latest_table_name=LATEST_TABLE_NAME,
+        latest_table_capacity=LATEST_TABLE_CAPACITY,
+        on_commit=live_broadcaster.notify,
+    ).start()
+    atexit.register(sharded_ingest.stop)
+
+write_queue = None
+if ingest_role:
+    write_queue = WriteQueue(
+        storage,
+        maxsize=WRITE_QUEUE_SIZE,
+        flush_interval=WRITE_FLUSH_INTERVAL,
+        fsync=WRITE_FSYNC,
+        fsync_interval=WRITE_FSYNC_INTERVAL,
+        overflow=WRITE_OVERFLOW,
+    ).start()
+    atexit.register(write_queue.stop)
+
+# None in a process without the ingest role
+ingest_sink = sharded_ingest or write_queue
+
+compactor = None
+if ingest_role and COMPACTION_INTERVAL > 0:
+    compactor = Compactor(storage, interval=COMPACTION_INTERVAL, grace=COMPACTION_GRACE).start()
+    atexit.register(compactor.stop)
+
+
+def _seed_last_point(mac_key):
+    # First sighting of a device since startup: its newest stored point, if any
+    latest = storage.latest(mac_key)
+    return latest[1:] if latest else None
+
+
+last_points = LastPointCache(DUPLICATE_DISTANCE_METERS, loader=_seed_last_point)
+
 # Route to show logs with filters
 @app.route('/logs', methods=['GET', 'POST'])
 def show_logs():
@@ -166,35 +313,53 @@ def show_logs():
     # Get the filename filter if provided (default to empty string)
     file_filter = request.args.get('file', '')
 
-    # List all log files matching the filters in the specific logs directory
-    log_files = [
-        f for f in os.listdir(LOGS_DIR)
-        if f.startswith('gps_log_') and f.endswith('.txt')  # No date filter, just looking for gps_log_ files
-           and (file_filter in f)  # Apply file name filter
-    ]
+    # List the device-days of the selected date whose name (<MAC>_<day>) matches the filter;
+    # the rows themselves are paged in by the table through /api/logs
+    log_files = [f'{mac_key}_{date_filter}' for mac_key in logtable.day_devices(storage, date_filter, file_filter)]
+
+    return render_template('logs.html', date=date_filter, file_filter=file_filter, files=log_files)
+
+
+@app.route('/api/logs', methods=['GET'])
+def get_log_page():
+    """
+    Serve the /logs table with the DataTables server-side protocol.
+
+    Reads ``draw``, ``start``, ``length``, ``search[value]`` and ``order[0][column]``/``order[0][dir]``
+    next to the ``date`` and ``file`` filters of the page, and returns only the visible page as
+    ``{draw, recordsTotal, recordsFiltered, data}``.
+    """
+    date_filter = request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
+    file_filter = request.args.get('file', '')
+    draw = request.args.get('draw', 0, type=int)
+    start = max(request.args.get('start', 0, type=int), 0)
+    length = request.args.get('length', 10, type=int)
+    if length < 0 or length > LOGS_MAX_PAGE:  # DataTables sends -1 for "All"
+        length = LOGS_MAX_PAGE
+    order_column = request.args.get('order[0][column]', 0, type=int)
+    descending = request.args.get('order[0][dir]', 'asc') == 'desc'
+
+    try:
+        datetime.strptime(date_filter, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({"draw": draw, "error": "Invalid date format. Use YYYY-MM-DD."}), 400
+    if not 0 <= order_column < len(logtable.COLUMNS):
+        return jsonify({"draw": draw, "error": f"Invalid order column {order_column}"}), 400
+
+    total, filtered, data = logtable.page(storage, date_filter, name_filter=file_filter,
+                                          search=request.args.get('search[value]', '').strip(),
+                                          order_column=order_column, descending=descending,
+                                          start=start, length=length, cache=log_day_cache)
+    return jsonify({"draw": draw, "recordsTotal": total, "recordsFiltered": filtered, "data": data})
+
+def _mac_args():
+    """
+    MACs of the comma-separated ``mac`` query parameter in canonical form.
+
+    :raises ValueError: if one of them is not a valid MAC address
+    """
+    return [normalize_mac(mac) for mac in request.args.get('mac', '').split(',') if mac.strip()]
 
-    # Sort files by the filename (for order)
-    log_files.sort()
-
-    # Initialize an empty list to hold logs
-    rows = []
-
-    # Read logs from the filtered files
-    for log_file in log_files:
-        file_path = os.path.join(LOGS_DIR, log_file)
-        with open(file_path, 'r') as f:
-            for line in f:
-                parts = line.strip().split(',')
-                if len(parts) == 4:
-                    rows.append({
-                        'timestamp': parts[0],
-                        'lat': parts[1],
-                        'lng': parts[2],
-                        'mac': parts[3]
-                    })
-
-    # Render the logs template with filtered data
-    return render_template('logs.html', logs=rows, date=date_filter, files=log_files)
 
 @app.route('/gps', methods=['POST'])
 def get_latest_mqtt_coords():
@@ -204,9 +369,12 @@ def get_latest_mqtt_coords():
 
     if not mac:
         return jsonify({"error": "MAC address is required"}), 400
+    try:
+        mac = normalize_mac(mac)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    with coords_lock:
-        data = latest_coords.get(mac)
+    data = latest_table.get(mac)
 
     if not data:
         return jsonify({"error": "No data available for this MAC"}), 404
@@ -220,21 +388,6 @@ def get_latest_mqtt_coords():
     }), 200
 
 
-# @app.route('/gps/live', methods=['GET'])
-# from flask import Flask, request, jsonify
-# import logging
-# import threading
-#
-# app = Flask(__name__)
-#
-# # Setup logger
-# logging.basicConfig(level=logging.DEBUG)
-# logger = logging.getLogger(__name__)
-#
-# # Simulated data store
-# latest_coords = {}
-# coords_lock = threading.Lock()
-
 @app.route("/gps/live", methods=["GET"])
 def get_latest_mqtt_coords_live():
     logger.debug("Function: get_latest_mqtt_coords_live() called")
@@ -248,18 +401,18 @@ def get_latest_mqtt_coords_live():
         logger.warning(f"[{client_ip}] MAC address missing from request")
         return jsonify({"error": "MAC address is required"}), 400
 
-    normalized_mac = mac.strip().upper()
+    try:
+        normalized_mac = normalize_mac(mac)
+    except ValueError as e:
+        logger.warning(f"[{client_ip}] {e}")
+        return jsonify({"error": str(e)}), 400
     logger.debug(f"Normalized MAC: {normalized_mac}")
 
     try:
-        with coords_lock:
-            logger.debug("Acquired coords_lock")
-            data = latest_coords.get(normalized_mac)
+        data = latest_table.get(normalized_mac)
     except Exception as e:
-        logger.exception("Exception occurred while accessing latest_coords")
+        logger.exception("Exception occurred while reading the latest-position table")
         return jsonify({"error": "Internal server error"}), 500
-    finally:
-        logger.debug("Released coords_lock")
 
     if not data:
         logger.warning(f"[{client_ip}] No data found for MAC: {normalized_mac}")
@@ -291,6 +444,34 @@ def get_latest_mqtt_coords_live():
     }), 200
 
 
+@app.route("/gps/stream", methods=["GET"])
+def stream_mqtt_coords():
+    """
+    Push live positions as Server-Sent Events instead of having the map poll /gps/live.
+
+    ``mac`` takes one MAC or a comma-separated list. The current position of each
+    device is sent on connect, then one ``position`` event per update with the same
+    JSON body as /gps/live.
+    """
+    try:
+        macs = _mac_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not macs:
+        return jsonify({"error": "MAC address is required"}), 400
+    if len(macs) > LIVE_STREAM_MAX_MACS:
+        return jsonify({"error": f"At most {LIVE_STREAM_MAX_MACS} MAC addresses per stream"}), 400
+
+    client_ip = request.remote_addr
+    logger.info(f"[{client_ip}] Opening live stream for {macs}")
+    subscription = live_broadcaster.subscribe(macs)
+    response = Response(stream_with_context(live_broadcaster.events(subscription)),
+                        mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # keep reverse proxies from buffering the stream
+    return response
+
+
 @app.route('/gps/legacy', methods=['POST'])
 def receive_gps():
     logger.debug("Function: receive_gps() called")
@@ -316,6 +497,11 @@ def receive_gps():
     if not mac or lat is None or lng is None:
         logger.error("Error: Missing required parameters")
         return jsonify({"error": "Missing parameters"}), 400
+    try:
+        mac = normalize_mac(mac)
+    except ValueError as e:
+        logger.error(f"Error: {e}")
+        return jsonify({"error": str(e)}), 400
 
     # Debugging for logging enabled/disabled
     if logging_enabled:
@@ -323,27 +509,26 @@ def receive_gps():
     else:
         logger.info("Logging is DISABLED. Skipping GPS data logging.")
 
-    # Check for duplicate coordinates (compare with previous ones)
-    today = datetime.utcnow().strftime('%Y-%m-%d')
-    log_dir = './logs'
-    os.makedirs(log_dir, exist_ok=True)
-
-    file_prefix = f'gps_log_{mac.replace(":", "-").upper()}_{today}_'
-    session_files = sorted(
-        [f for f in os.listdir(log_dir) if f.startswith(file_prefix) and f.endswith('.txt')])
-
-    if session_files:
-        last_log_file = session_files[-1]  # Get the most recent file
-        with open(os.path.join(log_dir, last_log_file), 'r') as f:
-            last_line = f.readlines()[-1].strip()
-            last_lat, last_lng = last_line.split(',')[1:3]
-            logger.debug(f"Last saved coordinates: Latitude: {last_lat}, Longitude: {last_lng}")
-
-            if str(lat) == last_lat and str(lng) == last_lng:
-                logger.warning("Received coordinates are the same as the previous ones. Skipping logging.")
-                return jsonify({"status": "success", "message": "Duplicate coordinates received"}), 200
-
-    # Call the write_to_log function if logging is enabled
+    try:
+        lat = float(lat)
+        lng = float(lng)
+    except (TypeError, ValueError):
+        logger.error(f"Error: Invalid coordinates lat={lat}, lng={lng}")
+        return jsonify({"error": "Invalid coordinates"}), 400
+
+    if logging_enabled and ingest_sink is None:
+        return jsonify({"error": "This process does not ingest points; send them to the ingest process"}), 503
+
+    # Check for duplicate coordinates against the last accepted point (in memory, shared with MQTT)
+    if sharded_ingest is not None or ingest_sink is None:
+        duplicate = _published_duplicate(mac, lat, lng)
+    elif logging_enabled:
+        duplicate = not last_points.accept(mac, lat, lng)
+    else:
+        duplicate = last_points.is_duplicate(mac, lat, lng)
+    if duplicate:
+        logger.warning("Received coordinates are the same as the previous ones. Skipping logging.")
+        return jsonify({"status": "success", "message": "Duplicate coordinates received"}), 200
     if logging_enabled:
         logger.info("Logging is enabled, writing data to log.")
         write_to_log(mac, lat, lng)
@@ -352,6 +537,90 @@ def receive_gps():
     return jsonify({"status": "success", "message": "Data received and processed"}), 200
 
 
+def _published_duplicate(mac, lat, lng):
+    """
+    Duplicate check of the HTTP path when the last accepted points live in other processes (shard workers,
+    or the ingest process when this one does not ingest).
+
+    The newest position in the latest table is the worker's last accepted point or a
+    duplicate of it, so it stands in for it; a device the table does not know is
+    compared with its newest stored point, as ``last_points`` seeds it. The owning
+    worker still applies its own check to what is written.
+    """
+    current = latest_table.get(mac)
+    if current is not None:
+        last = (current['lat'], current['lng'])
+    else:
+        latest = storage.latest(mac)
+        if latest is None:
+            return False
+        last = latest[1:]
+    return haversine(last[0], last[1], lat, lng) < DUPLICATE_DISTANCE_METERS
+
+
+@app.route('/gps/batch', methods=['POST'])
+def receive_gps_batch():
+    logger.debug("Function: receive_gps_batch() called")
+
+    # JSON array or NDJSON of {"mac", "latitude", "longitude", "timestamp"} items
+    try:
+        items = parse_batch_body(request.get_data(), request.content_type or '')
+    except BatchError as e:
+        logger.error(f"Error: Could not parse batch: {e}")
+        return jsonify({"error": str(e)}), 400
+
+    if not items:
+        return jsonify({"error": "No data received"}), 400
+    if len(items) > BATCH_MAX_POINTS:
+        logger.error(f"Error: Batch of {len(items)} points exceeds limit of {BATCH_MAX_POINTS}")
+        return jsonify({"error": f"Batch exceeds {BATCH_MAX_POINTS} points"}), 413
+
+    records, statuses = prepare_batch(items, default_mac=request.args.get('mac'),
+                                      duplicate_meters=DUPLICATE_DISTANCE_METERS)
+    logger.debug(f"Batch of {len(items)} items, {len(records)} accepted")
+
+    if records and ingest_sink is None:
+        return jsonify({"error": "This process does not ingest points; send them to the ingest process"}), 503
+    if records:
+        # One synchronous write and one fsync per file for the whole batch; under sharded
+        # ingest write_many returns once every worker involved has committed its part
+        try:
+            (sharded_ingest or storage).write_many(records, fsync=True)
+        except Exception as e:
+            logger.exception("Error writing batch")
+            return jsonify({"error": "Error writing batch"}), 500
+
+        if sharded_ingest is None:
+            # Shard workers publish their own devices; otherwise publish the newest point here
+            newest = {}
+            for timestamp, lat, lng, mac in records:
+                newest[mac] = (timestamp, lat, lng)
+            for mac, (timestamp, lat, lng) in newest.items():
+                epoch = calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+                try:
+                    current = latest_table.get(mac)
+                    if current is None or current['epoch'] <= epoch:
+                        latest_table.update(mac, lat, lng, epoch)
+                        # Live points after the batch are compared with its newest point
+                        last_points.accept(mac, lat, lng, epoch)
+                except Exception:
+                    logger.exception(f"Could not publish the live position of {mac}")
+            live_broadcaster.notify()
+
+    counts = {}
+    for status in statuses:
+        counts[status['status']] = counts.get(status['status'], 0) + 1
+
+    logger.info(f"Batch processed: {counts}")
+    return jsonify({
+        "status": "success",
+        "accepted": counts.get(STATUS_OK, 0),
+        "duplicates": counts.get(STATUS_DUPLICATE, 0),
+        "invalid": counts.get(STATUS_INVALID, 0),
+        "items": statuses
+    }), 200
+
+
 def filter_coords(new_coord, last_coord, threshold_lat=0.000000009, threshold_lng=0.000000009):
     """
     Filters out coordinates that haven't changed significantly (based on a threshold in degrees).
@@ -374,76 +643,514 @@ def filter_coords(new_coord, last_coord, threshold_lat=0.000000009, threshold_ln
 
 from datetime import datetime
 
+def _epoch(timestamp):
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+
+
+def _time_arg(value):
+    # Query strings are always text; accept epoch seconds as well as ISO 8601
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    return _epoch(parse_timestamp(value, None))
+
+
+def _time_window(date_filter):
+    """
+    Resolve the ``from``/``to`` (or ``start``/``end``) query parameters into ``[(day, start, end)]`` epoch windows.
+
+    Either bound may be omitted: ``from`` alone runs to now, ``to`` alone starts at
+    midnight of its day. Without both, the window is the whole of ``date_filter``.
+
+    :raises ValueError: if a bound cannot be parsed, ``from`` is after ``to`` or the
+                        window spans more than ``COORDS_MAX_DAYS`` days
+    """
+    start_arg = request.args.get('from') or request.args.get('start')
+    end_arg = request.args.get('to') or request.args.get('end')
+    if not start_arg and not end_arg:
+        start = _epoch(f'{date_filter} 00:00:00')
+        return [(date_filter, start, start + 86400)]
+
+    end = _time_arg(end_arg) if end_arg else int(time.time()) + 1
+    if start_arg:
+        start = _time_arg(start_arg)
+    else:
+        start = end - (end % 86400)
+    if start > end:
+        raise ValueError("'from' must not be after 'to'")
+    if (max(end, start + 1) - 1) // 86400 - start // 86400 >= COORDS_MAX_DAYS:
+        raise ValueError(f"The window spans more than {COORDS_MAX_DAYS} days")
+
+    windows = []
+    day_start = start - (start % 86400)
+    while day_start < end:
+        day = time.strftime('%Y-%m-%d', time.gmtime(day_start))
+        windows.append((day, max(start, day_start), min(end, day_start + 86400)))
+        day_start += 86400
+    return windows
+
+
+def _since_windows(day, live):
+    """
+    Whole-day windows a ``since`` cursor covers: its own day and, for a live cursor, every day up to today.
+
+    :raises ValueError: if a live cursor would cover more than ``COORDS_MAX_DAYS`` days
+    """
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    day_start = _epoch(f'{day} 00:00:00')
+    last = _epoch(f'{today} 00:00:00') if live and today > day else day_start
+    if (last - day_start) // 86400 >= COORDS_MAX_DAYS:
+        raise ValueError(f"cursor is more than {COORDS_MAX_DAYS} days old; request the track again without 'since'")
+    windows = []
+    while day_start <= last:
+        windows.append((time.strftime('%Y-%m-%d', time.gmtime(day_start)), day_start, day_start + 86400))
+        day_start += 86400
+    return windows
+
+
+def _simplify_args():
+    """
+    Read ``tolerance_m`` or ``zoom`` from the query string.
+
+    :return: ``('tolerance', metres)``, ``('zoom', level)`` or None when no simplification is asked for
+    :raises ValueError: if the value is out of range
+    """
+    if request.args.get('tolerance_m'):
+        tolerance = float(request.args['tolerance_m'])
+        if not tolerance >= 0:
+            raise ValueError("tolerance_m must be a non-negative number of metres")
+        return 'tolerance', tolerance
+    if request.args.get('zoom'):
+        zoom = int(request.args['zoom'])
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+        return 'zoom', zoom
+    return None
+
+
+def _tolerance(simplify, lat):
+    kind, value = simplify
+    return value if kind == 'tolerance' else float(zoom_tolerance(value, lat))
+
+
+def _simplified_positions(mac, day, start, end, track, positions, simplify):
+    """Reduce window positions to the vertices that survive simplification; cached per window and tolerance."""
+    if simplify is None or len(positions) < 3:
+        return positions
+    tolerance = _tolerance(simplify, float(latitudes(track[positions[:1]])[0]))
+
+    def compute():
+        window = track[positions]
+        return positions[rdp_mask(latitudes(window), longitudes(window), tolerance)]
+
+    # The record count changes with every append, so a growing day never hits a stale entry
+    source = ('coords', mac.replace(':', '-').upper(), day, start, end, len(track))
+    return simplify_cache.get_or_compute(source, tolerance, compute)
+
+
+def _response_format():
+    """Format negotiated from ``?format=`` or the Accept header; raises ValueError for an unknown ``format``."""
+    return wireformat.negotiate(request.args.get('format'), request.accept_mimetypes)
+
+
+def _track_response(fmt, epochs, lat_e7, lng_e7, headers=None, macs=None):
+    """Encode a track in ``fmt`` and gzip it when the client accepts that."""
+    body, mimetype = wireformat.render(fmt, epochs, lat_e7, lng_e7, macs=macs)
+    body, encoding = wireformat.compress(body, request.accept_encodings)
+    response = Response(body, mimetype=mimetype, headers=headers)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def _stream_coords(points, mac_keys, tag_mac):
+    """Serialize the ``(day, chunk)`` pairs of ``trackquery.merged_points`` as one JSON array, a chunk at a time."""
+    yield '['
+    first = True
+    count = 0
+    try:
+        for _, chunk in points:
+            if not len(chunk):
+                continue
+            columns = (latitudes(chunk).tolist(), longitudes(chunk).tolist(), timestamps(chunk).tolist())
+            if tag_mac:
+                macs = [mac_keys[index].replace('-', ':') for index in chunk['mac'].tolist()]
+                items = [{'lat': lat, 'lng': lng, 'timestamp': stamp, 'mac': mac}
+                         for lat, lng, stamp, mac in zip(*columns, macs)]
+            else:
+                items = [{'lat': lat, 'lng': lng, 'timestamp': stamp} for lat, lng, stamp in zip(*columns)]
+            body = json.dumps(items, separators=(',', ':'))[1:-1]
+            yield body if first else ',' + body
+            first = False
+            count += len(chunk)
+    except Exception:
+        # The status is already sent; leave the array unterminated so no client takes it for the whole track
+        logger.exception(f"Failed after streaming {count} coordinates")
+        return
+    yield ']'
+    logger.debug(f"Streamed {count} coordinates")
+
+
 @app.route('/api/coords')
 def get_coords():
     logger.debug("Function: get_coords()")
 
-    # Extract MAC and optional date from query parameters
-    mac = request.args.get('mac')
+    # One MAC or a comma-separated list, and a date or a from/to (start/end) window
+    try:
+        macs = _mac_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     date_filter = request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
 
     logger.debug(f"Request arguments: {request.args}")
-    logger.debug(f"Received MAC: {mac}, Date Filter: {date_filter}")
+    logger.debug(f"Received MACs: {macs}, Date Filter: {date_filter}")
 
-    if not mac:
+    if not macs:
         logger.error("Error: No MAC address provided")
         return jsonify({"error": "MAC address is required"}), 400
+    if len(macs) > COORDS_MAX_MACS:
+        return jsonify({"error": f"At most {COORDS_MAX_MACS} MAC addresses per request"}), 400
+    mac_keys = sorted({mac_to_file_key(mac) for mac in macs})
+    tag_mac = len(mac_keys) > 1
 
-    log_dir = './logs'
-    os.makedirs(log_dir, exist_ok=True)
+    try:
+        windows = _time_window(date_filter)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid time window: {e}"}), 400
+
+    # Optional paging: at most `limit` points, continuing from an opaque `cursor`
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= COORDS_MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {COORDS_MAX_LIMIT}"}), 400
+    cursor = None
+    if request.args.get('cursor'):
+        try:
+            cursor = trackquery.decode_cursor(request.args['cursor'])
+        except ValueError as e:
+            return jsonify({"error": f"Invalid cursor: {e}"}), 400
+    try:
+        simplify = _simplify_args()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid simplification: {e}"}), 400
+    try:
+        fmt = _response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if tag_mac and fmt in (wireformat.FORMAT_POLYLINE, wireformat.FORMAT_BINARY):
+        return jsonify({"error": f"The {fmt} format holds a single device; request one MAC"}), 400
+
+    # Incremental polling: `since` returns only the records appended after a previous response
+    since = None
+    if request.args.get('since'):
+        if limit is not None or cursor is not None or simplify is not None:
+            return jsonify({"error": "since cannot be combined with limit, cursor, tolerance_m or zoom"}), 400
+        try:
+            since = trackquery.decode_since(request.args['since'])
+            windows = _since_windows(since[0], since[1])
+        except ValueError as e:
+            return jsonify({"error": f"Invalid since cursor: {e}"}), 400
+
+    # Complete, unsimplified answers carry a cursor for the next `since` request. The record
+    # counts are taken before loading so a point appended meanwhile goes to the next delta.
+    counts = None
+    counts_day = windows[-1][0]
+
+    def refine(mac_key, day, start, end, track, positions):
+        if since is not None and day == since[0]:
+            positions = positions[positions >= since[2].get(mac_key, 0)]
+        if counts is not None and day == counts_day:
+            positions = positions[positions < counts[mac_key]]
+        # Simplify each device-day window before merging and paging so every page comes from the same line
+        return _simplified_positions(mac_key, day, start, end, track, positions, simplify)
 
     try:
-        # Create the log file prefix using the provided date (or today's date by default)
-        file_prefix = f'gps_log_{mac.replace(":", "-").upper()}_{date_filter}_'
+        if limit is None and cursor is None and simplify is None:
+            counts = trackquery.record_counts(storage, mac_keys, counts_day)
+
+        # Device-days are loaded on the query pool and merged in time order, one day at a time; without
+        # anything to refine, a cursor lets the device-days skip locating what lies before it
+        refined = since is not None or counts is not None or simplify is not None
+        if limit is not None:
+            load_limit = limit + 1
+        elif fmt != wireformat.FORMAT_OBJECTS:
+            load_limit = COORDS_MAX_LIMIT + 1  # enough to tell that the response would be too large
+        else:
+            load_limit = None
+        points = trackquery.merged_points(storage, query_executor, mac_keys, windows, refine if refined else None,
+                                          cursor, limit=load_limit, chunk_size=COORDS_CHUNK_SIZE)
+        headers = {}
+        if counts is not None:
+            live = counts_day >= datetime.utcnow().strftime('%Y-%m-%d')
+            headers['X-Since-Cursor'] = trackquery.encode_since(counts_day, live, counts)
+        if limit is not None:
+            page, following = trackquery.take(points, limit)
+            if following is not None:
+                day, point = following
+                headers['X-Next-Cursor'] = trackquery.encode_cursor(day, trackquery.point_key(mac_keys, point))
+            points = iter(page)
+
+        if fmt != wireformat.FORMAT_OBJECTS:
+            # Compact formats are a handful of numeric columns built in one go, so they are capped like a page
+            chunks = [np.zeros(0, dtype=trackquery.MERGED_DTYPE)]
+            total = 0
+            for _, chunk in points:
+                chunks.append(chunk)
+                total += len(chunk)
+                if total > COORDS_MAX_LIMIT:
+                    return jsonify({"error": f"More than {COORDS_MAX_LIMIT} points; request pages with limit "
+                                             f"and cursor"}), 413
+            merged = np.concatenate(chunks)
+            logger.debug(f"Returning {len(merged)} coordinates for {mac_keys} as {fmt}")
+            tags = [mac_keys[index].replace('-', ':') for index in merged['mac'].tolist()] if tag_mac else None
+            return _track_response(fmt, merged['t'], merged['lat'], merged['lng'], headers, macs=tags)
+
+        # Load the first day before answering, so its errors still become an error response
+        head = next(points, None)
+        if head is not None:
+            points = chain([head], points)
+        response = Response(_stream_coords(points, mac_keys, tag_mac), mimetype='application/json', headers=headers)
+        response.vary.add('Accept')
+        return response
 
-        # Find all log files for this MAC and date
-        session_files = sorted([
-            f for f in os.listdir(log_dir)
-            if f.startswith(file_prefix) and f.endswith('.txt')
-        ])
+    except Exception as e:
+        logger.error(f"Unexpected error in get_coords(): {e}")
+        return jsonify({"error": "An error occurred while processing the request"}), 500
 
-        logger.debug(f"Session files found for {mac} on {date_filter}: {session_files}")
 
-        if not session_files:
-            logger.warning(f"No session files found for MAC {mac} on {date_filter}.")
-            return jsonify([])
+def _coordinate_list(value, name):
+    """Parse ``lat,lng;lat,lng;...`` into ``[(lat, lng), ...]``; raises ValueError when malformed or out of range."""
+    vertices = []
+    for pair in value.split(';'):
+        parts = pair.split(',')
+        if len(parts) != 2:
+            raise ValueError(f"'{name}' must be a list of lat,lng pairs separated by ';'")
+        lat, lng = float(parts[0]), float(parts[1])
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError(f"Coordinates out of range in '{name}'")
+        vertices.append((lat, lng))
+    return vertices
 
-        coords = []
 
-        for log_file in session_files:
-            logger.debug(f"Processing file: {log_file}")
-            try:
-                with open(os.path.join(log_dir, log_file), 'r') as f:
-                    for line in f:
-                        line = line.strip()
-                        parts = line.split(',')
-
-                        if len(parts) >= 4 and parts[3] == mac:
-                            try:
-                                lat = float(parts[1])
-                                lng = float(parts[2])
-                                timestamp = parts[0]  # Use original timestamp from file
-
-                                coords.append({
-                                    'lat': lat,
-                                    'lng': lng,
-                                    'timestamp': timestamp
-                                })
-                                logger.debug(f"Coordinates added: lat={lat}, lng={lng}, timestamp={timestamp}")
-                            except ValueError as e:
-                                logger.error(f"Invalid coordinates in line: {line}. Error: {e}")
-                                continue
-                        else:
-                            logger.debug(f"Skipping line: {line}")
-            except Exception as e:
-                logger.error(f"Error reading file {log_file}: {e}")
-
-        logger.debug(f"Total coordinates collected for MAC {mac}: {len(coords)}")
-        return jsonify(coords)
+@app.route('/api/search/area')
+def search_area():
+    """
+    Devices that had points inside an area during a time window.
+
+    The area is ``bbox=min_lat,min_lng,max_lat,max_lng`` or ``polygon=lat,lng;lat,lng;...``
+    (at least three vertices); the window is ``from``/``to`` (or ``start``/``end``),
+    defaulting to the whole of ``date``. Each device is reported with the number of
+    its points inside and the first and last of them.
+    """
+    date_filter = request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
+    polygon = None
+    try:
+        if request.args.get('polygon'):
+            polygon = _coordinate_list(request.args['polygon'], 'polygon')
+            if len(polygon) < 3:
+                raise ValueError("'polygon' needs at least three vertices")
+            lats, lngs = zip(*polygon)
+            box = (min(lats), min(lngs), max(lats), max(lngs))
+        elif request.args.get('bbox'):
+            box = tuple(float(v) for v in request.args['bbox'].split(','))
+            if len(box) != 4 or not (-90 <= box[0] <= box[2] <= 90 and -180 <= box[1] <= box[3] <= 180):
+                raise ValueError("'bbox' must be min_lat,min_lng,max_lat,max_lng")
+        else:
+            return jsonify({"error": "Either 'bbox' or 'polygon' is required"}), 400
+        windows = _time_window(date_filter)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start, end = windows[0][1], windows[-1][2]
+    started = time.perf_counter()
+    devices = []
+    for mac_key, track in storage.points_in_bbox(*box, start, end).items():
+        if polygon is not None:
+            track = track[points_in_polygon(track, polygon)]
+        if not len(track):
+            continue
+        first, last = timestamps(track[[0, -1]]).tolist()
+        devices.append({'mac': mac_key.replace('-', ':'), 'points': len(track), 'first': first, 'last': last})
+    logger.debug(f"Area search over {len(windows)} days found {len(devices)} devices "
+                 f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return jsonify({'start': start, 'end': end, 'devices': devices})
+
+
+@app.route('/api/summary')
+def get_summary():
+    """
+    Daily summaries of devices over a range of days, with totals per device and for the fleet.
+
+    ``mac`` takes a comma-separated list; without it every device with points in the
+    range is reported. The range is the UTC days touched by ``start``/``end`` (or
+    ``from``/``to``), defaulting to ``date``. Summaries are maintained at ingest, so
+    this never reads the stored points.
+    """
+    date_filter = request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
+    try:
+        macs = _mac_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if len(macs) > COORDS_MAX_MACS:
+        return jsonify({"error": f"At most {COORDS_MAX_MACS} MAC addresses per request"}), 400
+    try:
+        windows = _time_window(date_filter)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    days = {day for day, _, _ in windows}
+    wanted = {mac_to_file_key(mac) for mac in macs}
+    device_days = {}
+    for mac_key, day in storage.device_days():
+        if day in days and (not wanted or mac_key in wanted):
+            device_days.setdefault(mac_key, []).append(day)
+
+    devices = []
+    for mac_key, mac_days in sorted(device_days.items()):
+        summaries = [dict(day=day, **storage.summary(mac_key, day)) for day in mac_days]
+        devices.append({'mac': mac_key.replace('-', ':'), 'days': summaries, 'total': combine_summaries(summaries)})
+    return jsonify({
+        'start': windows[0][1],
+        'end': windows[-1][2],
+        'devices': devices,
+        'total': combine_summaries([device['total'] for device in devices]),
+    })
 
-    except Exception as e:
-        logger.error(f"Unexpected error in get_coords(): {e}")
-        return jsonify({"error": "An error occurred while processing the request"}), 500
+
+@app.route('/api/heatmap')
+def get_heatmap():
+    """
+    Point density inside ``bbox=min_lat,min_lng,max_lat,max_lng`` at map ``zoom``, over devices and days.
+
+    Whole days are served from the per-day grids kept at ingest and added up cell by
+    cell; only the partial first and last day of a ``start``/``end`` (or ``from``/``to``)
+    window read points. ``mac`` optionally restricts the map to a comma-separated list
+    of devices. Only non-empty cells are returned, as ``[lat, lng, count]`` of their centre.
+    """
+    date_filter = request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
+    try:
+        macs = _mac_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if len(macs) > COORDS_MAX_MACS:
+        return jsonify({"error": f"At most {COORDS_MAX_MACS} MAC addresses per request"}), 400
+    try:
+        zoom = int(request.args.get('zoom', HEAT_LEVELS[-1]))
+        box = tuple(float(v) for v in request.args.get('bbox', '-90,-180,90,180').split(','))
+        if len(box) != 4 or not (-90 <= box[0] <= box[2] <= 90 and -180 <= box[1] <= box[3] <= 180):
+            raise ValueError("'bbox' must be min_lat,min_lng,max_lat,max_lng")
+        windows = _time_window(date_filter)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    level = heat_level(zoom)
+    wanted = {mac_to_file_key(mac) for mac in macs}
+    grids = []
+    for day, start, end in windows:
+        for mac_key in storage.devices_for_day(day):
+            if wanted and mac_key not in wanted:
+                continue
+            if end - start == 86400:
+                cells = storage.heat_grid(mac_key, day)
+            else:
+                cells = heat_cells(storage.read_range(mac_key, day, start, end), levels=(level,))
+            grids.append(cells_in_box(cells, level, *box))
+    cells = merge_cells(grids)
+    lat, lng = cell_centers(cells)
+    return jsonify({
+        'start': windows[0][1],
+        'end': windows[-1][2],
+        'zoom': zoom,
+        'level': level,
+        'cell_degrees': cell_degrees(level),
+        'points': int(cells['count'].sum()),
+        'max': int(cells['count'].max()) if len(cells) else 0,
+        # Rows built from Python values so the counts stay integers in the JSON
+        'cells': [[lat, lng, count] for lat, lng, count in
+                  zip(lat.round(6).tolist(), lng.round(6).tolist(), cells['count'].tolist())],
+    })
+
+
+def _analysis_track(mac):
+    """
+    Time-ordered points of ``mac`` in the window given by ``date`` or ``from``/``to`` (``start``/``end``).
+
+    :raises ValueError: if the window cannot be parsed
+    """
+    windows = _time_window(request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d')))
+    tracks = [storage.read_range(mac, day, start, end) for day, start, end in windows]
+    return analysis.time_ordered(np.concatenate(tracks)) if tracks else EMPTY_TRACK
+
+
+@app.route('/api/analysis/speed')
+def get_speed_analysis():
+    """
+    Speed-coloured polylines of a device's track, ready to draw.
+
+    Consecutive segments in the same speed band are merged into one multi-vertex
+    polyline. With ``series=1`` the speed of every segment is returned as well,
+    keyed by the time of the fix it ends at (null where two fixes share a timestamp).
+    """
+    mac = request.args.get('mac', '').strip()
+    if not mac:
+        return jsonify({"error": "MAC address is required"}), 400
+    try:
+        mac = normalize_mac(mac)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        track = _analysis_track(mac)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    polylines = [
+        {'band': band, 'color': analysis.SPEED_BANDS[band][1], 'coords': np.column_stack([lat, lng]).tolist()}
+        for band, lat, lng in analysis.speed_polylines(track)
+    ]
+    result = {'mac': mac, 'points': len(track), 'bands': analysis.band_legend(), 'polylines': polylines}
+    if request.args.get('series') in ('1', 'true'):
+        speeds = analysis.segment_speeds(track) if len(track) > 1 else np.zeros(0)
+        result['series'] = {
+            'timestamps': timestamps(track[1:]).tolist(),
+            'speed_kmh': [None if np.isnan(v) else round(v, 2) for v in speeds.tolist()],
+        }
+    return jsonify(result)
+
+
+@app.route('/api/analysis/stops')
+def get_stop_analysis():
+    """
+    Stay points of a device: one entry per place it stayed within ``radius`` metres for at least ``min_dwell`` seconds.
+
+    Each stop has its centroid, ``arrival``/``departure`` (epoch seconds), ``dwell_s``
+    and point count; ``ongoing`` marks a stop the device has not left yet, so only a
+    window that runs up to now can have one. Whole days with the default settings are
+    served from the detectors run at ingest, joined across midnight.
+    """
+    mac = request.args.get('mac', '').strip()
+    if not mac:
+        return jsonify({"error": "MAC address is required"}), 400
+    try:
+        mac = normalize_mac(mac)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        radius = float(request.args.get('radius', analysis.STOP_RADIUS_METERS))
+        min_dwell = int(request.args.get('min_dwell', analysis.STOP_MIN_DWELL_SECONDS))
+        if radius <= 0 or min_dwell < 0:
+            raise ValueError("'radius' must be positive and 'min_dwell' not negative")
+        windows = _time_window(request.args.get('date', datetime.utcnow().strftime('%Y-%m-%d')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    ongoing = windows[-1][2] >= time.time()
+    whole_days = all(end - start == 86400 for _, start, end in windows)
+    if whole_days and (radius, min_dwell) == (analysis.STOP_RADIUS_METERS, analysis.STOP_MIN_DWELL_SECONDS):
+        stops = analysis.stitch_stops([storage.stop_detector(mac, day) for day, _, _ in windows], ongoing)
+    else:
+        stops = analysis.detect_stops(_analysis_track(mac), radius, min_dwell, ongoing)
+    return jsonify({'mac': mac, 'radius_m': radius, 'min_dwell_s': min_dwell, 'stops': stops})
 
 
 @app.route('/routes')
@@ -509,9 +1216,41 @@ def load_route(name):
     path = os.path.join(ROUTES_DIR, f'{name}.json')
     if not os.path.exists(path):
         return "Route not found", 404
+    try:
+        simplify = _simplify_args()
+        fmt = _response_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     with open(path, 'r') as f:
         coords = json.load(f)
-    return jsonify(coords)
+
+    if simplify is not None and len(coords) >= 3:
+        lats = [float(c['lat']) for c in coords]
+        lngs = [float(c['lng']) for c in coords]
+        tolerance = _tolerance(simplify, lats[0])
+        keep = simplify_cache.get_or_compute(('route', name, os.stat(path).st_mtime_ns), tolerance,
+                                             lambda: rdp_mask(lats, lngs, tolerance))
+        coords = [c for c, kept in zip(coords, keep.tolist()) if kept]
+
+    if fmt == wireformat.FORMAT_OBJECTS:
+        # Saved routes are returned as recorded, including the browser's millisecond timestamps
+        return jsonify(coords)
+    epochs = [_route_epoch(c.get('timestamp')) for c in coords]
+    lat_e7 = np.rint(np.array([float(c['lat']) for c in coords]) * COORD_SCALE).astype(np.int32)
+    lng_e7 = np.rint(np.array([float(c['lng']) for c in coords]) * COORD_SCALE).astype(np.int32)
+    return _track_response(fmt, epochs, lat_e7, lng_e7)
+
+
+def _route_epoch(timestamp):
+    # Routes are recorded in the browser with Date.now(); older files may hold log-style strings
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        return int(timestamp // 1000 if timestamp > 1e11 else timestamp)
+    if isinstance(timestamp, str):
+        try:
+            return _epoch(parse_timestamp(timestamp, None))
+        except ValueError:
+            pass
+    return 0
 
 
 @app.route('/routes/delete/<name>', methods=['DELETE'])
@@ -526,7 +1265,7 @@ def delete_route(name):
 def start_mqtt():
     client = mqtt.Client()
     client.on_connect = on_connect
-    client.on_message = on_message
+    client.on_message = sharded_ingest.on_message if sharded_ingest else on_message
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
     client.loop_forever()
 
@@ -582,14 +1321,23 @@ def health_check():
         "status": "ok",
         "mqtt_connected": True,  # Could be tracked via global flag
         "routes_count": len(os.listdir(ROUTES_DIR)),
-        "log_files": len(os.listdir('./logs'))
+        "storage": storage.stats(),
+        "compaction": compactor.stats() if compactor else None,
+        "ingest_role": bool(ingest_role),
+        "write_queue": write_queue.stats() if write_queue else None,
+        "ingest_shards": sharded_ingest.stats() if sharded_ingest else None,
+        "parsed_cache": parsed_cache.stats(),
+        "log_table_cache": log_day_cache.stats(),
+        "live_stream_subscribers": live_broadcaster.subscriber_count()
     })
 
-mqtt_thread = threading.Thread(target=start_mqtt)
-mqtt_thread.daemon = True
-mqtt_thread.start()
+if MQTT_ENABLED and ingest_role:
+    mqtt_thread = threading.Thread(target=start_mqtt)
+    mqtt_thread.daemon = True
+    mqtt_thread.start()
 
 if __name__ == '__main__':
     logger.debug("Function: main()")
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    # No reloader: its monitor process imports this module too and would take the ingest role
+    app.run(host='0.0.0.0', port=port, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,153 @@
+# areaindex.py
+import logging
+import os
+
+import numpy as np
+
+from daysidecar import DaySidecars, points_by_day, sidecar_file_name, utc_today
+from trackstore import COORD_SCALE, day_start_epoch, to_records
+
+logger = logging.getLogger(__name__)
+
+AREA_INDEX_SUFFIX = '.cells'
+AREA_CELL_DEGREES = 0.01  # grid cell edge, about 1.1 km of latitude
+AREA_BUCKET_SECONDS = 600
+AREA_BUCKETS = 86400 // AREA_BUCKET_SECONDS
+_CELL_SIZE = int(round(AREA_CELL_DEGREES * COORD_SCALE))  # cell edge in scaled coordinate units
+CELL_DTYPE = np.dtype([('row', '<i4'), ('col', '<i4'), ('bucket', '<i4')])
+
+
+def area_index_file_name(mac_key, day):
+    return sidecar_file_name(mac_key, day, AREA_INDEX_SUFFIX)
+
+
+def cell_postings(track, day):
+    """Unique ``(row, col, bucket)`` grid cells and time buckets the points of a device-day fall in."""
+    postings = np.empty(len(track), dtype=CELL_DTYPE)
+    postings['row'] = track['lat'] // _CELL_SIZE
+    postings['col'] = track['lng'] // _CELL_SIZE
+    postings['bucket'] = np.clip((track['t'] - day_start_epoch(day)) // AREA_BUCKET_SECONDS, 0, AREA_BUCKETS - 1)
+    return np.unique(postings)
+
+
+def read_cells_tail(path, offset=0):
+    """:return: ``(postings, consumed)`` of an area index file from byte ``offset``"""
+    count = max(0, os.path.getsize(path) - offset) // CELL_DTYPE.itemsize
+    postings = np.fromfile(path, dtype=CELL_DTYPE, count=count, offset=offset)
+    return postings, len(postings) * CELL_DTYPE.itemsize
+
+
+def points_in_polygon(track, polygon):
+    """
+    Mask of the points of ``track`` inside ``polygon`` (even-odd rule).
+
+    :param polygon: Sequence of ``(lat, lng)`` vertices; the last connects back to the first
+    """
+    lat = track['lat'] / COORD_SCALE
+    lng = track['lng'] / COORD_SCALE
+    inside = np.zeros(len(track), dtype=bool)
+    vertices = list(polygon)
+    for (lat1, lng1), (lat2, lng2) in zip(vertices, vertices[1:] + vertices[:1]):
+        crosses = (lat1 > lat) != (lat2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            at = lng1 + (lat - lat1) * (lng2 - lng1) / (lat2 - lat1)
+        inside ^= crosses & (lng < at)
+    return inside
+
+
+class AreaIndex(DaySidecars):
+    """
+    Grid-cell index of where each device was, kept next to the track files.
+
+    The world is cut into ``AREA_CELL_DEGREES`` cells and each day into
+    ``AREA_BUCKET_SECONDS`` buckets. Every device-day has an append-only
+    ``<MAC>_<day>.cells`` file listing the distinct ``(cell, bucket)`` pairs its
+    points fall in, written at ingest by ``add``. An area query
+    (``candidate_windows``) only reads the points of the buckets in which the
+    device was in a cell the area overlaps.
+
+    Device-days written before the index existed get their file built from the
+    points the first time they are queried or written to.
+
+    :param read: ``f(mac_key, day) -> track`` used to build missing files
+    :param cache: Optional ``ParsedFileCache`` keeping index files in memory between queries
+    """
+
+    suffix = AREA_INDEX_SUFFIX
+
+    def __init__(self, tracks_dir, read, cache=None):
+        super().__init__(tracks_dir)  # _open: (mac_key, day) -> set of (row, col, bucket) already in the file
+        self.read = read
+        self.cache = cache
+        self.builds = 0
+
+    def _build(self, mac_key, day):
+        """Create the index file of a device-day from its points, unless another writer got there first."""
+        postings = cell_postings(self.read(mac_key, day), day)
+        if self._create(mac_key, day, postings.tobytes()):
+            self.builds += 1
+            logger.debug(f"Built area index {self.path(mac_key, day)} ({len(postings)} cells)")
+
+    def postings(self, mac_key, day):
+        """The ``(row, col, bucket)`` postings of a device-day, building its file if it has none yet."""
+        path = self.path(mac_key, day)
+        for attempt in range(2):
+            try:
+                if self.cache is not None:
+                    return self.cache.load(path, read_cells_tail)
+                return read_cells_tail(path)[0]
+            except FileNotFoundError:
+                if attempt:
+                    raise
+                self._build(mac_key, day)
+
+    def add(self, records):
+        """
+        Index a batch of ``(timestamp, lat, lng, mac)`` tuples after their points were stored.
+
+        Only pairs a device-day's file does not hold yet are appended; the pairs of the
+        days being written are kept in memory until the day is over.
+        """
+        today = utc_today()
+        with self._lock:
+            for (mac_key, day), points in points_by_day(records).items():
+                known = self._open.get((mac_key, day))
+                if known is None:
+                    known = set(self.postings(mac_key, day).tolist())
+                    self._open[(mac_key, day)] = known
+                new = [p for p in cell_postings(to_records(*zip(*points)), day).tolist() if p not in known]
+                if new:
+                    with open(self.path(mac_key, day), 'ab') as f:
+                        f.write(np.array(new, dtype=CELL_DTYPE).tobytes())
+                    known.update(new)
+            self._close_past_days(today)
+
+    def candidate_windows(self, mac_key, day, min_lat, min_lng, max_lat, max_lng, start, end):
+        """
+        Time windows of a device-day that can hold points inside the box, clipped to ``[start, end)``.
+
+        :return: List of ``(start, end)`` epoch windows, one per run of consecutive candidate buckets
+        """
+        postings = self.postings(mac_key, day)
+        rows = np.floor(np.array([min_lat, max_lat]) * COORD_SCALE / _CELL_SIZE)
+        cols = np.floor(np.array([min_lng, max_lng]) * COORD_SCALE / _CELL_SIZE)
+        day_start = day_start_epoch(day)
+        hit = ((postings['row'] >= rows[0]) & (postings['row'] <= rows[1]) &
+               (postings['col'] >= cols[0]) & (postings['col'] <= cols[1]) &
+               (postings['bucket'] >= (start - day_start) // AREA_BUCKET_SECONDS) &
+               (postings['bucket'] <= (end - 1 - day_start) // AREA_BUCKET_SECONDS))
+        buckets = np.unique(postings['bucket'][hit])
+        if not len(buckets):
+            return []
+
+        # Consecutive buckets become one window so each run is a single range read
+        breaks = np.flatnonzero(np.diff(buckets) > 1)
+        firsts = buckets[np.concatenate([[0], breaks + 1])]
+        lasts = buckets[np.concatenate([breaks, [len(buckets) - 1]])]
+        return [(max(start, day_start + int(first) * AREA_BUCKET_SECONDS),
+                 min(end, day_start + (int(last) + 1) * AREA_BUCKET_SECONDS))
+                for first, last in zip(firsts, lasts)]
+
+    def stats(self):
+        with self._lock:
+            return {'open_days': len(self._open), 'builds': self.builds}
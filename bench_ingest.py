@@ -0,0 +1,272 @@
+# bench_ingest.py
+"""
+Ingest throughput benchmark.
+
+Replays the recorded traces in ``logs/`` and ``gps_log_2025-07-11.txt`` as MQTT
+payloads from N virtual devices at M Hz, feeds them to ``app.on_message``
+(directly, or through an in-process broker stand-in that calls the callback from
+its own network thread like paho's ``loop_forever``) and prints one JSON object
+with sustained msgs/sec, enqueue-to-disk latency percentiles and CPU per message.
+
+    python bench_ingest.py --devices 200 --hz 1 --duration 30
+    python bench_ingest.py --devices 200 --hz 0 --messages 200000 --via broker
+    python bench_ingest.py --devices 200 --hz 0 --messages 200000 --workers 4
+    python bench_ingest.py --devices 200 --hz 0 --messages 200000 --storage sqlite
+
+``--hz 0`` replays as fast as possible to find the saturation point.
+"""
+import argparse
+import atexit
+import glob
+import json
+import logging
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class BenchMessage:
+    """Minimal stand-in for ``paho.mqtt.client.MQTTMessage``."""
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class LocalBroker:
+    """In-process broker stand-in: delivers published messages to a callback from one network thread."""
+
+    def __init__(self, on_message, maxsize=100000):
+        self.on_message = on_message
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._loop, name='bench-broker', daemon=True)
+        self._thread.start()
+
+    def publish(self, topic, payload):
+        self._queue.put(BenchMessage(topic, payload))
+
+    def _loop(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                break
+            self.on_message(self, None, msg)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def load_traces(paths):
+    """Read ``(lat, lng)`` sequences from text logs, one trace per file."""
+    traces = []
+    for path in paths:
+        points = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) < 3:
+                    continue
+                try:
+                    points.append((float(parts[1]), float(parts[2])))
+                except ValueError:
+                    continue
+        if points:
+            traces.append(points)
+    return traces
+
+
+def synthesize_payloads(traces, devices):
+    """
+    Build one payload generator per virtual device.
+
+    Device ``i`` replays trace ``i % len(traces)`` starting at a different offset
+    so devices sharing a trace do not send identical points.
+    """
+    def device_payloads(index):
+        trace = traces[index % len(traces)]
+        mac = f"02:00:00:{(index >> 16) & 0xFF:02X}:{(index >> 8) & 0xFF:02X}:{index & 0xFF:02X}"
+        position = (index * 7919) % len(trace)
+        while True:
+            lat, lng = trace[position]
+            yield json.dumps({"mac": mac, "latitude": lat, "longitude": lng}).encode()
+            position = (position + 1) % len(trace)
+
+    return [device_payloads(i) for i in range(devices)]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _children_cpu(sharded_ingest):
+    """CPU seconds used so far by the ingest worker processes (Linux /proc only)."""
+    if sharded_ingest is None:
+        return 0.0
+    total = 0.0
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    for process in sharded_ingest._processes:
+        try:
+            with open(f'/proc/{process.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+        except (OSError, IndexError, ValueError):
+            pass
+    return total
+
+
+def run(args):
+    data_dir = tempfile.mkdtemp(prefix='bench_ingest_')
+    os.environ['MQTT_ENABLED'] = '0'
+    os.environ['LOGS_DIR'] = os.path.join(data_dir, 'logs')
+    os.environ['TRACKS_DIR'] = os.path.join(data_dir, 'tracks')
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ['SQLITE_PATH'] = os.path.join(data_dir, 'oriiona.db')
+    os.environ['INGEST_WORKERS'] = str(args.workers)
+    os.environ['LATEST_TABLE_NAME'] = f'bench_latest_{os.getpid()}'
+    if args.fsync:
+        os.environ['WRITE_FSYNC'] = args.fsync
+
+    sys.path.insert(0, BASE_DIR)
+    import app
+
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+
+    trace_paths = sorted(glob.glob(os.path.join(BASE_DIR, 'logs', 'gps_log_*.txt')))
+    trace_paths.append(os.path.join(BASE_DIR, 'gps_log_2025-07-11.txt'))
+    traces = load_traces([p for p in trace_paths if os.path.exists(p)])
+    if not traces:
+        raise SystemExit("No traces found to replay")
+    generators = synthesize_payloads(traces, args.devices)
+
+    # Same callback start_mqtt would install
+    on_message = app.sharded_ingest.on_message if app.sharded_ingest else app.on_message
+    sink = app.sharded_ingest or app.write_queue
+
+    broker = LocalBroker(on_message) if args.via == 'broker' else None
+    deliver = (lambda msg: broker.publish(msg.topic, msg.payload)) if broker else \
+        (lambda msg: on_message(None, None, msg))
+
+    total = args.messages or int(args.devices * args.hz * args.duration)
+    tick = 1.0 / args.hz if args.hz else 0.0
+
+    # Pre-build the payloads so JSON encoding is not part of the measurement
+    messages = []
+    while len(messages) < total:
+        for gen in generators:
+            messages.append(BenchMessage(app.MQTT_TOPIC, next(gen)))
+            if len(messages) >= total:
+                break
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    sent = 0
+    next_tick = wall_start
+    per_tick = len(generators)
+    while sent < total:
+        for msg in messages[sent:sent + per_tick]:
+            deliver(msg)
+        sent = min(total, sent + per_tick)
+        if tick:
+            next_tick += tick
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    produce_elapsed = time.perf_counter() - wall_start
+
+    if broker:
+        broker.stop()
+    sink.flush()
+    wall_elapsed = time.perf_counter() - wall_start
+    cpu_elapsed = time.process_time() - cpu_start + _children_cpu(app.sharded_ingest)
+    stats = sink.stats()
+
+    # Shut down in the order atexit would, but before the data directory goes away
+    if app.sharded_ingest:
+        app.sharded_ingest.stop()
+    app.write_queue.stop()
+    if app.compactor:
+        app.compactor.stop()
+    app.storage.close()
+    atexit.unregister(app.storage.close)
+    app.latest_table.unlink()
+    if not args.keep_data:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        'benchmark': 'ingest',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'config': {
+            'devices': args.devices,
+            'hz': args.hz,
+            'messages': total,
+            'via': args.via,
+            'workers': args.workers,
+            'storage': app.STORAGE_BACKEND,
+            'fsync': app.WRITE_FSYNC,
+            'flush_interval_s': app.WRITE_FLUSH_INTERVAL,
+            'traces': len(traces),
+        },
+        'results': {
+            'sent': sent,
+            'written': stats['written'],
+            'dropped': stats.get('dropped', 0),
+            'produce_seconds': round(produce_elapsed, 4),
+            'wall_seconds': round(wall_elapsed, 4),
+            'msgs_per_sec': round(sent / wall_elapsed, 1) if wall_elapsed else 0.0,
+            'latency_p50_ms': round(stats['latency_p50_ms'], 3),
+            'latency_p99_ms': round(stats['latency_p99_ms'], 3),
+            'cpu_us_per_msg': round(cpu_elapsed / sent * 1e6, 2) if sent else 0.0,
+            'batches': stats.get('batches'),
+            'avg_commit_ms': round(stats['avg_commit_ms'], 3) if 'avg_commit_ms' in stats else None,
+            'max_queue_depth': stats.get('max_queue_depth'),
+        },
+        'data_dir': data_dir if args.keep_data else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded GPS traces through on_message and measure ingest")
+    parser.add_argument('--devices', type=int, default=200, help="Number of virtual devices")
+    parser.add_argument('--hz', type=float, default=1.0, help="Messages per second per device, 0 = unpaced")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of traffic to generate when paced")
+    parser.add_argument('--messages', type=int, default=0, help="Total messages (overrides devices*hz*duration)")
+    parser.add_argument('--via', choices=['direct', 'broker'], default='direct',
+                        help="Call on_message directly or through the in-process broker stand-in")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Ingest worker processes (INGEST_WORKERS), 0 = in-process writer thread")
+    parser.add_argument('--storage', choices=['files', 'sqlite'], default='files',
+                        help="Storage backend (STORAGE_BACKEND) the points are committed to")
+    parser.add_argument('--fsync', choices=['never', 'batch', 'interval'], help="Override WRITE_FSYNC")
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--keep-data', action='store_true', help="Keep the temporary logs/tracks directory")
+    parser.add_argument('--output', help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    if not args.messages and not args.hz:
+        parser.error("--hz 0 needs --messages")
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# compaction.py
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Compactor:
+    """
+    Background job that compacts the closed days of a storage backend.
+
+    Every ``interval`` seconds it asks the storage which device-days before the
+    cutoff still need compacting and compacts them one at a time. A day becomes
+    eligible ``grace`` seconds after its UTC midnight, which leaves late points
+    and open handles time to settle. Progress lives in the files themselves, so
+    a job that is stopped or crashes simply continues on its next run.
+
+    :param storage: Storage backend; backends without anything to compact are left alone
+    :param interval: Seconds between runs
+    :param grace: Seconds after the end of a UTC day before it is compacted
+    """
+
+    def __init__(self, storage, interval=3600, grace=3600):
+        self.storage = storage
+        self.interval = interval
+        self.grace = grace
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'runs': 0, 'compacted': 0, 'points_read': 0, 'points_kept': 0, 'errors': 0,
+                       'last_run_ms': 0.0}
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='compactor', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def run_once(self):
+        """Compact every eligible device-day now; returns the number compacted."""
+        started = time.perf_counter()
+        cutoff = time.strftime('%Y-%m-%d', time.gmtime(time.time() - self.grace))
+        compacted = 0
+        try:
+            pending = self.storage.pending_compaction(cutoff)
+        except Exception:
+            logger.exception("Could not list the days to compact")
+            pending = []
+            self._count('errors')
+        for mac_key, day in pending:
+            if self._stop.is_set():
+                break
+            try:
+                points_read, points_kept = self.storage.compact(mac_key, day)
+            except Exception:
+                logger.exception(f"Failed to compact {mac_key} {day}")
+                self._count('errors')
+                continue
+            compacted += 1
+            self._count('compacted')
+            self._count('points_read', points_read)
+            self._count('points_kept', points_kept)
+
+        with self._stats_lock:
+            self._stats['runs'] += 1
+            self._stats['last_run_ms'] = (time.perf_counter() - started) * 1000
+        return compacted
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
@@ -0,0 +1,78 @@
+# daysidecar.py
+import os
+import threading
+from datetime import datetime
+
+from logwriter import mac_to_file_key
+
+
+def sidecar_file_name(mac_key, day, suffix):
+    return f'{mac_key}_{day}{suffix}'
+
+
+def utc_today():
+    return datetime.utcnow().strftime('%Y-%m-%d')
+
+
+def points_by_day(records):
+    """Group ``(timestamp, lat, lng, mac)`` tuples into ``{(mac_key, day): [(timestamp, lat, lng)]}``."""
+    by_day = {}
+    for timestamp, lat, lng, mac in records:
+        by_day.setdefault((mac_to_file_key(mac), timestamp[:10]), []).append((timestamp, lat, lng))
+    return by_day
+
+
+class DaySidecars:
+    """
+    Files derived from the points of one device-day, kept as ``<MAC>_<day><suffix>`` next to the track files.
+
+    Subclasses set ``suffix`` and keep whatever they need about the days being
+    written in ``_open``, keyed by ``(mac_key, day)`` and guarded by ``_lock``;
+    ``_close_past_days`` drops the entries of the days that are over.
+    """
+
+    suffix = None
+
+    def __init__(self, tracks_dir):
+        self.tracks_dir = tracks_dir
+        self._lock = threading.Lock()
+        self._open = {}
+
+        os.makedirs(tracks_dir, exist_ok=True)
+
+    def path(self, mac_key, day):
+        return os.path.join(self.tracks_dir, sidecar_file_name(mac_key, day, self.suffix))
+
+    def _tmp_path(self, path):
+        return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+    def _replace(self, mac_key, day, data):
+        """Write a whole sidecar; readers see either the old file or the new one."""
+        path = self.path(mac_key, day)
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _create(self, mac_key, day, data):
+        """
+        Write a whole sidecar unless the device-day already has one.
+
+        :return: True if this call created the file, False if another writer got there first
+        """
+        path = self.path(mac_key, day)
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def _close_past_days(self, today):
+        """Forget the days being written that are not ``today``; call with ``_lock`` held."""
+        for key in [k for k in self._open if k[1] != today]:
+            del self._open[key]
@@ -0,0 +1,113 @@
+# daystops.py
+import json
+import os
+
+from analysis import StayPointDetector, time_ordered, STOP_RADIUS_METERS, STOP_MIN_DWELL_SECONDS
+from daysidecar import DaySidecars, points_by_day, sidecar_file_name, utc_today
+
+STOPS_FILE_SUFFIX = '.stops'
+STOPS_CHECKPOINT_POINTS = 1000  # fixes fed since the last checkpoint before the state is saved anyway
+
+
+def stops_file_name(mac_key, day):
+    return sidecar_file_name(mac_key, day, STOPS_FILE_SUFFIX)
+
+
+class DayStopFiles(DaySidecars):
+    """
+    Stay points of every device-day, detected at ingest and checkpointed in ``<MAC>_<day>.stops`` sidecars.
+
+    ``add`` runs after a batch is stored and feeds the fixes appended since the
+    detector last ran, so the stops of the current day are always up to date. The
+    detector state is saved when a stop is found or every ``STOPS_CHECKPOINT_POINTS``
+    fixes; a reader resumes from the checkpoint and only replays the fixes appended
+    after it. Fixes older than the detector's last one (a backfill) restart the day.
+    """
+
+    suffix = STOPS_FILE_SUFFIX
+
+    def __init__(self, tracks_dir, radius_m=STOP_RADIUS_METERS, min_dwell_s=STOP_MIN_DWELL_SECONDS):
+        super().__init__(tracks_dir)  # _open: (mac_key, day) -> (detector, points at the last checkpoint)
+        self.radius_m = radius_m
+        self.min_dwell_s = min_dwell_s
+        self.restarts = 0
+
+    def _load(self, mac_key, day):
+        try:
+            with open(self.path(mac_key, day)) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if (state.get('radius_m'), state.get('min_dwell_s')) != (self.radius_m, self.min_dwell_s) \
+                or 'leading' not in state:
+            return None
+        return StayPointDetector.from_state(state)
+
+    def _save(self, mac_key, day, detector):
+        self._replace(mac_key, day, json.dumps(detector.state()).encode())
+
+    def _catch_up(self, detector, track):
+        """Feed the fixes of ``track`` (append order) past ``detector.points``; returns the detector to keep."""
+        if detector is not None:
+            tail = track[detector.points:]
+            if detector.points <= len(track) and \
+                    not (len(tail) and detector.last_t is not None and int(tail['t'].min()) < detector.last_t):
+                detector.feed(time_ordered(tail))
+                return detector
+            self.restarts += 1
+        detector = StayPointDetector(self.radius_m, self.min_dwell_s)
+        detector.feed(time_ordered(track))
+        return detector
+
+    def add(self, records, read):
+        """
+        Run the detectors of the device-days a stored batch of ``(timestamp, lat, lng, mac)`` tuples touched.
+
+        :param read: ``f(mac_key, day) -> track`` returning the stored points in append order
+        """
+        today = utc_today()
+        with self._lock:
+            for mac_key, day in points_by_day(records):
+                entry = self._open.get((mac_key, day))
+                if entry is None:
+                    detector = self._load(mac_key, day)
+                    saved = detector.points if detector is not None else 0
+                else:
+                    detector, saved = entry
+                stops_before = len(detector.stops) if detector is not None else 0
+                detector = self._catch_up(detector, read(mac_key, day))
+                if len(detector.stops) != stops_before or detector.points - saved >= STOPS_CHECKPOINT_POINTS \
+                        or day != today:
+                    self._save(mac_key, day, detector)
+                    saved = detector.points
+                self._open[(mac_key, day)] = (detector, saved)
+            self._close_past_days(today)
+
+    def get(self, mac_key, day, read):
+        """Detector that has seen every fix of a device-day, resumed from this process's one or the checkpoint."""
+        with self._lock:
+            entry = self._open.get((mac_key, day))
+        detector = StayPointDetector.from_state(entry[0].state()) if entry is not None else self._load(mac_key, day)
+        points = detector.points if detector is not None else None
+        detector = self._catch_up(detector, read(mac_key, day))
+        if detector.points and detector.points != points and day < utc_today():
+            # A past day has no ingest-time detector left to checkpoint it, so the replay is saved here
+            self._save(mac_key, day, detector)
+        return detector
+
+    def forget(self, mac_key, day):
+        """
+        Drop the detector of a device-day whose stored points were rewritten (e.g. compacted).
+
+        Checkpoints resume from a record position, which only holds while the day is appended to.
+        """
+        with self._lock:
+            self._open.pop((mac_key, day), None)
+            try:
+                os.remove(self.path(mac_key, day))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'open_days': len(self._open), 'restarts': self.restarts}
@@ -0,0 +1,220 @@
+# daysummary.py
+import os
+
+import numpy as np
+
+from daysidecar import DaySidecars, points_by_day, sidecar_file_name, utc_today
+from geo import haversine_array
+from trackstore import COORD_SCALE, to_records
+
+SUMMARY_FILE_SUFFIX = '.sum'
+MOVING_SPEED_KMH = 2.0         # below this a device counts as idle, as on the map
+MAX_MOVING_GAP_SECONDS = 300   # longer gaps between fixes are not counted as moving time or for speed
+SUMMARY_DTYPE = np.dtype([
+    ('points', '<i8'), ('first', '<i8'), ('last', '<i8'), ('last_lat', '<i4'), ('last_lng', '<i4'),
+    ('min_lat', '<i4'), ('min_lng', '<i4'), ('max_lat', '<i4'), ('max_lng', '<i4'),
+    ('distance_m', '<f8'), ('moving_m', '<f8'), ('moving_s', '<f8'), ('max_speed_kmh', '<f8'),
+])
+
+
+def summary_file_name(mac_key, day):
+    return sidecar_file_name(mac_key, day, SUMMARY_FILE_SUFFIX)
+
+
+def empty_summary():
+    return np.zeros((), dtype=SUMMARY_DTYPE)
+
+
+def extend_summary(summary, track):
+    """
+    Fold newly stored points into a device-day summary, in time proportional to the new points.
+
+    Segments run between consecutive fixes in time order, continuing from the last fix
+    of ``summary``. Fixes with the same timestamp add no distance, so duplicates never
+    produce infinite speeds.
+
+    :return: The new summary, or None when ``track`` has points older than the summary's
+             last fix and the day has to be summarized again from all its points
+    """
+    summary = summary.copy()
+    if not len(track):
+        return summary
+    if summary['points'] and track['t'].min() < summary['last']:
+        return None
+    track = track[np.argsort(track['t'], kind='stable')]
+
+    t, lat, lng = track['t'], track['lat'], track['lng']
+    if summary['points']:
+        t = np.concatenate([[summary['last']], t])
+        lat = np.concatenate([[summary['last_lat']], lat])
+        lng = np.concatenate([[summary['last_lng']], lng])
+    else:
+        summary['first'] = t[0]
+        summary['min_lat'], summary['max_lat'] = lat[0], lat[0]
+        summary['min_lng'], summary['max_lng'] = lng[0], lng[0]
+
+    dt = np.diff(t)
+    distance = haversine_array(lat[:-1] / COORD_SCALE, lng[:-1] / COORD_SCALE,
+                               lat[1:] / COORD_SCALE, lng[1:] / COORD_SCALE)
+    timed = (dt > 0) & (dt <= MAX_MOVING_GAP_SECONDS)
+    speed = distance[timed] / dt[timed] * 3.6
+    moving = speed >= MOVING_SPEED_KMH
+    summary['distance_m'] += distance[dt > 0].sum()
+    summary['moving_m'] += distance[timed][moving].sum()
+    summary['moving_s'] += dt[timed][moving].sum()
+    if len(speed):
+        summary['max_speed_kmh'] = max(float(summary['max_speed_kmh']), float(speed.max()))
+
+    summary['points'] += len(track)
+    summary['last'] = track['t'][-1]
+    summary['last_lat'], summary['last_lng'] = track['lat'][-1], track['lng'][-1]
+    summary['min_lat'] = min(int(summary['min_lat']), int(lat.min()))
+    summary['min_lng'] = min(int(summary['min_lng']), int(lng.min()))
+    summary['max_lat'] = max(int(summary['max_lat']), int(lat.max()))
+    summary['max_lng'] = max(int(summary['max_lng']), int(lng.max()))
+    return summary
+
+
+def summarize_track(track):
+    """Summary of all the points of a device-day."""
+    return extend_summary(empty_summary(), track)
+
+
+def summary_dict(summary):
+    """
+    JSON-ready form of a summary.
+
+    :return: Dict with ``points``, ``first``/``last`` (epoch seconds), ``bbox``
+             (``[min_lat, min_lng, max_lat, max_lng]``), ``distance_m``, ``moving_distance_m``,
+             ``moving_time_s``, ``max_speed_kmh`` and ``mean_speed_kmh`` (of the moving segments);
+             None values when empty
+    """
+    points = int(summary['points'])
+    if not points:
+        return {'points': 0, 'first': None, 'last': None, 'bbox': None, 'distance_m': 0.0, 'moving_distance_m': 0.0,
+                'moving_time_s': 0, 'max_speed_kmh': None, 'mean_speed_kmh': None}
+    moving = int(summary['moving_s'])
+    return {
+        'points': points,
+        'first': int(summary['first']),
+        'last': int(summary['last']),
+        'bbox': [int(summary['min_lat']) / COORD_SCALE, int(summary['min_lng']) / COORD_SCALE,
+                 int(summary['max_lat']) / COORD_SCALE, int(summary['max_lng']) / COORD_SCALE],
+        'distance_m': round(float(summary['distance_m']), 1),
+        'moving_distance_m': round(float(summary['moving_m']), 1),
+        'moving_time_s': moving,
+        'max_speed_kmh': round(float(summary['max_speed_kmh']), 2),
+        'mean_speed_kmh': round(float(summary['moving_m']) / moving * 3.6, 2) if moving else None,
+    }
+
+
+def combine_summaries(summaries):
+    """
+    Totals over several day summaries (dicts from ``summary_dict``).
+
+    Days are added up as they are; the step from one day's last fix to the next day's
+    first fix is not counted as distance.
+    """
+    days = [s for s in summaries if s['points']]
+    if not days:
+        return summary_dict(empty_summary())
+    moving_distance = sum(s['moving_distance_m'] for s in days)
+    moving = sum(s['moving_time_s'] for s in days)
+    boxes = np.array([s['bbox'] for s in days])
+    return {
+        'points': sum(s['points'] for s in days),
+        'first': min(s['first'] for s in days),
+        'last': max(s['last'] for s in days),
+        'bbox': [float(boxes[:, 0].min()), float(boxes[:, 1].min()),
+                 float(boxes[:, 2].max()), float(boxes[:, 3].max())],
+        'distance_m': round(sum(s['distance_m'] for s in days), 1),
+        'moving_distance_m': round(moving_distance, 1),
+        'moving_time_s': moving,
+        'max_speed_kmh': max(s['max_speed_kmh'] for s in days),
+        'mean_speed_kmh': round(moving_distance / moving * 3.6, 2) if moving else None,
+    }
+
+
+class DaySummaryFiles(DaySidecars):
+    """
+    Running summary of every device-day, in a ``<MAC>_<day>.sum`` sidecar.
+
+    ``add`` is called by the writer after a batch is stored and folds the new points
+    into the summaries of the days they belong to; the summaries of the current day
+    stay in memory, so each point costs O(1). A batch with points older than a day's
+    last fix (a backfill) summarizes that day again from its stored points.
+
+    A sidecar is only trusted when it covers as many points as the store holds for the
+    day, so one left behind by a crash, a compaction or another process is rebuilt
+    when it is next read.
+    """
+
+    suffix = SUMMARY_FILE_SUFFIX
+
+    def __init__(self, tracks_dir):
+        super().__init__(tracks_dir)  # _open: (mac_key, day) -> summary of the days being written
+        self.rebuilds = 0
+
+    def _load(self, mac_key, day):
+        try:
+            with open(self.path(mac_key, day), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) != SUMMARY_DTYPE.itemsize:
+            return None
+        return np.frombuffer(data, dtype=SUMMARY_DTYPE).reshape(()).copy()
+
+    def _store(self, mac_key, day, summary):
+        # One small fixed-size record rewritten in place; readers check its point count anyway
+        fd = os.open(self.path(mac_key, day), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, summary.tobytes(), 0)
+        finally:
+            os.close(fd)
+
+    def add(self, records, read):
+        """
+        Fold a stored batch of ``(timestamp, lat, lng, mac)`` tuples into the summaries.
+
+        :param read: ``f(mac_key, day) -> track`` returning the stored points, batch included
+        """
+        today = utc_today()
+        with self._lock:
+            for (mac_key, day), points in points_by_day(records).items():
+                batch = to_records(*zip(*points))
+                summary = self._open.get((mac_key, day))
+                if summary is None:
+                    stored = self._load(mac_key, day)
+                    before = len(read(mac_key, day)) - len(batch)
+                    if stored is not None and stored['points'] == before:
+                        summary = stored
+                    elif before == 0:
+                        summary = empty_summary()
+                summary = extend_summary(summary, batch) if summary is not None else None
+                if summary is None:
+                    self.rebuilds += 1
+                    summary = summarize_track(read(mac_key, day))
+                self._store(mac_key, day, summary)
+                self._open[(mac_key, day)] = summary
+            self._close_past_days(today)
+
+    def get(self, mac_key, day, points, read):
+        """
+        Summary of a device-day holding ``points`` points; rebuilt from ``read`` if the sidecar does not match.
+        """
+        with self._lock:
+            summary = self._open.get((mac_key, day))
+        if summary is None or summary['points'] != points:
+            summary = self._load(mac_key, day)
+        if summary is None or summary['points'] != points:
+            with self._lock:
+                self.rebuilds += 1
+            summary = summarize_track(read(mac_key, day))
+            if points and day < utc_today():
+                self._store(mac_key, day, summary)
+        return summary
+
+    def stats(self):
+        with self._lock:
+            return {'open_days': len(self._open), 'rebuilds': self.rebuilds}
@@ -1,44 +1,75 @@
 # exports.py
-import os
-from flask import Blueprint, request, send_file, Response
+import io
+from flask import Blueprint, request, send_file, Response, current_app
 from datetime import datetime
 from xml.etree.ElementTree import Element, SubElement, tostring
 from xml.dom import minidom
 
+from logwriter import mac_to_file_key, normalize_mac
+from trackstore import latitudes, longitudes, timestamps
+
 export_bp = Blueprint('exports', __name__)
 
+
+def _export_args():
+    """
+    ``(date, mac_keys)`` of an export request: the requested MAC, or every device with data on the date.
+
+    :raises ValueError: if the date or the MAC is malformed
+    """
+    storage = current_app.config['STORAGE']
+    date = request.args.get('date') or datetime.utcnow().strftime('%Y-%m-%d')
+    datetime.strptime(date, '%Y-%m-%d')
+    mac = request.args.get('mac')
+    mac_keys = [mac_to_file_key(normalize_mac(mac))] if mac else storage.devices_for_day(date)
+    return date, mac_keys
+
+
+def _tracks_for_request(date, mac_keys):
+    """Yield ``(mac, track)`` for each of ``mac_keys`` with data on ``date``."""
+    storage = current_app.config['STORAGE']
+    for mac_key in mac_keys:
+        track = storage.read(mac_key, date)
+        if len(track):
+            yield mac_key.replace('-', ':'), track
+
+
 @export_bp.route('/export/csv')
 def export_csv():
-    date = request.args.get('date') or datetime.utcnow().strftime('%Y-%m-%d')
-    session_files = sorted([f for f in os.listdir('.') if f.startswith(f'gps_log_{date}_') and f.endswith('.txt')])
-    if not session_files:
+    try:
+        date, mac_keys = _export_args()
+    except ValueError as e:
+        return str(e), 400
+    lines = []
+    for mac, track in _tracks_for_request(date, mac_keys):
+        for ts, lat, lng in zip(timestamps(track).tolist(), latitudes(track).tolist(), longitudes(track).tolist()):
+            lines.append(f"{ts},{lat},{lng},{mac}\n")
+    if not lines:
         return "No data", 404
 
-    merged = '\n'.join(open(f, 'r').read() for f in session_files)
-    tmp_file = f'tmp_export_{date}.csv'
-    with open(tmp_file, 'w') as f:
-        f.write(merged)
-
-    return send_file(tmp_file, as_attachment=True, download_name=f'gps_{date}.csv')
+    return send_file(io.BytesIO(''.join(lines).encode('utf-8')), mimetype='text/csv',
+                     as_attachment=True, download_name=f'gps_{date}.csv')
 
 
 @export_bp.route('/export/gpx')
 def export_gpx():
-    date = request.args.get('date') or datetime.utcnow().strftime('%Y-%m-%d')
-    session_files = sorted([f for f in os.listdir('.') if f.startswith(f'gps_log_{date}_') and f.endswith('.txt')])
-    if not session_files:
+    try:
+        date, mac_keys = _export_args()
+    except ValueError as e:
+        return str(e), 400
+    tracks = list(_tracks_for_request(date, mac_keys))
+    if not tracks:
         return "No data", 404
 
     gpx = Element('gpx', version="1.1", creator="Oriiona", xmlns="http://www.topografix.com/GPX/1/1")
-    trk = SubElement(gpx, 'trk')
-    trkseg = SubElement(trk, 'trkseg')
-
-    for log_file in session_files:
-        with open(log_file) as f:
-            for line in f:
-                parts = line.strip().split(',')
-                if len(parts) == 3:
-                    SubElement(trkseg, 'trkpt', lat=parts[1], lon=parts[2])
+
+    for mac, track in tracks:
+        trk = SubElement(gpx, 'trk')
+        SubElement(trk, 'name').text = mac
+        trkseg = SubElement(trk, 'trkseg')
+        for ts, lat, lng in zip(timestamps(track).tolist(), latitudes(track).tolist(), longitudes(track).tolist()):
+            trkpt = SubElement(trkseg, 'trkpt', lat=str(lat), lon=str(lng))
+            SubElement(trkpt, 'time').text = ts.replace(' ', 'T') + 'Z'
 
     xml_str = minidom.parseString(tostring(gpx)).toprettyxml(indent="  ")
     return Response(xml_str, mimetype='application/gpx+xml')
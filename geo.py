@@ -0,0 +1,21 @@
+# geo.py
+from math import radians, cos, sin, asin, sqrt
+
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371000
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between two points given in degrees."""
+    d_lat = radians(lat2 - lat1)
+    d_lon = radians(lon2 - lon1)
+    a = sin(d_lat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(d_lon / 2) ** 2
+    return EARTH_RADIUS_METERS * 2 * asin(sqrt(a))
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    """Element-wise ``haversine`` over NumPy arrays of degrees; returns metres."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_METERS * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
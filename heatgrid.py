@@ -0,0 +1,171 @@
+# heatgrid.py
+import os
+
+import numpy as np
+
+from daysidecar import DaySidecars, points_by_day, sidecar_file_name, utc_today
+from trackstore import COORD_SCALE, to_records
+
+HEAT_FILE_SUFFIX = '.heat'
+# Map zoom levels a grid is kept for; a level's cells are 1/2**(level + HEAT_CELL_SHIFT) of 360 degrees,
+# i.e. about 4 px on a 256 px tile at that zoom
+HEAT_LEVELS = (4, 7, 10, 13, 16)
+HEAT_CELL_SHIFT = 6
+HEAT_DTYPE = np.dtype([('level', '<i4'), ('row', '<i4'), ('col', '<i4'), ('count', '<i4')])
+EMPTY_HEAT = np.zeros(0, dtype=HEAT_DTYPE)
+
+
+def heat_file_name(mac_key, day):
+    return sidecar_file_name(mac_key, day, HEAT_FILE_SUFFIX)
+
+
+def heat_level(zoom):
+    """The finest kept level not finer than map ``zoom`` (the coarsest one below it)."""
+    finer = [level for level in HEAT_LEVELS if level <= zoom]
+    return finer[-1] if finer else HEAT_LEVELS[0]
+
+
+def cell_degrees(level):
+    return 360.0 / (1 << (level + HEAT_CELL_SHIFT))
+
+
+def _cell_index(scaled, level):
+    # Integer floor division keeps cell edges exact; lat * 2**22 still fits in int64
+    return (scaled.astype(np.int64) << (level + HEAT_CELL_SHIFT)) // (360 * COORD_SCALE)
+
+
+def heat_cells(track, levels=HEAT_LEVELS):
+    """Point counts of ``track`` per non-empty cell of every level, one HEAT_DTYPE row per cell."""
+    grids = []
+    for level in levels:
+        cells = np.empty(len(track), dtype=HEAT_DTYPE)
+        cells['level'] = level
+        cells['row'] = _cell_index(track['lat'], level)
+        cells['col'] = _cell_index(track['lng'], level)
+        cells['count'] = 1
+        grids.append(cells)
+    return merge_cells(grids)
+
+
+def merge_cells(grids):
+    """
+    Add up sparse grids: the counts of equal ``(level, row, col)`` cells are summed.
+
+    This is what makes grids of any set of days and devices combinable; the result
+    is sorted by level, row and column.
+    """
+    cells = np.concatenate([EMPTY_HEAT, *grids])
+    keys, inverse = np.unique(cells[['level', 'row', 'col']], return_inverse=True)
+    merged = np.empty(len(keys), dtype=HEAT_DTYPE)
+    for name in ('level', 'row', 'col'):
+        merged[name] = keys[name]
+    merged['count'] = np.bincount(inverse.ravel(), weights=cells['count'], minlength=len(keys))
+    return merged
+
+
+def cells_in_box(cells, level, min_lat, min_lng, max_lat, max_lng):
+    """The cells of ``level`` overlapping a lat/lng box."""
+    rows = _cell_index(np.round(np.array([min_lat, max_lat]) * COORD_SCALE), level)
+    cols = _cell_index(np.round(np.array([min_lng, max_lng]) * COORD_SCALE), level)
+    return cells[(cells['level'] == level) & (cells['row'] >= rows[0]) & (cells['row'] <= rows[1]) &
+                 (cells['col'] >= cols[0]) & (cells['col'] <= cols[1])]
+
+
+def cell_centers(cells):
+    """:return: ``(latitudes, longitudes)`` of the centres of cells of one level"""
+    if not len(cells):
+        return np.zeros(0), np.zeros(0)
+    size = cell_degrees(int(cells['level'][0]))
+    return (cells['row'] + 0.5) * size, (cells['col'] + 0.5) * size
+
+
+def read_heat_tail(path, offset=0):
+    """:return: ``(cells, consumed)`` of a heat grid file from byte ``offset``"""
+    count = max(0, os.path.getsize(path) - offset) // HEAT_DTYPE.itemsize
+    cells = np.fromfile(path, dtype=HEAT_DTYPE, count=count, offset=offset)
+    return cells, len(cells) * HEAT_DTYPE.itemsize
+
+
+def counted_points(cells):
+    """Points a grid counts: every point is in exactly one cell of each level."""
+    return int(cells['count'][cells['level'] == HEAT_LEVELS[0]].sum())
+
+
+class HeatGridFiles(DaySidecars):
+    """
+    Point-density grids of every device-day, in ``<MAC>_<day>.heat`` sidecars.
+
+    A file is an append-only list of ``(level, row, col, count)`` cells; ``add``
+    appends the counts of each stored batch, and a cell listed more than once is
+    summed when read (``merge_cells``). Files of past days are rewritten merged the
+    first time they are read. Every point is counted once per level, so the counts
+    of the coarsest level must add up to the day's points; a grid that misses an
+    append or still counts the duplicates a compaction removed is recounted.
+
+    :param cache: Optional ``ParsedFileCache`` keeping grid files in memory between queries
+    """
+
+    suffix = HEAT_FILE_SUFFIX
+
+    def __init__(self, tracks_dir, cache=None):
+        super().__init__(tracks_dir)  # _open: (mac_key, day) -> points counted in the file, for the days being written
+        self.cache = cache
+        self.rebuilds = 0
+
+    def _load(self, mac_key, day):
+        path = self.path(mac_key, day)
+        try:
+            if self.cache is not None:
+                return self.cache.load(path, read_heat_tail)
+            return read_heat_tail(path)[0]
+        except FileNotFoundError:
+            return None
+
+    def add(self, records, read):
+        """
+        Count a stored batch of ``(timestamp, lat, lng, mac)`` tuples into the grids.
+
+        :param read: ``f(mac_key, day) -> track`` returning the stored points, batch included
+        """
+        today = utc_today()
+        with self._lock:
+            for (mac_key, day), points in points_by_day(records).items():
+                counted = self._open.get((mac_key, day))
+                if counted is None:
+                    stored = self._load(mac_key, day)
+                    counted = counted_points(stored) if stored is not None else 0
+                    before = len(read(mac_key, day)) - len(points)
+                    if counted != before:
+                        counted = None
+                if counted is None:
+                    self.rebuilds += 1
+                    track = read(mac_key, day)
+                    self._replace(mac_key, day, heat_cells(track).tobytes())
+                    counted = len(track)
+                else:
+                    with open(self.path(mac_key, day), 'ab') as f:
+                        f.write(heat_cells(to_records(*zip(*points))).tobytes())
+                    counted += len(points)
+                self._open[(mac_key, day)] = counted
+            self._close_past_days(today)
+
+    def get(self, mac_key, day, points, read):
+        """Merged grid (all levels) of a device-day holding ``points`` points; rebuilt from ``read`` if stale."""
+        cells = self._load(mac_key, day)
+        past = day < utc_today()
+        if cells is None or counted_points(cells) != points:
+            with self._lock:
+                self.rebuilds += 1
+            merged = heat_cells(read(mac_key, day))
+        else:
+            merged = merge_cells([cells])
+            if len(merged) == len(cells):
+                return merged
+        if past and points:
+            # Appends to a past day are backfills, so merging its cells once saves every later read the work
+            self._replace(mac_key, day, merged.tobytes())
+        return merged
+
+    def stats(self):
+        with self._lock:
+            return {'open_days': len(self._open), 'rebuilds': self.rebuilds}
@@ -18,11 +18,15 @@ def import_csv():
         reader = csv.reader(stream)
         coords = []
         for row in reader:
-            if len(row) == 3:
+            # timestamp,lat,lng as the old exports wrote it, or timestamp,lat,lng,mac as /export/csv does
+            if len(row) in (3, 4):
                 try:
-                    coords.append({'lat': float(row[1]), 'lng': float(row[2])})
+                    coord = {'lat': float(row[1]), 'lng': float(row[2])}
                 except ValueError:
                     continue
+                if len(row) == 4:
+                    coord['mac'] = row[3]
+                coords.append(coord)
         return jsonify(coords)
     except Exception as e:
         return f"Error parsing CSV: {str(e)}", 500
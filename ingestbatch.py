@@ -0,0 +1,140 @@
+# ingestbatch.py
+import json
+from datetime import datetime, timezone
+
+from geo import haversine
+from logwriter import mac_to_file_key, normalize_mac
+
+STATUS_OK = 'ok'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_INVALID = 'invalid'
+
+
+class BatchError(ValueError):
+    """The request body as a whole could not be parsed."""
+
+
+def parse_batch_body(raw, content_type=''):
+    """
+    Decode a bulk upload into a list of items.
+
+    Accepts a JSON array, a JSON object with a ``points`` array, or NDJSON (one
+    object per line). NDJSON is assumed when the content type says so or when
+    the body is not a single JSON document.
+
+    :raises BatchError: if the body is empty or a line is not valid JSON
+    """
+    text = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+    stripped = text.strip()
+    if not stripped:
+        raise BatchError("Empty body")
+
+    if 'ndjson' not in content_type and 'jsonl' not in content_type:
+        try:
+            body = json.loads(stripped)
+        except ValueError:
+            body = None
+        if isinstance(body, list):
+            return body
+        if isinstance(body, dict):
+            return body.get('points') if isinstance(body.get('points'), list) else [body]
+
+    items = []
+    for line_no, line in enumerate(stripped.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            raise BatchError(f"Invalid JSON on line {line_no}")
+    return items
+
+
+def parse_timestamp(value, default):
+    """
+    Normalize a device timestamp to the ``%Y-%m-%d %H:%M:%S`` UTC string used in the logs.
+
+    :param value: Epoch seconds, or an ISO 8601 / ``%Y-%m-%d %H:%M:%S`` string (naive means UTC)
+    :param default: Returned when ``value`` is None
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("timestamp must be a number or a string")
+    if isinstance(value, (int, float)):
+        try:
+            parsed = datetime.fromtimestamp(value, tz=timezone.utc)
+        except (OverflowError, OSError):
+            raise ValueError("timestamp out of range")
+    elif isinstance(value, str):
+        parsed = datetime.fromisoformat(value.strip())
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+    else:
+        raise ValueError("timestamp must be a number or a string")
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def validate_item(item, default_mac, received_at):
+    """
+    Turn one uploaded item into a ``(timestamp, lat, lng, mac)`` record.
+
+    :raises ValueError: with a message suitable for the per-item status
+    """
+    if not isinstance(item, dict):
+        raise ValueError("item must be an object")
+    mac = item.get('mac') or default_mac
+    if not mac or not isinstance(mac, str):
+        raise ValueError("mac is required")
+    mac = normalize_mac(mac)
+    lat = item.get('latitude', item.get('lat'))
+    lng = item.get('longitude', item.get('lng'))
+    if isinstance(lat, bool) or isinstance(lng, bool) or not isinstance(lat, (int, float)) \
+            or not isinstance(lng, (int, float)):
+        raise ValueError("latitude and longitude must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("coordinates out of range")
+    timestamp = parse_timestamp(item.get('timestamp'), received_at)
+    return timestamp, float(lat), float(lng), mac
+
+
+def prepare_batch(items, default_mac=None, duplicate_meters=0.01, received_at=None):
+    """
+    Validate, order and de-duplicate an uploaded batch.
+
+    Points are sorted by device and timestamp (stable, so upload order breaks
+    ties). A point within ``duplicate_meters`` of the previous kept point of the
+    same device at the same second is a duplicate.
+
+    :return: ``(records, statuses)`` where ``records`` are the accepted
+             ``(timestamp, lat, lng, mac)`` tuples in write order and ``statuses``
+             has one ``{"index", "status"[, "error"]}`` entry per uploaded item
+    """
+    if received_at is None:
+        received_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+    statuses = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, validate_item(item, default_mac, received_at)))
+        except ValueError as e:
+            statuses[index] = {'index': index, 'status': STATUS_INVALID, 'error': str(e)}
+
+    valid.sort(key=lambda entry: (mac_to_file_key(entry[1][3]), entry[1][0]))
+
+    records = []
+    previous = {}
+    for index, record in valid:
+        timestamp, lat, lng, mac = record
+        mac_key = mac_to_file_key(mac)
+        last = previous.get(mac_key)
+        if last is not None and last[0] == timestamp and haversine(last[1], last[2], lat, lng) < duplicate_meters:
+            statuses[index] = {'index': index, 'status': STATUS_DUPLICATE}
+            continue
+        previous[mac_key] = record
+        records.append(record)
+        statuses[index] = {'index': index, 'status': STATUS_OK}
+
+    return records, statuses
@@ -0,0 +1,59 @@
+# lastpoint.py
+import threading
+
+from geo import haversine
+from logwriter import mac_to_file_key
+
+
+class LastPointCache:
+    """
+    Last accepted point per device, shared by the MQTT and HTTP ingest paths.
+
+    A new point is a duplicate when it lies within ``threshold_meters`` of the
+    last accepted point for the same MAC, so duplicate checks never read the
+    logs. ``loader(mac_key)`` may return ``(lat, lng)`` to seed a device the
+    first time it is seen after a restart; it runs outside the lock, once per
+    device, and a device it knows nothing about is remembered as such.
+    """
+
+    def __init__(self, threshold_meters=0.01, loader=None):
+        self.threshold_meters = threshold_meters
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._points = {}  # mac_key -> (lat, lng, timestamp), or None for a device with no point yet
+
+    def _seed(self, mac_key):
+        """Load the last point of a device not seen yet; call without holding the lock."""
+        with self._lock:
+            if mac_key in self._points:
+                return
+        seeded = self.loader(mac_key) if self.loader is not None else None
+        with self._lock:
+            self._points.setdefault(mac_key, (seeded[0], seeded[1], None) if seeded is not None else None)
+
+    def is_duplicate(self, mac, lat, lng):
+        mac_key = mac_to_file_key(mac)
+        self._seed(mac_key)
+        with self._lock:
+            last = self._points[mac_key]
+        return last is not None and haversine(last[0], last[1], lat, lng) < self.threshold_meters
+
+    def accept(self, mac, lat, lng, timestamp=None):
+        """
+        Record the point unless it duplicates the last accepted one.
+
+        :return: True if the point was accepted (and should be written), False if it is a duplicate
+        """
+        mac_key = mac_to_file_key(mac)
+        self._seed(mac_key)
+        with self._lock:
+            last = self._points[mac_key]
+            if last is not None and haversine(last[0], last[1], lat, lng) < self.threshold_meters:
+                return False
+            self._points[mac_key] = (lat, lng, timestamp)
+        return True
+
+    def get(self, mac):
+        """Return ``(lat, lng, timestamp)`` of the last accepted point, or None."""
+        with self._lock:
+            return self._points.get(mac_to_file_key(mac))
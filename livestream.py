@@ -0,0 +1,145 @@
+# livestream.py
+import json
+import logging
+import queue
+import threading
+
+from logwriter import mac_to_file_key
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One open stream: the MACs it follows and its pending events."""
+
+    def __init__(self, mac_keys, queue_size):
+        self.mac_keys = mac_keys
+        self.events = queue.Queue(queue_size)
+
+    def push(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Slow client: positions supersede each other, so drop the oldest
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                pass
+            self.events.put_nowait(event)
+
+
+def format_position(mac_key, point):
+    data = {
+        "mac": mac_key.replace('-', ':'),
+        "latitude": point['lat'],
+        "longitude": point['lng'],
+        "timestamp": point['timestamp'],
+        "source": "MQTT"
+    }
+    return f"event: position\ndata: {json.dumps(data)}\n\n"
+
+
+class LiveBroadcaster:
+    """
+    Fans position updates out to Server-Sent Events subscribers.
+
+    One watcher thread per process compares the slot versions of the watched
+    devices in the shared latest-position table and pushes a formatted event to
+    every subscription following a device whose version changed. The ingest path
+    in this process calls ``notify`` to wake the watcher immediately; updates
+    written by other processes are picked up within ``poll_interval`` seconds.
+    """
+
+    def __init__(self, table, poll_interval=0.25, keepalive=15, queue_size=100):
+        self.table = table
+        self.poll_interval = poll_interval
+        self.keepalive = keepalive
+        self.queue_size = queue_size
+
+        self._lock = threading.Lock()
+        self._subscribers = {}  # mac_key -> set of Subscription
+        self._seen = {}         # mac_key -> last published slot version
+        self._wake = threading.Event()
+        self._thread = None
+
+    def notify(self):
+        """Called by the ingest path after publishing positions to the table."""
+        self._wake.set()
+
+    def subscribe(self, macs):
+        mac_keys = sorted({mac_to_file_key(mac.strip()) for mac in macs if mac.strip()})
+        subscription = Subscription(mac_keys, self.queue_size)
+        with self._lock:
+            for mac_key in mac_keys:
+                if mac_key not in self._subscribers:
+                    self._subscribers[mac_key] = set()
+                    self._seen[mac_key] = self.table.sequence(mac_key)
+                self._subscribers[mac_key].add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-broadcaster', daemon=True)
+                self._thread.start()
+        logger.debug(f"Live stream subscribed to {mac_keys}")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for mac_key in subscription.mac_keys:
+                subscribers = self._subscribers.get(mac_key)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[mac_key]
+                    self._seen.pop(mac_key, None)
+        logger.debug(f"Live stream unsubscribed from {subscription.mac_keys}")
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                watched = list(self._subscribers)
+            for mac_key in watched:
+                try:
+                    version = self.table.sequence(mac_key)
+                    if not version or version == self._seen.get(mac_key):
+                        continue
+                    point = self.table.get(mac_key)
+                except Exception:
+                    logger.exception(f"Could not read the latest position of {mac_key}")
+                    continue
+                if point is None:
+                    continue
+                event = format_position(mac_key, point)
+                with self._lock:
+                    if mac_key not in self._subscribers:
+                        continue
+                    self._seen[mac_key] = version
+                    subscribers = list(self._subscribers[mac_key])
+                for subscription in subscribers:
+                    subscription.push(event)
+
+    def events(self, subscription):
+        """
+        Generator of SSE chunks for one subscription.
+
+        Starts with the current position of every followed device, then yields
+        updates as they arrive and a comment line every ``keepalive`` seconds.
+        """
+        try:
+            yield "retry: 5000\n\n"
+            for mac_key in subscription.mac_keys:
+                point = self.table.get(mac_key)
+                if point is not None:
+                    yield format_position(mac_key, point)
+            while True:
+                try:
+                    yield subscription.events.get(timeout=self.keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
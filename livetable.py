@@ -0,0 +1,233 @@
+# livetable.py
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from logwriter import mac_to_file_key, normalize_mac
+
+logger = logging.getLogger(__name__)
+
+TABLE_MAGIC = 0x4F524C54  # "ORLT"
+TABLE_VERSION = 2
+KEY_SIZE = 24
+
+HEADER_DTYPE = np.dtype([('magic', '<u4'), ('version', '<u4'), ('capacity', '<u4'), ('count', '<u4'),
+                         ('generation', '<u8')])
+SLOT_DTYPE = np.dtype([('seq', '<u8'), ('t', '<i8'), ('lat', '<f8'), ('lng', '<f8')])
+
+
+class LatestPositionTable:
+    """
+    Latest position per device in ``multiprocessing.shared_memory``.
+
+    Layout: a small header, a directory of ``capacity`` fixed-width MAC keys and
+    ``capacity`` fixed slots of ``(seq, epoch, lat, lng)``. Slots are handed out
+    in directory order and never move, so readers cache ``MAC -> slot`` locally
+    and only rescan the directory entries added since their last look.
+
+    Each slot is a seqlock: the writer makes ``seq`` odd, writes the fields and
+    makes it even again; a reader retries while ``seq`` is odd or changed under
+    it. Readers therefore never block and never talk to the ingest process.
+    There must be one writing process per device (the ingest process, or the
+    shard worker that owns the MAC); slot allocation across processes is
+    serialized with an ``flock`` on ``lock_path``.
+
+    Slots are never freed one by one. When every slot is taken, the table is
+    cleared and its ``generation`` bumped; every process drops its cached slots
+    when it sees the new generation, and devices reappear with their next update.
+    A segment left behind by an older layout is replaced on attach.
+    """
+
+    def __init__(self, name, capacity=4096, lock_path=None):
+        self.name = name
+        self.capacity = capacity
+        self.lock_path = lock_path or os.path.join(tempfile.gettempdir(), f'{name}.lock')
+
+        with self._allocation_lock():
+            created = self._attach(name, capacity)
+
+        buf = self._shm.buf
+        offset = HEADER_DTYPE.itemsize
+        self._keys = np.ndarray((self.capacity,), dtype=f'S{KEY_SIZE}', buffer=buf, offset=offset)
+        offset += self.capacity * KEY_SIZE
+        slots = np.ndarray((self.capacity,), dtype=SLOT_DTYPE, buffer=buf, offset=offset)
+        self._seq = slots['seq']
+        self._t = slots['t']
+        self._lat = slots['lat']
+        self._lng = slots['lng']
+
+        self._slots = {}     # local cache: mac_key -> slot
+        self._scanned = 0    # directory entries already in the cache
+        self._generation = int(self._header[0]['generation'])
+        self._write_lock = threading.Lock()
+        logger.debug(f"{'Created' if created else 'Attached to'} latest-position table {name} "
+                     f"({self.capacity} slots)")
+
+    def _attach(self, name, capacity):
+        """Open (or create) the segment and check its header; returns whether it was created."""
+        size = HEADER_DTYPE.itemsize + capacity * KEY_SIZE + capacity * SLOT_DTYPE.itemsize
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            created = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            created = False
+        # The segment outlives whichever process created it; only unlink() removes it
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+        if header[0]['magic'] == TABLE_MAGIC and header[0]['version'] != TABLE_VERSION:
+            logger.warning(f"Replacing latest-position table {name} of version {int(header[0]['version'])}")
+            del header
+            self.unlink()
+            self._shm.close()
+            return self._attach(name, capacity)
+        if header[0]['magic'] == 0:
+            header['capacity'] = capacity
+            header['version'] = TABLE_VERSION
+            header['magic'] = TABLE_MAGIC
+        elif header[0]['magic'] != TABLE_MAGIC:
+            raise ValueError(f"Shared memory segment {name} is not a latest-position table")
+        self._header = header
+        self.capacity = int(header[0]['capacity'])
+        return created
+
+    @contextmanager
+    def _allocation_lock(self):
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh_directory(self):
+        generation = int(self._header[0]['generation'])
+        if generation != self._generation:
+            # The table was cleared; every cached slot may belong to another device now
+            self._slots.clear()
+            self._scanned = 0
+            self._generation = generation
+        count = int(self._header[0]['count'])
+        for slot in range(self._scanned, count):
+            self._slots[self._keys[slot].decode('ascii', 'replace')] = slot
+        self._scanned = count
+
+    def _clear(self):
+        """Free every slot; the caller holds the allocation lock."""
+        self._header['count'] = 0
+        self._seq[:] = 0
+        self._keys[:] = b''
+        self._header['generation'] = int(self._header[0]['generation']) + 1
+        self._refresh_directory()
+
+    def _slot(self, mac_key, allocate):
+        slot = self._slots.get(mac_key)
+        if slot is not None and int(self._header[0]['generation']) == self._generation:
+            return slot
+        self._refresh_directory()
+        slot = self._slots.get(mac_key)
+        if slot is not None or not allocate:
+            return slot
+
+        with self._allocation_lock():
+            self._refresh_directory()
+            slot = self._slots.get(mac_key)
+            if slot is None:
+                count = int(self._header[0]['count'])
+                if count >= self.capacity:
+                    logger.warning(f"Latest-position table {self.name} is full ({self.capacity} devices), "
+                                   f"clearing it")
+                    self._clear()
+                    count = 0
+                self._keys[count] = mac_key.encode('ascii')
+                # Publish the key before the count so readers never see an empty entry
+                self._header['count'] = count + 1
+                self._slots[mac_key] = slot = count
+                self._scanned = count + 1
+        return slot
+
+    def update(self, mac, lat, lng, epoch=None):
+        """
+        Publish the latest position of a device.
+
+        :raises ValueError: if ``mac`` is not a valid MAC address
+        """
+        if epoch is None:
+            epoch = time.time()
+        mac_key = mac_to_file_key(normalize_mac(mac))
+        with self._write_lock:
+            slot = self._slot(mac_key, allocate=True)
+            seq = int(self._seq[slot])
+            self._seq[slot] = seq + 1
+            self._t[slot] = int(epoch)
+            self._lat[slot] = lat
+            self._lng[slot] = lng
+            self._seq[slot] = seq + 2
+
+    def sequence(self, mac):
+        """
+        Version counter of a device's slot, 0 if it was never written.
+
+        Cheap enough to poll: it changes every time ``update`` publishes a position.
+        """
+        slot = self._slot(mac_to_file_key(mac), allocate=False)
+        return 0 if slot is None else int(self._seq[slot])
+
+    def get(self, mac):
+        """
+        Read the latest position of a device without locking.
+
+        :return: ``{'lat', 'lng', 'timestamp', 'epoch'}`` or None if the device was never seen
+        """
+        slot = self._slot(mac_to_file_key(mac), allocate=False)
+        if slot is None:
+            return None
+        while True:
+            before = int(self._seq[slot])
+            if before == 0:
+                return None
+            if before & 1:
+                continue
+            epoch = int(self._t[slot])
+            lat = float(self._lat[slot])
+            lng = float(self._lng[slot])
+            if int(self._seq[slot]) == before:
+                break
+        return {
+            'lat': lat,
+            'lng': lng,
+            'epoch': epoch,
+            'timestamp': datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    def devices(self):
+        """MAC keys that have a slot, in allocation order."""
+        self._refresh_directory()
+        return sorted(self._slots, key=self._slots.get)
+
+    def clear(self):
+        """Forget every device, e.g. to make room after many one-off MACs."""
+        with self._write_lock, self._allocation_lock():
+            self._clear()
+
+    def close(self):
+        self._header = self._keys = self._seq = self._t = self._lat = self._lng = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # A view is still referenced somewhere; the mapping goes away with the process
+            pass
+
+    def unlink(self):
+        # SharedMemory.unlink() unregisters from the resource tracker, which we opted out of in __init__
+        resource_tracker.register(self._shm._name, 'shared_memory')
+        self._shm.unlink()
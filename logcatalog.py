@@ -0,0 +1,343 @@
+# logcatalog.py
+import logging
+import os
+import threading
+
+import numpy as np
+
+from logwriter import parse_log_file_name
+from trackstore import COMPACT_FILE_SUFFIX, COORD_SCALE, read_compacted, read_text_tail
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT_NAME = '.catalog.npz'
+COMPACTED_PART = -1  # part number under which a device-day's compacted file is catalogued
+_NUMERIC_FIELDS = ('part', 'size', 'mtime_ns', 'points', 'first', 'last', 'min_lat', 'min_lng', 'max_lat', 'max_lng')
+
+
+def _epoch(timestamp):
+    return int(np.datetime64(timestamp, 's').astype('<i8'))
+
+
+class _Entry:
+    """Catalogued file; ``size`` is the number of bytes accounted for, coordinates are scaled integers."""
+    __slots__ = ('mac_key', 'day') + _NUMERIC_FIELDS
+
+    def __init__(self, mac_key, day, part, size=0, mtime_ns=0, points=0, first=0, last=0,
+                 min_lat=0, min_lng=0, max_lat=0, max_lng=0):
+        self.mac_key = mac_key
+        self.day = day
+        self.part = part
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.points = points
+        self.first = first
+        self.last = last
+        self.min_lat = min_lat
+        self.min_lng = min_lng
+        self.max_lat = max_lat
+        self.max_lng = max_lng
+
+    def add(self, points, first, last, min_lat, min_lng, max_lat, max_lng):
+        if not points:
+            return
+        if not self.points:
+            self.first, self.last = first, last
+            self.min_lat, self.min_lng, self.max_lat, self.max_lng = min_lat, min_lng, max_lat, max_lng
+        else:
+            self.first, self.last = min(self.first, first), max(self.last, last)
+            self.min_lat, self.min_lng = min(self.min_lat, min_lat), min(self.min_lng, min_lng)
+            self.max_lat, self.max_lng = max(self.max_lat, max_lat), max(self.max_lng, max_lng)
+        self.points += points
+
+    def add_track(self, track):
+        if len(track):
+            self.add(len(track), int(track['t'].min()), int(track['t'].max()), int(track['lat'].min()),
+                     int(track['lng'].min()), int(track['lat'].max()), int(track['lng'].max()))
+
+
+class LogCatalog:
+    """
+    In-memory catalog of the GPS log files: every text log part and compacted day file.
+
+    Each entry holds the file's MAC, day, part number, point count, first/last
+    timestamp and bounding box, so listing device-days, finding the parts of a day
+    or summarizing a day never lists or parses the log directory.
+
+    The writer reports what it appends through ``record``. Files changed by other
+    processes (ingest shards, compaction elsewhere) are picked up lazily: a changed
+    directory mtime triggers a rescan of file names, and the files of a device-day
+    are re-checked against their size when that day is summarized, parsing only the
+    bytes appended since.
+
+    The catalog is saved to ``snapshot_path`` on ``save`` and reloaded on startup,
+    where a single scan of the directories validates it by file size, so only files
+    that changed since the snapshot are parsed again.
+    """
+
+    def __init__(self, log_dir, tracks_dir, snapshot_path=None):
+        self.log_dir = log_dir
+        self.tracks_dir = tracks_dir
+        self.snapshot_path = snapshot_path or os.path.join(tracks_dir, CATALOG_SNAPSHOT_NAME)
+
+        self._lock = threading.Lock()
+        self._entries = {}   # path -> _Entry
+        self._by_day = {}    # (mac_key, day) -> {part: path}
+        self._dir_mtimes = {}
+        self.rescans = 0
+        self.parsed = 0
+
+        os.makedirs(log_dir, exist_ok=True)
+        os.makedirs(tracks_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def _parse_name(directory_is_logs, name):
+        """:return: ``(mac_key, day, part)`` for a catalogued file name, else None"""
+        if directory_is_logs:
+            return parse_log_file_name(name)
+        if name.endswith(COMPACT_FILE_SUFFIX):
+            mac_key, _, day = name[:-len(COMPACT_FILE_SUFFIX)].rpartition('_')
+            if mac_key:
+                return mac_key, day, COMPACTED_PART
+        return None
+
+    def _load(self):
+        snapshot = {}
+        try:
+            with np.load(self.snapshot_path, allow_pickle=False) as data:
+                for path, row in zip(data['paths'].tolist(), data['numbers'].tolist()):
+                    snapshot[path] = row
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.exception(f"Ignoring unreadable catalog snapshot {self.snapshot_path}")
+
+        with self._lock:
+            for directory in (self.log_dir, self.tracks_dir):
+                self._scan(directory, snapshot)
+        logger.debug(f"Catalog holds {len(self._entries)} files ({len(snapshot)} in the snapshot, "
+                     f"{self.parsed} parsed)")
+
+    def _scan(self, directory, known):
+        """
+        List ``directory`` and bring its entries in line with the files in it.
+
+        :param known: ``path -> numeric fields`` from a snapshot, or the live entries on a rescan
+        """
+        self._dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+        is_logs = directory == self.log_dir
+        seen = set()
+        with os.scandir(directory) as files:
+            for file in files:
+                parsed = self._parse_name(is_logs, file.name)
+                if parsed is None:
+                    continue
+                seen.add(file.path)
+                row = known.get(file.path)
+                if isinstance(row, _Entry):
+                    continue  # already catalogued; re-checked when its day is summarized
+                try:
+                    st = file.stat()
+                except FileNotFoundError:
+                    continue
+                entry = _Entry(*parsed)
+                if row is not None:
+                    entry = _Entry(parsed[0], parsed[1], *row)
+                self._put(file.path, entry)
+                self._revalidate(file.path, entry, st)
+        gone = [path for path, entry in self._entries.items()
+                if (entry.part != COMPACTED_PART) == is_logs and path not in seen]
+        for path in gone:
+            self._drop(path)
+
+    def _put(self, path, entry):
+        self._entries[path] = entry
+        self._by_day.setdefault((entry.mac_key, entry.day), {})[entry.part] = path
+
+    def _drop(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        parts = self._by_day.get((entry.mac_key, entry.day))
+        if parts is not None:
+            parts.pop(entry.part, None)
+            if not parts:
+                del self._by_day[(entry.mac_key, entry.day)]
+
+    def _revalidate(self, path, entry, st=None):
+        """Account for what changed in ``path`` since ``entry`` was taken; drops the entry if the file is gone."""
+        if st is None:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                self._drop(path)
+                return
+        if entry.part == COMPACTED_PART:
+            # Compacted files are only ever replaced as a whole
+            if (entry.size, entry.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                self._reset(entry, st)
+                entry.add_track(read_compacted(path))
+                self.parsed += 1
+            return
+        if st.st_size < entry.size:
+            self._reset(entry, None)
+        if st.st_size > entry.size:
+            # Text logs are append-only: parse just the lines written since
+            track, consumed = read_text_tail(path, entry.size)
+            entry.add_track(track)
+            entry.size += consumed
+            self.parsed += 1
+        entry.mtime_ns = st.st_mtime_ns
+
+    @staticmethod
+    def _reset(entry, st):
+        entry.points = 0
+        entry.size, entry.mtime_ns = (st.st_size, st.st_mtime_ns) if st is not None else (0, 0)
+
+    def _refresh(self):
+        """Rescan the directories whose listing changed since they were last scanned."""
+        for directory in (self.log_dir, self.tracks_dir):
+            if os.stat(directory).st_mtime_ns != self._dir_mtimes.get(directory):
+                self.rescans += 1
+                self._scan(directory, self._entries)
+
+    def record(self, path, offset, nbytes, timestamps, lats, lngs):
+        """
+        Account for lines the writer appended to a text log.
+
+        :param offset: Size of the file before the write
+        :param nbytes: Number of bytes written
+        :param timestamps: ``%Y-%m-%d %H:%M:%S`` strings of the appended points
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                parsed = parse_log_file_name(os.path.basename(path))
+                if parsed is None:
+                    return
+                entry = _Entry(*parsed)
+                self._put(path, entry)
+            if entry.size == offset:
+                entry.size += nbytes
+                entry.add(len(timestamps), _epoch(min(timestamps)), _epoch(max(timestamps)),
+                          int(round(min(lats) * COORD_SCALE)), int(round(min(lngs) * COORD_SCALE)),
+                          int(round(max(lats) * COORD_SCALE)), int(round(max(lngs) * COORD_SCALE)))
+            elif entry.size < offset + nbytes:
+                # Out of step with the file (written elsewhere too); read back what is missing
+                self._revalidate(path, entry)
+
+    def replace(self, path, track):
+        """Catalog a compacted file that was just written with the contents ``track``."""
+        with self._lock:
+            self._drop(path)
+            parsed = self._parse_name(False, os.path.basename(path))
+            st = os.stat(path)
+            entry = _Entry(*parsed, size=st.st_size, mtime_ns=st.st_mtime_ns)
+            entry.add_track(track)
+            self._put(path, entry)
+
+    def forget(self, paths):
+        """Remove files that were deleted."""
+        with self._lock:
+            for path in paths:
+                self._drop(path)
+
+    def device_days(self):
+        """Sorted ``(mac_key, day)`` pairs with a text log part or a compacted file."""
+        with self._lock:
+            self._refresh()
+            return sorted(self._by_day)
+
+    def text_parts(self, mac_key, day):
+        """Text log paths of a device-day, in part order."""
+        with self._lock:
+            self._refresh()
+            parts = self._by_day.get((mac_key, day), {})
+            return [parts[part] for part in sorted(parts) if part != COMPACTED_PART]
+
+    def last_parts(self):
+        """Highest text log part number of every ``(mac_key, day)``."""
+        with self._lock:
+            self._refresh()
+            return {key: max(parts) for key, parts in self._by_day.items() if max(parts) != COMPACTED_PART}
+
+    def uncompacted_days(self, before):
+        """Sorted ``(mac_key, day)`` pairs before ``before`` that still have text log parts."""
+        with self._lock:
+            self._refresh()
+            return sorted(key for key, parts in self._by_day.items()
+                          if key[1] < before and max(parts) != COMPACTED_PART)
+
+    def files(self, mac_key, day):
+        """
+        Catalog entries of a device-day, re-checked against the files.
+
+        :return: List of dicts with ``path``, ``part`` (``COMPACTED_PART`` for the compacted file),
+                 ``points``, ``first``, ``last`` and ``bbox`` (``[min_lat, min_lng, max_lat, max_lng]``)
+        """
+        with self._lock:
+            self._refresh()
+            files = []
+            for part, path in sorted(self._by_day.get((mac_key, day), {}).items()):
+                entry = self._entries[path]
+                self._revalidate(path, entry)
+                if path not in self._entries:
+                    continue
+                files.append({
+                    'path': path,
+                    'part': part,
+                    'points': entry.points,
+                    'first': entry.first if entry.points else None,
+                    'last': entry.last if entry.points else None,
+                    'bbox': [entry.min_lat / COORD_SCALE, entry.min_lng / COORD_SCALE,
+                             entry.max_lat / COORD_SCALE, entry.max_lng / COORD_SCALE] if entry.points else None,
+                })
+            return files
+
+    def summary(self, mac_key, day):
+        """Point count, time span and bounding box of a device-day, as counted from its catalogued files."""
+        files = [f for f in self.files(mac_key, day) if f['points']]
+        if not files:
+            return {'points': 0, 'first': None, 'last': None, 'bbox': None}
+        boxes = np.array([f['bbox'] for f in files])
+        return {
+            'points': sum(f['points'] for f in files),
+            'first': min(f['first'] for f in files),
+            'last': max(f['last'] for f in files),
+            'bbox': [float(boxes[:, 0].min()), float(boxes[:, 1].min()),
+                     float(boxes[:, 2].max()), float(boxes[:, 3].max())],
+        }
+
+    def day_points(self, day):
+        """``{mac_key: points}`` of every device with files for ``day``, re-checked against the files."""
+        with self._lock:
+            self._refresh()
+            keys = [key for key in self._by_day if key[1] == day]
+        return {mac_key: sum(f['points'] for f in self.files(mac_key, day)) for mac_key, _ in sorted(keys)}
+
+    def save(self):
+        """Write the catalog to ``snapshot_path`` (atomically)."""
+        with self._lock:
+            paths = list(self._entries)
+            numbers = np.array([[getattr(e, field) for field in _NUMERIC_FIELDS] for e in self._entries.values()],
+                               dtype=np.int64).reshape(len(paths), len(_NUMERIC_FIELDS))
+        tmp_path = self.snapshot_path + f'.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, paths=np.array(paths, dtype=str), numbers=numbers)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError:
+            # Only costs a rescan of the changed files on the next start
+            logger.warning(f"Could not save the catalog snapshot {self.snapshot_path}", exc_info=True)
+            return
+        logger.debug(f"Saved catalog snapshot of {len(paths)} files to {self.snapshot_path}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._entries),
+                'device_days': len(self._by_day),
+                'rescans': self.rescans,
+                'parsed': self.parsed,
+            }
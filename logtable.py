@@ -0,0 +1,140 @@
+# logtable.py
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from trackstore import EMPTY_TRACK, latitudes, longitudes, timestamps
+
+# Column order of the /logs table, as DataTables numbers them in order[i][column]
+COLUMNS = ('timestamp', 'lat', 'lng', 'mac')
+# Characters a search can contain and still match a column; other columns are not searched
+TIMESTAMP_CHARACTERS = frozenset('0123456789-: ')
+COORDINATE_CHARACTERS = frozenset('0123456789.-')
+MAC_CHARACTERS = frozenset('0123456789ABCDEF:-')
+
+
+def day_devices(storage, day, name_filter=''):
+    """MAC keys with points on ``day`` whose ``<MAC>_<day>`` name contains ``name_filter``."""
+    return [mac_key for mac_key in storage.devices_for_day(day) if name_filter in f'{mac_key}_{day}']
+
+
+def load_day(storage, day, name_filter=''):
+    """
+    All points of ``day`` from the devices whose ``<MAC>_<day>`` name contains ``name_filter``.
+
+    :return: ``(mac_keys, track, owners)`` where ``owners[i]`` indexes the MAC key of point ``i``
+    """
+    mac_keys = day_devices(storage, day, name_filter)
+    tracks = [storage.read(mac_key, day) for mac_key in mac_keys]
+    if not tracks:
+        return mac_keys, EMPTY_TRACK, np.zeros(0, dtype=np.int64)
+    owners = np.repeat(np.arange(len(tracks)), [len(track) for track in tracks])
+    return mac_keys, np.concatenate(tracks), owners
+
+
+class LoadedDay:
+    """The points of a date as ``load_day`` returns them, with the searchable columns formatted on first use."""
+
+    def __init__(self, mac_keys, track, owners):
+        self.mac_keys = mac_keys
+        self.track = track
+        self.owners = owners
+        self._columns = {}
+
+    def column(self, name):
+        """``timestamp``, ``lat`` or ``lng`` of every point as strings."""
+        if name not in self._columns:
+            format_column = {'timestamp': timestamps, 'lat': lambda t: latitudes(t).astype(str),
+                             'lng': lambda t: longitudes(t).astype(str)}[name]
+            self._columns[name] = format_column(self.track)
+        return self._columns[name]
+
+
+class LogDayCache:
+    """
+    LRU of the dates loaded by the log table, keyed by ``(day, name_filter, storage.day_version(day))``.
+
+    Every draw of the table (page change, sort, search keystroke) asks for the same
+    date, so it is read and its columns formatted once; a write to the date changes
+    its version and the next draw loads it again.
+    """
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, storage, day, name_filter=''):
+        key = (day, name_filter, storage.day_version(day))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        loaded = LoadedDay(*load_day(storage, day, name_filter))
+        with self._lock:
+            self._entries[key] = loaded
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            return {'days': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def page(storage, day, name_filter='', search='', order_column=0, descending=False, start=0, length=10, cache=None):
+    """
+    One page of the log table for a day, filtered by ``search`` and sorted on one column.
+
+    Points stay binary until the page is cut; ``search`` only runs over the columns
+    its characters can match, and only the rows of the page are turned into dicts.
+
+    :param search: Substring matched against the timestamp, coordinates and MAC (``:`` or ``-`` form) of every point
+    :param order_column: Index into ``COLUMNS``; ties are broken by time
+    :param cache: Optional ``LogDayCache`` keeping the day loaded between calls
+    :return: ``(total points, points matching search, rows)``
+    """
+    if cache is not None:
+        loaded = cache.get(storage, day, name_filter)
+    else:
+        loaded = LoadedDay(*load_day(storage, day, name_filter))
+    track, owners = loaded.track, loaded.owners
+    macs = np.array([mac_key.replace('-', ':') for mac_key in loaded.mac_keys], dtype=str)
+    total = len(track)
+
+    selected = np.arange(total)
+    if search and total:
+        needle = search.upper()
+        characters = set(needle)
+        match = np.zeros(total, dtype=bool)
+        if characters <= TIMESTAMP_CHARACTERS:
+            match |= np.char.find(loaded.column('timestamp'), search) >= 0
+        if characters <= COORDINATE_CHARACTERS:
+            match |= np.char.find(loaded.column('lat'), search) >= 0
+            match |= np.char.find(loaded.column('lng'), search) >= 0
+        if characters <= MAC_CHARACTERS:
+            devices = np.array([needle in mac_key or needle in mac for mac_key, mac in zip(loaded.mac_keys, macs)],
+                               dtype=bool)
+            match |= devices[owners]
+        selected = np.flatnonzero(match)
+
+    # Sorting MAC keys sorts the MACs, so the owner index orders the mac column
+    keys = (track['t'], track['lat'], track['lng'], owners)[order_column][selected]
+    order = np.lexsort((track['t'][selected], keys))
+    if descending:
+        order = order[::-1]
+    rows = track[selected[order][start:start + length]]
+    row_owners = owners[selected[order][start:start + length]]
+
+    data = [
+        {'timestamp': ts, 'lat': lat, 'lng': lng, 'mac': mac}
+        for ts, lat, lng, mac in zip(timestamps(rows).tolist(), latitudes(rows).tolist(), longitudes(rows).tolist(),
+                                     macs[row_owners].tolist())
+    ]
+    return total, len(selected), data
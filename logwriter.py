@@ -0,0 +1,259 @@
+# logwriter.py
+import os
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+LOG_FILE_PREFIX = 'gps_log_'
+LOG_FILE_SUFFIX = '.txt'
+MAC_PATTERN = re.compile(r'[0-9A-F]{2}(?::[0-9A-F]{2}){5}|[0-9A-F]{2}(?:-[0-9A-F]{2}){5}')
+
+
+def normalize_mac(mac):
+    """
+    Canonical ``08:3A:8D:...`` form of a MAC address given with ``:`` or ``-`` separators.
+
+    Anything else is rejected rather than passed on, since MACs end up in file
+    names and shared-memory keys.
+
+    :raises ValueError: if ``mac`` is not six hex octets
+    """
+    if not isinstance(mac, str):
+        raise ValueError("MAC address must be a string")
+    mac = mac.strip().upper()
+    if not MAC_PATTERN.fullmatch(mac):
+        raise ValueError(f"Invalid MAC address: {mac[:40]!r}")
+    return mac.replace('-', ':')
+
+
+def mac_to_file_key(mac):
+    """Normalize a MAC address to the form used in log file names (``08-3A-8D-...``)."""
+    return mac.replace(":", "-").upper()
+
+
+def log_file_name(mac_key, day, part):
+    return f'{LOG_FILE_PREFIX}{mac_key}_{day}_{part}{LOG_FILE_SUFFIX}'
+
+
+def parse_log_file_name(name):
+    """
+    Split a log file name into its parts.
+
+    :param name: File name such as ``gps_log_08-3A-8D-DE-E5-10_2025-07-16_0.txt``
+    :return: Tuple ``(mac_key, day, part)`` or None if the name is not a per-device log file
+    """
+    if not (name.startswith(LOG_FILE_PREFIX) and name.endswith(LOG_FILE_SUFFIX)):
+        return None
+    stem = name[len(LOG_FILE_PREFIX):-len(LOG_FILE_SUFFIX)]
+    pieces = stem.rsplit('_', 2)
+    if len(pieces) != 3:
+        return None
+    mac_key, day, part = pieces
+    if not part.isdigit():
+        return None
+    return mac_key, day, int(part)
+
+
+def count_lines(path):
+    """Count newline-terminated lines without decoding the file."""
+    count = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            count += chunk.count(b'\n')
+    return count
+
+
+class _OpenLog:
+    __slots__ = ('day', 'part', 'count', 'handle', 'last_write')
+
+    def __init__(self, day, part, count, handle):
+        self.day = day
+        self.part = part
+        self.count = count
+        self.handle = handle
+        self.last_write = time.monotonic()
+
+
+class LogWriter:
+    """
+    Appends GPS points to the per-device, per-day log files.
+
+    One append handle and an in-memory line counter are kept per MAC, so a write
+    never lists the log directory or re-reads a file. The directory is scanned
+    once on startup to find the last part number of every (MAC, day); the line
+    count of that part is read lazily the first time the device writes again.
+
+    If a ``track_store`` is given, every batch is also appended to its binary files.
+    If a ``catalog`` (``LogCatalog``) is given, the part numbers are taken from it
+    instead of scanning the directory, and every commit is recorded in it.
+    """
+
+    def __init__(self, log_dir, max_points_per_file=500, idle_timeout=300, sweep_interval=60, track_store=None,
+                 catalog=None):
+        self.log_dir = log_dir
+        self.track_store = track_store
+        self.catalog = catalog
+        self.max_points_per_file = max_points_per_file
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        self._open = {}          # mac_key -> _OpenLog
+        self._last_parts = {}    # (mac_key, day) -> highest part number on disk
+        self._last_sweep = time.monotonic()
+        self._today = None
+
+        os.makedirs(log_dir, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        if self.catalog is not None:
+            self._last_parts = self.catalog.last_parts()
+            return
+        for name in os.listdir(self.log_dir):
+            parsed = parse_log_file_name(name)
+            if not parsed:
+                continue
+            mac_key, day, part = parsed
+            if part >= self._last_parts.get((mac_key, day), -1):
+                self._last_parts[(mac_key, day)] = part
+        logger.debug(f"LogWriter picked up {len(self._last_parts)} existing device-days from {self.log_dir}")
+
+    def _path(self, mac_key, day, part):
+        return os.path.join(self.log_dir, log_file_name(mac_key, day, part))
+
+    def _open_part(self, mac_key, day, part, count):
+        path = self._path(mac_key, day, part)
+        handle = open(path, 'a', encoding='utf-8')
+        self._last_parts[(mac_key, day)] = part
+        logger.debug(f"Opened log file {path} at {count} points")
+        return _OpenLog(day, part, count, handle)
+
+    def _current(self, mac_key, day):
+        """Return the open log for ``mac_key`` on ``day``, rolling over day or part as needed."""
+        state = self._open.get(mac_key)
+        if state is not None and state.day != day:
+            # UTC day rollover: the previous day's file is finished
+            state.handle.close()
+            del self._open[mac_key]
+            state = None
+
+        if state is None:
+            part = self._last_parts.get((mac_key, day))
+            if part is None:
+                state = self._open_part(mac_key, day, 0, 0)
+            else:
+                path = self._path(mac_key, day, part)
+                count = count_lines(path) if os.path.exists(path) else 0
+                state = self._open_part(mac_key, day, part, count)
+            self._open[mac_key] = state
+
+        if state.count >= self.max_points_per_file:
+            state.handle.close()
+            state = self._open_part(mac_key, day, state.part + 1, 0)
+            self._open[mac_key] = state
+
+        return state
+
+    def write(self, mac, lat, lng, timestamp=None):
+        """
+        Append one point to the device's current log file.
+
+        :param mac: MAC address as received (written verbatim into the line)
+        :param lat: Latitude
+        :param lng: Longitude
+        :param timestamp: ``%Y-%m-%d %H:%M:%S`` UTC string, defaults to now
+        :return: Path of the file the point was written to
+        """
+        if timestamp is None:
+            timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        return self.write_many([(timestamp, lat, lng, mac)])[-1]
+
+    def write_many(self, records, fsync=False):
+        """
+        Append a batch of points, issuing one write (and optionally one fsync) per file.
+
+        :param records: Iterable of ``(timestamp, lat, lng, mac)`` tuples, in arrival order
+        :param fsync: Whether to fsync every file touched by the batch
+        :return: List of the paths that were written, in commit order
+        """
+        records = list(records)
+        by_device = {}
+        for record in records:
+            by_device.setdefault(mac_to_file_key(record[3]), []).append(record)
+
+        written = []
+        with self._lock:
+            # Files of closed days may be compacted away, so their handles never outlive a batch
+            today = datetime.utcnow().strftime('%Y-%m-%d')
+            if today != self._today:
+                self._today = today
+                self._close_days_before(today)
+            if self.track_store is not None:
+                self.track_store.write_many(records, fsync)
+            for mac_key, device_records in by_device.items():
+                state = None
+                lines = []
+                points = []
+                for timestamp, lat, lng, mac in device_records:
+                    day = timestamp[:10]
+                    current = self._open.get(mac_key)
+                    if lines and (current.day != day or current.count >= self.max_points_per_file):
+                        # The file is about to roll over; commit what belongs in it first
+                        written.append(self._commit(state, lines, points, fsync))
+                        lines = []
+                        points = []
+                    state = self._current(mac_key, day)
+                    lines.append(f"{timestamp},{lat},{lng},{mac}\n")
+                    points.append((timestamp, lat, lng))
+                    state.count += 1
+                if lines:
+                    written.append(self._commit(state, lines, points, fsync))
+            if any(record[0][:10] < today for record in records):
+                self._close_days_before(today)
+            self._maybe_sweep()
+
+        return written
+
+    def _commit(self, state, lines, points, fsync):
+        data = ''.join(lines)
+        offset = state.handle.tell()
+        state.handle.write(data)
+        state.handle.flush()
+        if fsync:
+            os.fsync(state.handle.fileno())
+        state.last_write = time.monotonic()
+        if self.catalog is not None:
+            self.catalog.record(state.handle.name, offset, len(data.encode('utf-8')), *zip(*points))
+        return state.handle.name
+
+    def _close_days_before(self, day):
+        for mac_key in [k for k, s in self._open.items() if s.day < day]:
+            self._open.pop(mac_key).handle.close()
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self._sweep()
+
+    def _sweep(self):
+        now = time.monotonic()
+        self._last_sweep = now
+        for mac_key in [k for k, s in self._open.items() if now - s.last_write >= self.idle_timeout]:
+            state = self._open.pop(mac_key)
+            state.handle.close()
+            logger.debug(f"Closed idle log handle for {mac_key}")
+
+    def close_idle(self):
+        """Close every handle that has been idle for longer than ``idle_timeout``."""
+        with self._lock:
+            self._sweep()
+
+    def close(self):
+        with self._lock:
+            for state in self._open.values():
+                state.handle.close()
+            self._open.clear()
@@ -0,0 +1,90 @@
+# parsedcache.py
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ParsedFileCache:
+    """
+    Process-wide LRU of parsed track arrays, keyed by ``(path, size, mtime_ns)``.
+
+    A file whose size and mtime are unchanged is served from memory. A file that
+    only grew since it was cached (same inode, larger size) keeps its parsed
+    prefix and only the appended tail is parsed, so the active file of the day
+    costs one small read per request. Anything else is parsed again from scratch.
+
+    Entries are evicted least recently used first once their ``nbytes`` exceed
+    ``max_bytes``; an array larger than the whole budget is returned uncached.
+    Cached arrays are read-only and shared between threads.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (inode, size, mtime_ns, consumed, array)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.extends = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, path, parse_tail):
+        """
+        Return the parsed contents of ``path``.
+
+        :param parse_tail: ``f(path, offset) -> (array, consumed)`` parsing the file from byte
+                           ``offset``; ``consumed`` is the offset the next tail starts at, so a
+                           partially written record at the end is left for a later call
+        """
+        st = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[1] == st.st_size and entry[2] == st.st_mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[4]
+
+        if entry is not None and entry[0] == st.st_ino and entry[3] <= st.st_size:
+            # Appended to since it was cached: parse only the new bytes
+            tail, consumed = parse_tail(path, entry[3])
+            array = np.concatenate([entry[4], tail]) if len(tail) else entry[4]
+            consumed += entry[3]
+            counter = 'extends'
+        else:
+            array, consumed = parse_tail(path, 0)
+            counter = 'misses'
+        array.flags.writeable = False
+
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old[4].nbytes
+            if array.nbytes <= self.max_bytes:
+                self._entries[path] = (st.st_ino, st.st_size, st.st_mtime_ns, consumed, array)
+                self._bytes += array.nbytes
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted[4].nbytes
+                    self.evictions += 1
+        return array
+
+    def discard(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= entry[4].nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'extends': self.extends,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
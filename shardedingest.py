@@ -0,0 +1,400 @@
+# shardedingest.py
+import calendar
+import json
+import logging
+import multiprocessing
+import queue
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+
+from lastpoint import LastPointCache
+from livetable import LatestPositionTable
+from logwriter import mac_to_file_key, normalize_mac
+from storage import open_storage
+
+logger = logging.getLogger(__name__)
+
+# Pulls the MAC out of a raw payload without decoding the whole JSON document
+MAC_PATTERN = re.compile(rb'"mac"\s*:\s*"([^"]*)"')
+
+KIND_PAYLOAD = 0   # raw MQTT payload bytes, parsed and de-duplicated by the worker
+KIND_POINT = 1     # (mac, lat, lng, timestamp) from HTTP, de-duplicated by the worker
+KIND_RECORD = 2    # (timestamp, lat, lng, mac) already validated, written as-is
+
+
+def shard_for(mac, shards):
+    """Stable shard index for a MAC; every point of a device goes to the same worker."""
+    return zlib.crc32(mac_to_file_key(mac).encode()) % shards
+
+
+def parse_payload(payload):
+    """
+    Decode an MQTT payload into ``(normalized_mac, lat, lng)``.
+
+    :return: The tuple, or None if the MAC or the coordinates are missing or invalid
+    """
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    mac = data.get("mac")
+    lat = data.get("latitude")
+    lng = data.get("longitude")
+    if not mac or not isinstance(mac, str):
+        return None
+    if isinstance(lat, bool) or isinstance(lng, bool) or not isinstance(lat, (int, float)) \
+            or not isinstance(lng, (int, float)):
+        return None
+    try:
+        mac = normalize_mac(mac)
+    except ValueError:
+        return None
+    return mac, float(lat), float(lng)
+
+
+def _utc_string(epoch):
+    return datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _worker_main(shard, inbox, results, config):
+    """
+    Worker process: owns the stored points of the MACs that hash to ``shard``.
+
+    Coalesces whatever is waiting in ``inbox`` into one batch, de-duplicates it with
+    its own last-point cache, commits it with the storage backend's ``write_many``, publishes the
+    newest position per device to the shared latest-position table and reports
+    counters and per-point latencies back on ``results``, together with the ack ids
+    of the batches it committed and the error if the commit failed.
+    """
+    logging.basicConfig(level=config['log_level'], format=f'%(asctime)s - shard {shard} - %(levelname)s - %(message)s')
+
+    writer = open_storage(**config['storage'])
+
+    def seed(mac_key):
+        latest = writer.latest(mac_key)
+        return latest[1:] if latest else None
+
+    last_points = LastPointCache(config['duplicate_meters'], loader=seed)
+    latest_table = None
+    if config['latest_table_name']:
+        latest_table = LatestPositionTable(config['latest_table_name'], capacity=config['latest_table_capacity'])
+    last_fsync = time.monotonic()
+    stopping = False
+
+    while not stopping:
+        message = inbox.get()
+        if message is None:
+            break
+        batches = [message]
+        while len(batches) < config['max_coalesce']:
+            try:
+                message = inbox.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                stopping = True
+                break
+            batches.append(message)
+
+        records = []
+        latest = {}
+        received = []
+        fsync = False
+        invalid = 0
+        acks = []
+        for items, batch_fsync, ack in batches:
+            fsync = fsync or batch_fsync
+            if ack is not None:
+                acks.append(ack)
+            for kind, data, received_at in items:
+                if kind == KIND_RECORD:
+                    records.append(data)
+                    received.append(received_at)
+                    timestamp, lat, lng, mac = data
+                    epoch = calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+                    if mac not in latest or latest[mac][2] <= epoch:
+                        latest[mac] = (lat, lng, epoch)
+                    continue
+                if kind == KIND_PAYLOAD:
+                    parsed = parse_payload(data)
+                    if parsed is None:
+                        invalid += 1
+                        continue
+                    mac, lat, lng = parsed
+                    timestamp = _utc_string(received_at)
+                else:
+                    mac, lat, lng, timestamp = data
+                latest[mac] = (lat, lng, received_at)
+                if last_points.accept(mac, lat, lng):
+                    records.append((timestamp, lat, lng, mac))
+                    received.append(received_at)
+
+        if not fsync and config['fsync'] == 'batch':
+            fsync = True
+        elif not fsync and config['fsync'] == 'interval' and time.monotonic() - last_fsync >= config['fsync_interval']:
+            fsync = True
+        if fsync:
+            last_fsync = time.monotonic()
+
+        error = None
+        if records:
+            try:
+                writer.write_many(records, fsync=fsync)
+            except Exception as e:
+                logger.exception(f"Shard {shard} failed to commit {len(records)} points")
+                error = f"{type(e).__name__}: {e}"
+        committed = time.time()
+
+        if latest_table is not None:
+            for mac, (lat, lng, epoch) in latest.items():
+                try:
+                    # Back-filled batches must not replace a newer live position
+                    current = latest_table.get(mac)
+                    if current is None or current['epoch'] <= int(epoch):
+                        latest_table.update(mac, lat, lng, epoch)
+                except Exception:
+                    logger.exception(f"Shard {shard} could not publish the position of {mac}")
+
+        processed = sum(len(items) for items, _, _ in batches)
+        latencies = [(committed - r) * 1000 for r in received[::max(1, len(received) // 200)]]
+        results.put((shard, processed, len(records) if error is None else 0, invalid, latencies, acks, error))
+
+    writer.close()
+    if latest_table is not None:
+        latest_table.close()
+
+
+class ShardedIngest:
+    """
+    Spreads MQTT ingest over ``shards`` worker processes, sharded by MAC hash.
+
+    The paho network thread only runs ``on_message``, which finds the MAC with a
+    regex, hashes it and appends the raw payload to that shard's buffer. Buffers
+    are shipped every ``flush_interval`` seconds (or every ``max_batch`` points)
+    so each inter-process hop carries a batch. Because a MAC always maps to the
+    same worker, per-device order is preserved and every log file has exactly
+    one writer.
+
+    Each worker opens its own storage backend from ``storage_config`` (the keyword
+    arguments of ``storage.open_storage``).
+
+    Workers publish positions straight into the shared latest-position table named
+    ``latest_table_name``, so the web processes never wait on them.
+
+    ``on_commit`` is called (without arguments) from the results thread after each
+    worker batch, e.g. to wake the live-stream broadcaster.
+
+    ``write_many`` waits until every worker involved confirms it committed its part
+    of the batch (``ack_timeout`` seconds at most); ``put`` and ``on_message`` only
+    queue. ``stop`` gives each worker ``stop_timeout`` seconds to drain before it is
+    terminated.
+
+    Workers are forked by default so they do not re-import the application module;
+    call ``start`` before other background threads are running.
+    """
+
+    def __init__(self, shards, storage_config, duplicate_meters=0.01,
+                 flush_interval=0.05, max_batch=2000, fsync='interval', fsync_interval=1.0,
+                 latest_table_name=None, latest_table_capacity=4096, log_level=logging.WARNING,
+                 latency_samples=10000, start_method='fork', on_commit=None, ack_timeout=30.0, stop_timeout=10.0):
+        self.shards = shards
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self.ack_timeout = ack_timeout
+        self.stop_timeout = stop_timeout
+        self.config = {
+            'storage': storage_config,
+            'duplicate_meters': duplicate_meters,
+            'fsync': fsync,
+            'fsync_interval': fsync_interval,
+            'max_coalesce': 64,
+            'log_level': log_level,
+            'latest_table_name': latest_table_name,
+            'latest_table_capacity': latest_table_capacity,
+        }
+
+        self._context = multiprocessing.get_context(start_method)
+        self._lock = threading.Lock()
+        self._buffers = [[] for _ in range(shards)]
+        self._inboxes = []
+        self._processes = []
+        self._results = None
+        self._threads = []
+        self._running = False
+        self._latencies = deque(maxlen=latency_samples)
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._stats = {'processed': 0, 'written': 0, 'invalid': 0, 'unroutable': 0, 'failed_commits': 0,
+                       'terminated': 0}
+        self._acks = {}  # ack id -> [shards still to confirm, errors, threading.Event]
+        self._next_ack = 0
+
+    def start(self):
+        self._results = self._context.Queue()
+        for shard in range(self.shards):
+            inbox = self._context.Queue()
+            process = self._context.Process(target=_worker_main, name=f'ingest-shard-{shard}',
+                                            args=(shard, inbox, self._results, self.config), daemon=True)
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        self._running = True
+        for target, name in ((self._flush_loop, 'ingest-flusher'), (self._results_loop, 'ingest-results')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.shards} ingest shard workers")
+        return self
+
+    def _append(self, shard, item):
+        with self._lock:
+            buffer = self._buffers[shard]
+            buffer.append(item)
+            self._submitted += 1
+            if len(buffer) >= self.max_batch:
+                self._buffers[shard] = []
+                self._inboxes[shard].put((buffer, False, None))
+
+    def on_message(self, client, userdata, msg):
+        """paho ``on_message`` callback: route the raw payload to the shard that owns its MAC."""
+        match = MAC_PATTERN.search(msg.payload)
+        if not match or not match.group(1).strip():
+            with self._stats_lock:
+                self._stats['unroutable'] += 1
+            logger.warning("MQTT message missing MAC address")
+            return
+        mac = match.group(1).decode('utf-8', 'replace').strip()
+        self._append(shard_for(mac, self.shards), (KIND_PAYLOAD, msg.payload, time.time()))
+
+    def put(self, mac, lat, lng, timestamp):
+        """Queue one point from another ingest path; the owning worker de-duplicates it."""
+        self._append(shard_for(mac, self.shards), (KIND_POINT, (mac, lat, lng, timestamp), time.time()))
+        return True
+
+    def write_many(self, records, fsync=False):
+        """
+        Commit already validated ``(timestamp, lat, lng, mac)`` records, one batch per shard, and wait for the workers.
+
+        :raises RuntimeError: if a worker failed to commit its part of the batch
+        :raises TimeoutError: if the workers did not confirm the batch within ``ack_timeout`` seconds
+        """
+        per_shard = {}
+        now = time.time()
+        for record in records:
+            per_shard.setdefault(shard_for(record[3], self.shards), []).append((KIND_RECORD, record, now))
+        if not per_shard:
+            return
+        done = threading.Event()
+        with self._stats_lock:
+            ack = self._next_ack
+            self._next_ack += 1
+            self._acks[ack] = [len(per_shard), [], done]
+        with self._lock:
+            self._submitted += len(records)
+            for shard, items in per_shard.items():
+                self._inboxes[shard].put((items, fsync, ack))
+
+        confirmed = done.wait(self.ack_timeout)
+        with self._stats_lock:
+            errors = self._acks.pop(ack)[1]
+        if not confirmed:
+            raise TimeoutError(f"Ingest workers did not confirm a batch of {len(records)} points "
+                               f"within {self.ack_timeout} s")
+        if errors:
+            raise RuntimeError(f"Ingest workers failed to commit a batch: {'; '.join(errors)}")
+
+    def _flush_buffers(self):
+        with self._lock:
+            for shard, buffer in enumerate(self._buffers):
+                if buffer:
+                    self._buffers[shard] = []
+                    self._inboxes[shard].put((buffer, False, None))
+
+    def _flush_loop(self):
+        while self._running:
+            time.sleep(self.flush_interval)
+            self._flush_buffers()
+
+    def _results_loop(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+            shard, processed, written, invalid, latencies, acks, error = result
+            with self._stats_lock:
+                self._stats['processed'] += processed
+                self._stats['written'] += written
+                self._stats['invalid'] += invalid
+                if error is not None:
+                    self._stats['failed_commits'] += 1
+                self._latencies.extend(latencies)
+                for ack in acks:
+                    waiting = self._acks.get(ack)
+                    if waiting is None:
+                        continue  # the writer gave up waiting
+                    waiting[0] -= 1
+                    if error is not None:
+                        waiting[1].append(f"shard {shard}: {error}")
+                    if waiting[0] == 0:
+                        waiting[2].set()
+            if self.on_commit is not None:
+                self.on_commit()
+
+    def flush(self, timeout=None):
+        """Ship pending buffers and wait until the workers have processed everything submitted so far."""
+        self._flush_buffers()
+        with self._lock:
+            target = self._submitted
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._stats_lock:
+                if self._stats['processed'] >= target:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+
+    def stop(self):
+        if not self._running:
+            return
+        self._flush_buffers()
+        self._running = False
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process, inbox in zip(self._processes, self._inboxes):
+            process.join(self.stop_timeout)
+            if process.is_alive():
+                # A stuck worker must not hang shutdown; what it had not committed is lost
+                logger.error(f"{process.name} did not stop within {self.stop_timeout} s, terminating it")
+                process.terminate()
+                process.join(self.stop_timeout)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+                inbox.cancel_join_thread()
+                with self._stats_lock:
+                    self._stats['terminated'] += 1
+        self._results.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            submitted = self._submitted
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = list(self._latencies)
+        latencies.sort()
+        stats['submitted'] = submitted
+        stats['shards'] = self.shards
+        stats['pending'] = stats['submitted'] - stats['processed']
+        stats['latency_p50_ms'] = latencies[len(latencies) // 2] if latencies else 0.0
+        stats['latency_p99_ms'] = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] if latencies else 0.0
+        return stats
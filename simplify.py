@@ -0,0 +1,99 @@
+# simplify.py
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from geo import EARTH_RADIUS_METERS
+
+# Ground resolution of a 256 px Web Mercator tile at zoom 0 on the equator
+METERS_PER_PIXEL_Z0 = 2 * np.pi * EARTH_RADIUS_METERS / 256
+MAX_ZOOM = 22
+
+
+def zoom_tolerance(zoom, lat):
+    """Tolerance in metres that keeps the simplified line within one screen pixel at ``zoom``."""
+    return METERS_PER_PIXEL_Z0 * np.cos(np.radians(lat)) / 2 ** zoom
+
+
+def project(lats, lngs):
+    """Equirectangular projection to metres around the mean latitude; plenty for city-scale tracks."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    scale = np.radians(1) * EARTH_RADIUS_METERS
+    x = lngs * scale * np.cos(np.radians(lats.mean()))
+    y = lats * scale
+    return x, y
+
+
+def rdp_mask(lats, lngs, tolerance):
+    """
+    Ramer–Douglas–Peucker simplification.
+
+    Each step measures every interior point of a span against its chord with one
+    vectorized expression, so the Python loop only runs once per kept vertex.
+
+    :param tolerance: Maximum distance in metres between the original and the simplified line
+    :return: Boolean mask of the points to keep; the first and last are always kept
+    """
+    n = len(lats)
+    if n < 3 or tolerance <= 0:
+        return np.ones(n, dtype=bool)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    x, y = project(lats, lngs)
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            # Closed span (returned to its start): fall back to the distance from the start
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(px * dy - py * dx) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+class SimplificationCache:
+    """
+    LRU of simplification results keyed by ``(source, tolerance)``.
+
+    ``source`` must change whenever the underlying points do (e.g. include the
+    record count or the file mtime), so entries never go stale.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, source, tolerance, compute):
+        key = (source, round(float(tolerance), 3))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
@@ -0,0 +1,618 @@
+# storage.py
+import os
+import fcntl
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import repeat
+
+import numpy as np
+
+from analysis import StayPointDetector, time_ordered
+from areaindex import AreaIndex
+from daysummary import DaySummaryFiles, SUMMARY_DTYPE, extend_summary, summarize_track, summary_dict, \
+    empty_summary
+from daystops import DayStopFiles
+from heatgrid import HeatGridFiles, HEAT_LEVELS, HEAT_DTYPE, counted_points, heat_cells
+from logcatalog import LogCatalog
+from logwriter import LogWriter, mac_to_file_key
+from trackstore import TrackStore, TRACK_DTYPE, EMPTY_TRACK, COORD_SCALE, day_start_epoch, to_records
+
+logger = logging.getLogger(__name__)
+
+STORAGE_FILES = 'files'
+STORAGE_SQLITE = 'sqlite'
+
+
+def _days_between(start, end):
+    """UTC days touched by ``[start, end)`` (epoch seconds)."""
+    day_start = start - (start % 86400)
+    days = []
+    while day_start < end:
+        days.append(time.strftime('%Y-%m-%d', time.gmtime(day_start)))
+        day_start += 86400
+    return days
+
+
+def _time_ordered(track):
+    return track[np.argsort(track['t'], kind='stable')]
+
+
+class Storage:
+    """
+    Interface of the GPS point stores; every endpoint reads and writes through it.
+
+    A device-day is returned as a TRACK_DTYPE array in the order its points were
+    appended, so record positions stay valid while the day grows and can be used
+    as cursors. ``write_many`` takes ``(timestamp, lat, lng, mac)`` tuples.
+
+    Subclasses implement ``write_many``, ``read`` and ``device_days``; the other
+    queries have generic versions built on those that backends with an index override.
+    """
+
+    name = None
+
+    def write_many(self, records, fsync=False):
+        """
+        Append a batch of points.
+
+        :return: List of the units written (files or device-days), in commit order
+        """
+        raise NotImplementedError
+
+    def read(self, mac, day):
+        raise NotImplementedError
+
+    def device_days(self):
+        """Sorted ``(mac_key, day)`` pairs that have points."""
+        raise NotImplementedError
+
+    def locate_range(self, mac, day, start, end, track=None):
+        """Record positions of the points of a device-day with ``start <= t < end``, in append order."""
+        if track is None:
+            track = self.read(mac, day)
+        return np.flatnonzero((track['t'] >= start) & (track['t'] < end))
+
+    def read_range(self, mac, day, start, end):
+        track = self.read(mac, day)
+        return track[self.locate_range(mac, day, start, end, track=track)]
+
+    def devices_for_day(self, day):
+        return sorted(mac_key for mac_key, d in self.device_days() if d == day)
+
+    def days_for_device(self, mac):
+        mac_key = mac_to_file_key(mac)
+        return [day for k, day in self.device_days() if k == mac_key]
+
+    def day_version(self, day):
+        """Value that changes whenever points of ``day`` are added or removed; keys caches of a whole date."""
+        return tuple((mac_key, len(self.read(mac_key, day))) for mac_key in self.devices_for_day(day))
+
+    def latest(self, mac):
+        """:return: Newest ``(epoch, lat, lng)`` of the device, or None"""
+        for day in reversed(self.days_for_device(mac)):
+            track = self.read(mac, day)
+            if len(track):
+                newest = track[int(np.argmax(track['t']))]
+                return int(newest['t']), int(newest['lat']) / COORD_SCALE, int(newest['lng']) / COORD_SCALE
+        return None
+
+    def summary(self, mac, day):
+        """Point count, time span, bbox, distance and speeds of a device-day (see ``daysummary.summary_dict``)."""
+        return summary_dict(summarize_track(self.read(mac, day)))
+
+    def heat_grid(self, mac, day):
+        """Point counts per cell of every ``heatgrid.HEAT_LEVELS`` grid for a device-day (``HEAT_DTYPE`` array)."""
+        return heat_cells(self.read(mac, day))
+
+    def stop_detector(self, mac, day):
+        """``analysis.StayPointDetector`` with the default settings that has seen every fix of a device-day."""
+        detector = StayPointDetector()
+        detector.feed(time_ordered(self.read(mac, day)))
+        return detector
+
+    def points_in_bbox(self, min_lat, min_lng, max_lat, max_lng, start, end):
+        """
+        Points inside a lat/lng box with ``start <= t < end``.
+
+        :return: ``{mac_key: track}`` with each track in time order
+        """
+        lo = np.rint(np.array([min_lat, min_lng]) * COORD_SCALE)
+        hi = np.rint(np.array([max_lat, max_lng]) * COORD_SCALE)
+        days = set(_days_between(start, end))
+        found = {}
+        for mac_key, day in self.device_days():
+            if day not in days:
+                continue
+            for window_start, window_end in self._candidate_windows(mac_key, day, min_lat, min_lng, max_lat, max_lng,
+                                                                    start, end):
+                track = self.read_range(mac_key, day, window_start, window_end)
+                inside = track[(track['lat'] >= lo[0]) & (track['lat'] <= hi[0]) &
+                               (track['lng'] >= lo[1]) & (track['lng'] <= hi[1])]
+                if len(inside):
+                    found.setdefault(mac_key, []).append(inside)
+        return {mac_key: _time_ordered(np.concatenate(tracks)) for mac_key, tracks in sorted(found.items())}
+
+    def _candidate_windows(self, mac_key, day, min_lat, min_lng, max_lat, max_lng, start, end):
+        """Time windows of a device-day that can hold points inside the box; without an index, the whole query."""
+        return [(start, end)]
+
+    def pending_compaction(self, before):
+        """``(mac_key, day)`` pairs of days before ``before`` that ``compact`` would rewrite."""
+        return []
+
+    def compact(self, mac_key, day):
+        """:return: ``(points read, points kept)``"""
+        raise NotImplementedError
+
+    def stats(self):
+        return {'backend': self.name, 'device_days': len(self.device_days())}
+
+    def close(self):
+        pass
+
+
+class FileStorage(Storage):
+    """
+    Per-device, per-day text logs written by ``LogWriter``, read back through the binary ``TrackStore``.
+
+    Closed days are compacted into one file each. Writes to past days (backfills)
+    and compaction exclude each other through an ``flock`` on a lock file in the
+    tracks directory, which also covers writers in other processes.
+
+    The files are looked up in a ``LogCatalog`` kept up to date by the writer, so
+    listings and day summaries never scan the directories; it is saved on ``close``.
+    Box queries are narrowed by the grid-cell ``AreaIndex``; day summaries, stay
+    points and heatmap grids come from ``DaySummaryFiles``, ``DayStopFiles`` and
+    ``HeatGridFiles`` sidecars. All of them are maintained at ingest.
+    """
+
+    name = STORAGE_FILES
+
+    def __init__(self, log_dir, tracks_dir, max_points_per_file=500, cache=None):
+        self.catalog = LogCatalog(log_dir, tracks_dir)
+        self.track_store = TrackStore(tracks_dir, log_dir, cache=cache, catalog=self.catalog)
+        self.log_writer = LogWriter(log_dir, max_points_per_file=max_points_per_file, track_store=self.track_store,
+                                    catalog=self.catalog)
+        self.area_index = AreaIndex(tracks_dir, self.track_store.read, cache=cache)
+        self.summaries = DaySummaryFiles(tracks_dir)
+        self.day_stops = DayStopFiles(tracks_dir)
+        self.heat_grids = HeatGridFiles(tracks_dir, cache=cache)
+        self.lock_path = os.path.join(tracks_dir, '.compaction.lock')
+
+    @contextmanager
+    def _past_days_lock(self, operation):
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def write_many(self, records, fsync=False):
+        records = list(records)
+        today = datetime.utcnow().strftime('%Y-%m-%d')
+        if any(record[0][:10] < today for record in records):
+            with self._past_days_lock(fcntl.LOCK_SH):
+                return self._write(records, fsync)
+        return self._write(records, fsync)
+
+    def _write(self, records, fsync):
+        written = self.log_writer.write_many(records, fsync)
+        # Indexed once the points are stored, so a posting never leads to points that are not there yet
+        self.area_index.add(records)
+        self.summaries.add(records, self.track_store.read)
+        self.day_stops.add(records, self.track_store.read)
+        self.heat_grids.add(records, self.track_store.read)
+        return written
+
+    def read(self, mac, day):
+        return self.track_store.read(mac, day)
+
+    def locate_range(self, mac, day, start, end, track=None):
+        # The minute index of the track store limits the read to the requested window
+        return self.track_store.locate_range(mac, day, start, end, track=track)
+
+    def read_range(self, mac, day, start, end):
+        return self.track_store.read_range(mac, day, start, end)
+
+    def device_days(self):
+        return self.track_store.device_days()
+
+    def devices_for_day(self, day):
+        return self.track_store.devices_for_day(day)
+
+    def day_version(self, day):
+        # Point counts from the catalog: only the files of the day are stat'ed, none is read
+        return tuple(self.catalog.day_points(day).items())
+
+    def _candidate_windows(self, mac_key, day, min_lat, min_lng, max_lat, max_lng, start, end):
+        return self.area_index.candidate_windows(mac_key, day, min_lat, min_lng, max_lat, max_lng, start, end)
+
+    def summary(self, mac, day):
+        # Maintained as the points were written; only read back when the sidecar is stale
+        mac_key = mac_to_file_key(mac)
+        points = self.catalog.summary(mac_key, day)['points']
+        return summary_dict(self.summaries.get(mac_key, day, points, self.track_store.read))
+
+    def heat_grid(self, mac, day):
+        mac_key = mac_to_file_key(mac)
+        points = self.catalog.summary(mac_key, day)['points']
+        return self.heat_grids.get(mac_key, day, points, self.track_store.read)
+
+    def stop_detector(self, mac, day):
+        # Detected at ingest; only the fixes since the last checkpoint are replayed
+        return self.day_stops.get(mac_to_file_key(mac), day, self.track_store.read)
+
+    def pending_compaction(self, before):
+        return self.track_store.uncompacted_days(before)
+
+    def compact(self, mac_key, day):
+        with self._past_days_lock(fcntl.LOCK_EX):
+            result = self.track_store.compact(mac_key, day)
+            # The day is now sorted and de-duplicated, so stop checkpoints no longer match its record positions
+            self.day_stops.forget(mac_key, day)
+            return result
+
+    def stats(self):
+        stats = super().stats()
+        stats['catalog'] = self.catalog.stats()
+        stats['area_index'] = self.area_index.stats()
+        stats['summaries'] = self.summaries.stats()
+        stats['stops'] = self.day_stops.stats()
+        stats['heatmap'] = self.heat_grids.stats()
+        return stats
+
+    def close(self):
+        self.log_writer.close()
+        self.track_store.close()
+        self.catalog.save()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    mac TEXT NOT NULL,
+    t INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    lat INTEGER NOT NULL,
+    lng INTEGER NOT NULL,
+    PRIMARY KEY (mac, t, seq)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS days (
+    mac TEXT NOT NULL,
+    day TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (mac, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS days_by_day ON days (day);
+
+CREATE TABLE IF NOT EXISTS cells (
+    id INTEGER PRIMARY KEY,
+    mac TEXT NOT NULL,
+    minute INTEGER NOT NULL,
+    UNIQUE (mac, minute)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS cell_boxes USING rtree_i32(
+    id, min_lat, max_lat, min_lng, max_lng, min_minute, max_minute
+);
+
+CREATE TABLE IF NOT EXISTS day_summaries (
+    mac TEXT NOT NULL,
+    day TEXT NOT NULL,
+    summary BLOB NOT NULL,
+    PRIMARY KEY (mac, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS heat_cells (
+    mac TEXT NOT NULL,
+    day TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (mac, day, level, row, col)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS day_stops (
+    mac TEXT NOT NULL,
+    day TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (mac, day)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteStorage(Storage):
+    """
+    All points in one SQLite database in WAL mode.
+
+    ``points`` is clustered on ``(mac, t)`` so a device's time window is one
+    index range. ``seq`` numbers the points of a device-day in append order and
+    is their record position. ``days`` counts the points per device-day, which
+    lists devices and days without scanning and hands out the next ``seq``.
+    Every device-minute gets a bounding box in the ``cell_boxes`` R*Tree, so box
+    queries only touch the minutes that can contain a match. ``day_summaries``
+    holds the running ``daysummary`` record of every device-day, ``heat_cells``
+    its heatmap grid counts and ``day_stops`` its stay-point detector state, all
+    updated in the same transaction as its points.
+
+    Each thread gets its own connection; writes are serialized in-process and,
+    between processes, by SQLite's write lock.
+    """
+
+    name = STORAGE_SQLITE
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SQLITE_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def write_many(self, records, fsync=False):
+        """Insert a batch in one transaction; ``fsync`` makes the commit durable (``synchronous=FULL``)."""
+        by_day = {}
+        for timestamp, lat, lng, mac in records:
+            by_day.setdefault((mac_to_file_key(mac), timestamp[:10]), []).append((timestamp, lat, lng))
+
+        conn = self._connection()
+        with self._lock:
+            conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for (mac_key, day), points in by_day.items():
+                    track = to_records(*zip(*points))
+                    row = conn.execute('SELECT points FROM days WHERE mac = ? AND day = ?', (mac_key, day)).fetchone()
+                    first = row[0] if row else 0
+                    conn.executemany(
+                        'INSERT INTO points (mac, t, seq, lat, lng) VALUES (?, ?, ?, ?, ?)',
+                        zip(repeat(mac_key), track['t'].tolist(), range(first, first + len(track)),
+                            track['lat'].tolist(), track['lng'].tolist()))
+                    conn.execute(
+                        'INSERT INTO days (mac, day, points) VALUES (?, ?, ?) '
+                        'ON CONFLICT (mac, day) DO UPDATE SET points = points + excluded.points',
+                        (mac_key, day, len(track)))
+                    self._update_cells(conn, mac_key, track)
+                    self._update_summary(conn, mac_key, day, track, first)
+                    self._update_heat(conn, mac_key, day, track, first)
+                    self._update_stops(conn, mac_key, day, track, first)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return [f'{mac_key}/{day}' for mac_key, day in by_day]
+
+    def _update_summary(self, conn, mac_key, day, track, stored):
+        """Fold a batch into the device-day's summary; ``stored`` is how many points the day had before it."""
+        row = conn.execute('SELECT summary FROM day_summaries WHERE mac = ? AND day = ?', (mac_key, day)).fetchone()
+        summary = empty_summary() if stored == 0 else None
+        if row is not None:
+            previous = np.frombuffer(row[0], dtype=SUMMARY_DTYPE).reshape(())
+            if previous['points'] == stored:
+                summary = previous
+        summary = extend_summary(summary, track) if summary is not None else None
+        if summary is None:
+            # A backfill or a day stored before summaries were kept: summarize all of it
+            summary = summarize_track(self.read(mac_key, day))
+        conn.execute('INSERT OR REPLACE INTO day_summaries (mac, day, summary) VALUES (?, ?, ?)',
+                     (mac_key, day, summary.tobytes()))
+
+    def _update_heat(self, conn, mac_key, day, track, stored):
+        """Add a batch to the device-day's heatmap counts; ``stored`` is how many points the day had before it."""
+        counted = conn.execute('SELECT COALESCE(SUM(count), 0) FROM heat_cells WHERE mac = ? AND day = ? AND level = ?',
+                               (mac_key, day, HEAT_LEVELS[0])).fetchone()[0]
+        if counted != stored:
+            # A day stored before grids were kept: count all of it
+            conn.execute('DELETE FROM heat_cells WHERE mac = ? AND day = ?', (mac_key, day))
+            track = self.read(mac_key, day)
+        cells = heat_cells(track)
+        conn.executemany(
+            'INSERT INTO heat_cells (mac, day, level, row, col, count) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (mac, day, level, row, col) DO UPDATE SET count = count + excluded.count',
+            zip(repeat(mac_key), repeat(day), cells['level'].tolist(), cells['row'].tolist(), cells['col'].tolist(),
+                cells['count'].tolist()))
+
+    def _update_stops(self, conn, mac_key, day, track, stored):
+        """Feed a batch to the device-day's stop detector; ``stored`` is how many points the day had before it."""
+        row = conn.execute('SELECT state FROM day_stops WHERE mac = ? AND day = ?', (mac_key, day)).fetchone()
+        detector = self._saved_detector(row[0] if row else None, stored)
+        if detector is not None and (detector.last_t is None or int(track['t'].min()) >= detector.last_t):
+            detector.feed(time_ordered(track))
+        else:
+            # A backfill or a day stored before stops were kept: detect over all of it
+            detector = StayPointDetector()
+            detector.feed(time_ordered(self.read(mac_key, day)))
+        conn.execute('INSERT OR REPLACE INTO day_stops (mac, day, state) VALUES (?, ?, ?)',
+                     (mac_key, day, json.dumps(detector.state())))
+
+    @staticmethod
+    def _saved_detector(state, points):
+        """Detector of a ``day_stops`` state if it has seen exactly ``points`` fixes with the default settings."""
+        if state is None:
+            return StayPointDetector() if points == 0 else None
+        detector = StayPointDetector.from_state(json.loads(state))
+        default = StayPointDetector()
+        if detector.points != points or \
+                (detector.radius_m, detector.min_dwell_s) != (default.radius_m, default.min_dwell_s):
+            return None
+        return detector
+
+    @staticmethod
+    def _update_cells(conn, mac_key, track):
+        """Widen (or create) the R*Tree box of every device-minute the batch touches."""
+        minutes = track['t'] // 60
+        for minute in np.unique(minutes).tolist():
+            cell = track[minutes == minute]
+            box = [int(cell['lat'].min()), int(cell['lat'].max()), int(cell['lng'].min()), int(cell['lng'].max())]
+            row = conn.execute(
+                'SELECT c.id, b.min_lat, b.max_lat, b.min_lng, b.max_lng FROM cells c '
+                'JOIN cell_boxes b ON b.id = c.id WHERE c.mac = ? AND c.minute = ?', (mac_key, minute)).fetchone()
+            if row is None:
+                cell_id = conn.execute('INSERT INTO cells (mac, minute) VALUES (?, ?)', (mac_key, minute)).lastrowid
+                conn.execute('INSERT INTO cell_boxes VALUES (?, ?, ?, ?, ?, ?, ?)', (cell_id, *box, minute, minute))
+            else:
+                cell_id, min_lat, max_lat, min_lng, max_lng = row
+                conn.execute(
+                    'UPDATE cell_boxes SET min_lat = ?, max_lat = ?, min_lng = ?, max_lng = ? WHERE id = ?',
+                    (min(min_lat, box[0]), max(max_lat, box[1]), min(min_lng, box[2]), max(max_lng, box[3]), cell_id))
+
+    @staticmethod
+    def _track(rows):
+        """TRACK_DTYPE array from ``(seq, t, lat, lng)`` rows, in ``seq`` (append) order."""
+        if not rows:
+            return EMPTY_TRACK
+        columns = np.array(rows, dtype=np.int64)
+        columns = columns[np.argsort(columns[:, 0], kind='stable')]
+        track = np.empty(len(columns), dtype=TRACK_DTYPE)
+        track['t'] = columns[:, 1]
+        track['lat'] = columns[:, 2]
+        track['lng'] = columns[:, 3]
+        return track
+
+    def _select_window(self, mac_key, start, end, columns='seq, t, lat, lng'):
+        return self._connection().execute(
+            f'SELECT {columns} FROM points WHERE mac = ? AND t >= ? AND t < ?', (mac_key, start, end)).fetchall()
+
+    def read(self, mac, day):
+        start = day_start_epoch(day)
+        return self._track(self._select_window(mac_to_file_key(mac), start, start + 86400))
+
+    def locate_range(self, mac, day, start, end, track=None):
+        day_start = day_start_epoch(day)
+        rows = self._select_window(mac_to_file_key(mac), max(start, day_start), min(end, day_start + 86400), 'seq')
+        positions = np.sort(np.array([row[0] for row in rows], dtype=np.int64))
+        if track is not None:
+            # Points committed after the caller read the day are not in its array
+            positions = positions[positions < len(track)]
+        return positions
+
+    def read_range(self, mac, day, start, end):
+        day_start = day_start_epoch(day)
+        return self._track(self._select_window(mac_to_file_key(mac), max(start, day_start),
+                                               min(end, day_start + 86400)))
+
+    def device_days(self):
+        return [tuple(row) for row in self._connection().execute('SELECT mac, day FROM days ORDER BY mac, day')]
+
+    def devices_for_day(self, day):
+        rows = self._connection().execute('SELECT mac FROM days WHERE day = ? ORDER BY mac', (day,))
+        return [row[0] for row in rows]
+
+    def day_version(self, day):
+        rows = self._connection().execute('SELECT mac, points FROM days WHERE day = ? ORDER BY mac', (day,))
+        return tuple(tuple(row) for row in rows)
+
+    def days_for_device(self, mac):
+        rows = self._connection().execute('SELECT day FROM days WHERE mac = ? ORDER BY day', (mac_to_file_key(mac),))
+        return [row[0] for row in rows]
+
+    def latest(self, mac):
+        row = self._connection().execute(
+            'SELECT t, lat, lng FROM points WHERE mac = ? ORDER BY t DESC LIMIT 1', (mac_to_file_key(mac),)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1] / COORD_SCALE, row[2] / COORD_SCALE
+
+    def summary(self, mac, day):
+        mac_key = mac_to_file_key(mac)
+        row = self._connection().execute(
+            'SELECT d.points, s.summary FROM days d LEFT JOIN day_summaries s ON s.mac = d.mac AND s.day = d.day '
+            'WHERE d.mac = ? AND d.day = ?', (mac_key, day)).fetchone()
+        if row is not None and row[1] is not None:
+            summary = np.frombuffer(row[1], dtype=SUMMARY_DTYPE).reshape(())
+            if summary['points'] == row[0]:
+                return summary_dict(summary)
+        return super().summary(mac_key, day)
+
+    def heat_grid(self, mac, day):
+        mac_key = mac_to_file_key(mac)
+        conn = self._connection()
+        rows = conn.execute('SELECT level, row, col, count FROM heat_cells WHERE mac = ? AND day = ? '
+                            'ORDER BY level, row, col', (mac_key, day)).fetchall()
+        points = conn.execute('SELECT points FROM days WHERE mac = ? AND day = ?', (mac_key, day)).fetchone()
+        cells = np.array([tuple(row) for row in rows], dtype=HEAT_DTYPE)
+        if counted_points(cells) == (points[0] if points else 0):
+            return cells
+        return super().heat_grid(mac_key, day)
+
+    def stop_detector(self, mac, day):
+        # Kept up to date at ingest; nothing is replayed unless the day predates the table
+        mac_key = mac_to_file_key(mac)
+        row = self._connection().execute(
+            'SELECT d.points, s.state FROM days d LEFT JOIN day_stops s ON s.mac = d.mac AND s.day = d.day '
+            'WHERE d.mac = ? AND d.day = ?', (mac_key, day)).fetchone()
+        detector = self._saved_detector(row[1], row[0]) if row is not None else StayPointDetector()
+        return detector if detector is not None else super().stop_detector(mac_key, day)
+
+    def points_in_bbox(self, min_lat, min_lng, max_lat, max_lng, start, end):
+        box = [int(round(v * COORD_SCALE)) for v in (min_lat, max_lat, min_lng, max_lng)]
+        conn = self._connection()
+        cells = conn.execute(
+            'SELECT c.mac, c.minute FROM cell_boxes b JOIN cells c ON c.id = b.id '
+            'WHERE b.max_lat >= ? AND b.min_lat <= ? AND b.max_lng >= ? AND b.min_lng <= ? '
+            'AND b.max_minute >= ? AND b.min_minute <= ? ORDER BY c.mac, c.minute',
+            (box[0], box[1], box[2], box[3], start // 60, (end - 1) // 60)).fetchall()
+
+        # Runs of consecutive minutes of a device become one range read on the clustered index
+        runs = []
+        for mac_key, minute in cells:
+            if runs and runs[-1][0] == mac_key and runs[-1][2] == minute - 1:
+                runs[-1][2] = minute
+            else:
+                runs.append([mac_key, minute, minute])
+
+        found = {}
+        for mac_key, first, last in runs:
+            rows = conn.execute(
+                'SELECT seq, t, lat, lng FROM points WHERE mac = ? AND t >= ? AND t < ? '
+                'AND lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?',
+                (mac_key, max(start, first * 60), min(end, (last + 1) * 60), *box)).fetchall()
+            if rows:
+                found.setdefault(mac_key, []).append(self._track(rows))
+        return {mac_key: _time_ordered(np.concatenate(tracks)) for mac_key, tracks in found.items()}
+
+    def stats(self):
+        stats = super().stats()
+        stats['path'] = self.path
+        return stats
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def open_storage(backend, log_dir=None, tracks_dir=None, sqlite_path=None, max_points_per_file=500, cache=None):
+    """
+    Create the storage backend named by ``backend`` (``files`` or ``sqlite``).
+
+    :raises ValueError: for an unknown backend
+    """
+    if backend == STORAGE_FILES:
+        return FileStorage(log_dir, tracks_dir, max_points_per_file=max_points_per_file, cache=cache)
+    if backend == STORAGE_SQLITE:
+        return SQLiteStorage(sqlite_path)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,28 @@
+# conftest.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """``app`` imported once, storing into a temporary directory with MQTT off."""
+    data_dir = tmp_path_factory.mktemp('data')
+    os.environ.update(
+        MQTT_ENABLED='0',
+        LOGS_DIR=str(data_dir / 'logs'),
+        TRACKS_DIR=str(data_dir / 'tracks'),
+        STORAGE_BACKEND='files',
+        LATEST_TABLE_NAME=f'oriiona_test_{os.getpid()}',
+    )
+    import app
+    yield app
+    app.storage.close()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,91 @@
+# test_coords.py
+import pytest
+
+import trackquery
+
+MACS = ('AA:BB:CC:00:01:01', 'AA:BB:CC:00:01:02')
+DAYS = ('2026-02-01', '2026-02-02')
+
+
+@pytest.fixture(scope='module')
+def stored(app_module):
+    # Both devices report at the same seconds, so the merge has ties to break
+    records = [(f'{day} 10:{i // 60:02d}:{i % 60:02d}', round(37.9 + i / 1e4, 7), round(23.6 + i / 1e4, 7), mac)
+               for day in DAYS for i in range(0, 300, 7) for mac in MACS]
+    app_module.storage.write_many(records)
+    return records
+
+
+def _query(extra=''):
+    return f"/api/coords?mac={','.join(MACS)}&from={DAYS[0]}T00:00:00Z&to={DAYS[1]}T23:59:59Z{extra}"
+
+
+def _pages(client, limit, extra=''):
+    pages, cursor = [], ''
+    while True:
+        response = client.get(_query(f'&limit={limit}{extra}' + (f'&cursor={cursor}' if cursor else '')))
+        assert response.status_code == 200
+        pages.append(response.get_json())
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return pages
+
+
+def test_cursor_round_trip():
+    key = (1769940000, 'AA-BB-CC-00-01-01', 42)
+    assert trackquery.decode_cursor(trackquery.encode_cursor(DAYS[0], key)) == (DAYS[0], key)
+    with pytest.raises(ValueError):
+        trackquery.decode_cursor('not a cursor')
+
+
+@pytest.mark.parametrize('limit', [1, 7, 43, 1000])
+def test_pages_add_up_to_the_whole_track(client, stored, limit):
+    whole = client.get(_query()).get_json()
+    assert len(whole) == len(stored)
+    pages = _pages(client, limit)
+    assert [point for page in pages for point in page] == whole
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_columnar_pages(client, stored):
+    whole = client.get(_query('&format=columnar')).get_json()
+    pages = _pages(client, 50, '&format=columnar')
+    assert [t for page in pages for t in page['t']] == whole['t']
+    assert [mac for page in pages for mac in page['mac']] == whole['mac']
+
+
+def test_malformed_cursor(client, stored):
+    assert client.get(_query('&limit=5&cursor=bm9wZQ')).status_code == 400
+
+
+def test_since_round_trip():
+    counts = {'AA-BB-CC-00-01-01': 12, 'AA-BB-CC-00-01-02': 0}
+    assert trackquery.decode_since(trackquery.encode_since(DAYS[1], True, counts)) == (DAYS[1], True, counts)
+    with pytest.raises(ValueError):
+        trackquery.decode_since(trackquery.encode_since('2026-02-30', False, counts))
+
+
+def test_since_returns_only_appended_points(app_module, client):
+    mac, day = 'AA:BB:CC:00:01:03', '2026-02-03'
+    app_module.storage.write_many([(f'{day} 08:00:{i:02d}', 37.9, 23.6 + i / 1e4, mac) for i in range(10)])
+    first = client.get(f'/api/coords?mac={mac}&date={day}')
+    assert len(first.get_json()) == 10
+    since = first.headers['X-Since-Cursor']
+
+    assert client.get(f'/api/coords?mac={mac}&since={since}').get_json() == []
+    # A late point older than the ones already returned still counts as new
+    appended = [(f'{day} 09:00:00', 38.0, 23.7, mac), (f'{day} 07:00:00', 38.1, 23.8, mac)]
+    app_module.storage.write_many(appended)
+    delta = client.get(f'/api/coords?mac={mac}&since={since}')
+    assert [(p['timestamp'], p['lat'], p['lng']) for p in delta.get_json()] == \
+        [(ts, lat, lng) for ts, lat, lng, _ in sorted(appended)]
+
+    following = delta.headers['X-Since-Cursor']
+    assert client.get(f'/api/coords?mac={mac}&since={following}').get_json() == []
+    assert len(client.get(f'/api/coords?mac={mac}&date={day}').get_json()) == 12
+
+
+def test_since_rejects_paging(client, stored):
+    since = trackquery.encode_since(DAYS[0], False, {})
+    assert client.get(f'/api/coords?mac={MACS[0]}&since={since}&limit=5').status_code == 400
+    assert client.get(f'/api/coords?mac={MACS[0]}&since=bm9wZQ').status_code == 400
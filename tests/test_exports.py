@@ -0,0 +1,26 @@
+# test_exports.py
+import io
+
+MACS = ('AA:BB:CC:00:00:01', 'AA:BB:CC:00:00:02')
+DAY = '2026-03-14'
+
+
+def test_csv_export_imports_back(app_module, client):
+    records = [(f'{DAY} 10:00:{i:02d}', round(37.9 + i / 1000, 7), round(23.6 + i / 1000, 7), mac)
+               for i in range(20) for mac in MACS]
+    app_module.storage.write_many(records)
+
+    exported = client.get(f'/export/csv?date={DAY}')
+    assert exported.status_code == 200
+    assert len(exported.data.decode('utf-8').splitlines()) == len(records)
+
+    imported = client.post('/import/csv', data={'file': (io.BytesIO(exported.data), 'export.csv')})
+    assert imported.status_code == 200
+    points = sorted((p['mac'], p['lat'], p['lng']) for p in imported.get_json())
+    assert points == sorted((mac, lat, lng) for _, lat, lng, mac in records)
+
+
+def test_csv_import_accepts_three_columns(client):
+    body = b'2026-03-14 10:00:00,37.9,23.6\nnot,a,row\n'
+    imported = client.post('/import/csv', data={'file': (io.BytesIO(body), 'old.csv')})
+    assert imported.get_json() == [{'lat': 37.9, 'lng': 23.6}]
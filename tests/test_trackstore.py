@@ -0,0 +1,106 @@
+# test_trackstore.py
+import os
+
+import numpy as np
+
+from logwriter import mac_to_file_key
+from trackstore import TrackStore, TRACK_DTYPE, COMPACT_BLOCK_POINTS, compact_track, day_start_epoch, latitudes, \
+    longitudes, read_compacted, timestamps, write_compacted
+
+MAC = 'AA:BB:CC:00:00:01'
+DAY = '2026-03-14'
+
+
+def _records(count, day=DAY, mac=MAC):
+    return [(f'{day} {i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}', round(37.9 + i * 1e-5, 7),
+             round(23.6 - i * 1e-5, 7), mac) for i in range(count)]
+
+
+def _as_records(track, mac=MAC):
+    return list(zip(timestamps(track).tolist(), latitudes(track).tolist(), longitudes(track).tolist(),
+                    [mac] * len(track)))
+
+
+def test_trk_round_trip(tmp_path):
+    (tmp_path / 'logs').mkdir()
+    store = TrackStore(str(tmp_path / 'tracks'), str(tmp_path / 'logs'))
+    records = _records(1200)
+    store.write_many(records[:700])
+    store.write_many(records[700:])
+    try:
+        assert _as_records(store.read(mac_to_file_key(MAC), DAY)) == records
+    finally:
+        store.close()
+
+
+def test_trk_keeps_append_order(tmp_path):
+    (tmp_path / 'logs').mkdir()
+    store = TrackStore(str(tmp_path / 'tracks'), str(tmp_path / 'logs'))
+    records = _records(50)
+    store.write_many(records[25:])
+    store.write_many(records[:25])
+    try:
+        track = store.read(mac_to_file_key(MAC), DAY)
+        assert _as_records(track) == records[25:] + records[:25]
+        assert track['lat'].dtype == np.int32
+    finally:
+        store.close()
+
+
+def _random_track(count, seed=0):
+    rng = np.random.default_rng(seed)
+    track = np.empty(count, dtype=TRACK_DTYPE)
+    track['t'] = day_start_epoch(DAY) + np.sort(rng.integers(0, 86400, count))
+    track['lat'] = 379000000 + np.cumsum(rng.integers(-500, 500, count))
+    track['lng'] = -236000000 + np.cumsum(rng.integers(-500, 500, count))
+    return track
+
+
+def test_trz_round_trip(tmp_path):
+    track = _random_track(3 * COMPACT_BLOCK_POINTS + 17)
+    path = str(tmp_path / 'day.trz')
+    write_compacted(path, track)
+    assert np.array_equal(read_compacted(path), track)
+    assert os.listdir(tmp_path) == ['day.trz']
+
+
+def test_trz_range_read(tmp_path):
+    track = _random_track(2 * COMPACT_BLOCK_POINTS + 5)
+    path = str(tmp_path / 'day.trz')
+    write_compacted(path, track)
+    start, end = int(track['t'][100]), int(track['t'][COMPACT_BLOCK_POINTS + 50])
+    expected = track[(track['t'] >= start) & (track['t'] < end)]
+    assert np.array_equal(read_compacted(path, start, end), expected)
+    assert len(read_compacted(path, 0, 1)) == 0
+
+
+def test_compact_track_sorts_and_drops_exact_copies():
+    track = _random_track(100)
+    doubled = np.concatenate([track[50:], track, track[:10]])
+    moved = track[:1].copy()
+    moved['lat'] += 1
+    compacted = compact_track(np.concatenate([doubled, moved]))
+    assert len(compacted) == len(track) + 1
+    assert np.all(np.diff(compacted['t']) >= 0)
+
+
+def test_compacted_day_reads_back(tmp_path):
+    (tmp_path / 'logs').mkdir()
+    store = TrackStore(str(tmp_path / 'tracks'), str(tmp_path / 'logs'))
+    mac_key = mac_to_file_key(MAC)
+    records = _records(5000)
+    try:
+        store.write_many(records[2500:])
+        store.write_many(records[:3000])
+        assert store.compact(mac_key, DAY) == (5500, 5000)
+        assert _as_records(store.read(mac_key, DAY)) == records
+        assert not os.path.exists(store.path(mac_key, DAY))
+
+        # A late upload to a compacted day is merged into it by the next compaction
+        late = _records(5001)[-1:]
+        store.write_many(late)
+        assert len(store.read(mac_key, DAY)) == 5001
+        assert store.compact(mac_key, DAY) == (5001, 5001)
+        assert _as_records(store.read(mac_key, DAY)) == records + late
+    finally:
+        store.close()
@@ -0,0 +1,82 @@
+# test_wireformat.py
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import wireformat
+from wireformat import FORMAT_BINARY, FORMAT_COLUMNAR, FORMAT_OBJECTS, FORMAT_POLYLINE
+
+EPOCHS = [1773446400, 1773446405, 1773446460]
+LAT_E7 = [379000000, 379001234, -123456789]
+LNG_E7 = [236000000, 235998766, 1799999999]
+
+
+def decode_polyline(encoded):
+    """Reference decoder of Google's encoded polyline algorithm; returns the scaled integer coordinates."""
+    values, value, shift = [], 0, 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if not chunk & 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    return np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0).tolist()
+
+
+def test_objects():
+    body, mimetype = wireformat.render(FORMAT_OBJECTS, EPOCHS, LAT_E7, LNG_E7, macs=['AA:BB:CC:00:00:01'] * 3)
+    assert mimetype == 'application/json'
+    points = json.loads(body)
+    assert points[0] == {'lat': 37.9, 'lng': 23.6, 'timestamp': '2026-03-14 00:00:00', 'mac': 'AA:BB:CC:00:00:01'}
+    assert [p['lat'] for p in points] == [v / 1e7 for v in LAT_E7]
+
+
+def test_columnar():
+    body, mimetype = wireformat.render(FORMAT_COLUMNAR, EPOCHS, LAT_E7, LNG_E7)
+    assert mimetype == 'application/vnd.oriiona.columnar+json'
+    assert json.loads(body) == {'t': EPOCHS, 'lat': [v / 1e7 for v in LAT_E7], 'lng': [v / 1e7 for v in LNG_E7]}
+
+
+def test_polyline():
+    body, _ = wireformat.render(FORMAT_POLYLINE, EPOCHS, LAT_E7, LNG_E7)
+    decoded = json.loads(body)
+    assert decoded['t'] == EPOCHS
+    scale = 10 ** (7 - decoded['precision'])
+    expected = [[round(lat / scale), round(lng / scale)] for lat, lng in zip(LAT_E7, LNG_E7)]
+    assert decode_polyline(decoded['polyline']) == expected
+
+
+def test_polyline_reference_example():
+    # The example from Google's algorithm description
+    assert wireformat.encode_polyline([38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+
+def test_binary():
+    body, mimetype = wireformat.render(FORMAT_BINARY, EPOCHS, LAT_E7, LNG_E7)
+    assert mimetype == 'application/octet-stream'
+    n = int(np.frombuffer(body, dtype='<u4', count=1)[0])
+    assert n == 3 and len(body) == 4 * (1 + 3 * n)
+    assert np.frombuffer(body, dtype='<u4', count=n, offset=4).tolist() == EPOCHS
+    assert np.frombuffer(body, dtype='<i4', count=n, offset=4 + 4 * n).tolist() == LAT_E7
+    assert np.frombuffer(body, dtype='<i4', count=n, offset=4 + 8 * n).tolist() == LNG_E7
+
+
+@pytest.mark.parametrize('fmt', [FORMAT_OBJECTS, FORMAT_COLUMNAR, FORMAT_POLYLINE, FORMAT_BINARY])
+def test_empty_track(fmt):
+    body, _ = wireformat.render(fmt, [], [], [])
+    assert body
+
+
+def test_compress_round_trip():
+    body = json.dumps(list(range(2000)))
+
+    class Accepts(dict):
+        def __getitem__(self, key):
+            return self.get(key, False)
+
+    compressed, encoding = wireformat.compress(body, Accepts(gzip=True))
+    assert encoding == 'gzip' and gzip.decompress(compressed).decode('utf-8') == body
+    assert wireformat.compress(body, Accepts()) == (body.encode('utf-8'), None)
@@ -0,0 +1,115 @@
+# test_writequeue.py
+import threading
+import time
+
+import pytest
+
+from writequeue import WriteQueue, OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST
+
+
+class GatedWriter:
+    """Storage stand-in whose ``write_many`` waits until the gate is opened."""
+
+    def __init__(self, open=True):
+        self.gate = threading.Event()
+        if open:
+            self.gate.set()
+        self.entered = threading.Event()
+        self.batches = []
+
+    def write_many(self, records, fsync=False):
+        self.entered.set()
+        self.gate.wait()
+        self.batches.append(list(records))
+        return ['file']
+
+    @property
+    def timestamps(self):
+        return [record[0] for batch in self.batches for record in batch]
+
+
+def _put(write_queue, count, first=0):
+    return [write_queue.put('AA:BB:CC:00:00:01', 37.9, 23.6, str(i)) for i in range(first, first + count)]
+
+
+def _held_queue(overflow, maxsize=5):
+    """A started queue whose writer is holding the first point, with ``maxsize`` more points queued."""
+    writer = GatedWriter(open=False)
+    write_queue = WriteQueue(writer, maxsize=maxsize, flush_interval=0, max_batch=1, overflow=overflow).start()
+    _put(write_queue, 1)
+    assert writer.entered.wait(2)
+    assert all(_put(write_queue, maxsize, first=1))
+    return writer, write_queue
+
+
+def test_stop_commits_everything_queued():
+    writer = GatedWriter()
+    write_queue = WriteQueue(writer, maxsize=1000, flush_interval=0.01, max_batch=64).start()
+    assert all(_put(write_queue, 500))
+    write_queue.stop()
+    assert writer.timestamps == [str(i) for i in range(500)]
+    stats = write_queue.stats()
+    assert (stats['written'], stats['dropped'], stats['queue_depth']) == (500, 0, 0)
+
+
+def test_stop_of_an_idle_queue_returns_promptly():
+    write_queue = WriteQueue(GatedWriter()).start()
+    started = time.monotonic()
+    write_queue.stop()
+    assert time.monotonic() - started < 1
+    write_queue.stop()
+
+
+def test_block_waits_for_room_without_dropping():
+    writer, write_queue = _held_queue(OVERFLOW_BLOCK)
+    results = []
+    producer = threading.Thread(target=lambda: results.extend(_put(write_queue, 20, first=6)))
+    producer.start()
+    # Longer than any fixed put timeout would allow
+    producer.join(1.5)
+    assert producer.is_alive()
+    writer.gate.set()
+    producer.join(5)
+    write_queue.stop()
+    assert results == [True] * 20
+    assert writer.timestamps == [str(i) for i in range(26)]
+    stats = write_queue.stats()
+    assert stats['dropped'] == 0 and stats['blocked'] >= 1
+
+
+def test_drop_newest_keeps_the_queued_points():
+    writer, write_queue = _held_queue(OVERFLOW_DROP_NEWEST)
+    assert _put(write_queue, 3, first=6) == [False] * 3
+    writer.gate.set()
+    write_queue.stop()
+    assert writer.timestamps == [str(i) for i in range(6)]
+    assert write_queue.stats()['dropped'] == 3
+
+
+def test_drop_oldest_keeps_the_newest_points():
+    writer, write_queue = _held_queue(OVERFLOW_DROP_OLDEST)
+    assert all(_put(write_queue, 3, first=6))
+    writer.gate.set()
+    write_queue.stop()
+    assert writer.timestamps == ['0'] + [str(i) for i in range(4, 9)]
+    assert write_queue.stats()['dropped'] == 3
+
+
+def test_failed_commit_is_counted():
+    class FailingWriter:
+        def write_many(self, records, fsync=False):
+            raise OSError('disk full')
+
+    write_queue = WriteQueue(FailingWriter(), flush_interval=0).start()
+    _put(write_queue, 3)
+    write_queue.flush()
+    write_queue.stop()
+    stats = write_queue.stats()
+    assert stats['errors'] >= 1 and stats['written'] == 0
+
+
+def test_unknown_policies_are_rejected():
+    with pytest.raises(ValueError):
+        WriteQueue(GatedWriter(), overflow='spill')
+    with pytest.raises(ValueError):
+        WriteQueue(GatedWriter(), fsync='sometimes')
@@ -0,0 +1,178 @@
+# trackquery.py
+import base64
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from trackstore import TRACK_DTYPE
+
+logger = logging.getLogger(__name__)
+
+# One merged point: its TRACK_DTYPE fields, the device's index in the query and its record position
+MERGED_DTYPE = np.dtype(TRACK_DTYPE.descr + [('mac', '<i4'), ('position', '<i8')])
+
+
+def encode_cursor(day, key):
+    """Opaque cursor for the first point not yet returned; ``key`` is ``(epoch, mac_key, position)``."""
+    t, mac_key, position = key
+    return base64.urlsafe_b64encode(f'{day}|{t}|{mac_key}|{position}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    :return: ``(day, (epoch, mac_key, position))``
+    :raises ValueError: if the cursor was not produced by ``encode_cursor``
+    """
+    try:
+        day, t, mac_key, position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        key = (int(t), mac_key, int(position))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("malformed cursor")
+    if len(day) != 10 or key[2] < 0:
+        raise ValueError("malformed cursor")
+    return day, key
+
+
+def encode_since(day, live, counts):
+    """
+    Opaque cursor marking how many records of each device ``day`` held when a response was built.
+
+    :param live: Whether the cursor follows the devices into later days once ``day`` is over
+    :param counts: ``{mac_key: record count}``
+    """
+    devices = ','.join(f'{mac_key}={count}' for mac_key, count in sorted(counts.items()))
+    return base64.urlsafe_b64encode(f'{day}|{int(live)}|{devices}'.encode()).decode().rstrip('=')
+
+
+def decode_since(cursor):
+    """
+    :return: ``(day, live, {mac_key: record count})``
+    :raises ValueError: if the cursor was not produced by ``encode_since``
+    """
+    try:
+        day, live, devices = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        counts = {}
+        for device in filter(None, devices.split(',')):
+            mac_key, count = device.split('=')
+            counts[mac_key] = int(count)
+        if datetime.strptime(day, '%Y-%m-%d').strftime('%Y-%m-%d') != day:
+            raise ValueError(day)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("malformed cursor")
+    if live not in ('0', '1') or any(count < 0 for count in counts.values()):
+        raise ValueError("malformed cursor")
+    return day, live == '1', counts
+
+
+def record_counts(storage, mac_keys, day):
+    """Number of records each device has on ``day`` right now; positions below it are already written."""
+    return {mac_key: len(storage.read(mac_key, day)) for mac_key in mac_keys}
+
+
+def load_window(storage, mac_key, mac_index, day, start, end, refine=None, cursor=None, limit=None):
+    """
+    Points of one device-day inside ``[start, end)``, ordered by time, as a MERGED_DTYPE array.
+
+    Only record positions are handled until the window is cut to ``cursor`` and
+    ``limit``; the points themselves are gathered for what is left.
+
+    :param mac_index: Index of the device in the query, stored in the ``mac`` column
+    :param refine: Optional ``f(mac_key, day, start, end, track, positions) -> positions``
+                   applied to the file-ordered positions (e.g. simplification)
+    :param cursor: ``(epoch, mac_index, position)`` of the first point to keep, when resuming on this day
+    :param limit: Keep at most the first ``limit`` points
+    """
+    if cursor is not None and refine is None:
+        # Nothing before the cursor's second is kept, so it is not even located
+        start = max(start, cursor[0])
+    track = storage.read(mac_key, day)
+    positions = storage.locate_range(mac_key, day, start, end, track=track)
+    if refine is not None:
+        positions = refine(mac_key, day, start, end, track, positions)
+    # Backfilled batches can land out of order in the file; the merge needs time order
+    epochs = track['t'][positions]
+    order = np.argsort(epochs, kind='stable')
+    positions, epochs = positions[order], epochs[order]
+    if cursor is not None:
+        ct, cursor_index, cp = cursor
+        after = (epochs > ct) | ((epochs == ct) & ((mac_index > cursor_index) |
+                                                   ((mac_index == cursor_index) & (positions >= cp))))
+        positions = positions[after]
+    if limit is not None:
+        positions = positions[:limit]
+
+    window = np.empty(len(positions), dtype=MERGED_DTYPE)
+    points = track[positions]
+    for name in ('t', 'lat', 'lng'):
+        window[name] = points[name]
+    window['mac'] = mac_index
+    window['position'] = positions
+    return window
+
+
+def point_key(mac_keys, point):
+    """``(epoch, mac_key, position)`` of one MERGED_DTYPE row, as ``encode_cursor`` takes it."""
+    return int(point['t']), mac_keys[int(point['mac'])], int(point['position'])
+
+
+def merged_points(storage, executor, mac_keys, windows, refine=None, cursor=None, limit=None, chunk_size=1000):
+    """
+    Stream the points of several devices over several days in time order, in chunks.
+
+    Days are disjoint, so they are processed one after another and only one day
+    per device is held in memory, as NumPy columns. Within a day every device is
+    loaded on ``executor``, cut to the cursor and ``limit`` before its points are
+    gathered, and the devices are merged with one sort on ``(epoch, mac_index,
+    position)``; the next day is loaded in the background while the current one
+    is consumed.
+
+    :param mac_keys: Sorted MAC keys; their index breaks ties between equal timestamps
+    :param windows: ``[(day, start, end)]`` from oldest to newest
+    :param cursor: ``(day, key)`` from ``decode_cursor`` to resume after a previous page
+    :param limit: Most points the caller takes; no device-day is loaded beyond it
+    :return: Generator of ``(day, chunk)`` with ``chunk`` a MERGED_DTYPE array of at most ``chunk_size`` points
+    """
+    cursor_key = None
+    if cursor is not None:
+        windows = [w for w in windows if w[0] >= cursor[0]]
+        t, mac_key, position = cursor[1]
+        cursor_key = (t, mac_keys.index(mac_key) if mac_key in mac_keys else -1, position)
+
+    def submit(window):
+        day, start, end = window
+        day_cursor = cursor_key if cursor is not None and day == cursor[0] else None
+        return [executor.submit(load_window, storage, mac_key, mac_index, day, start, end, refine, day_cursor, limit)
+                for mac_index, mac_key in enumerate(mac_keys)]
+
+    pending = submit(windows[0]) if windows else None
+    for i, (day, start, end) in enumerate(windows):
+        loaded = [future.result() for future in pending]
+        pending = submit(windows[i + 1]) if i + 1 < len(windows) else None
+
+        merged = np.concatenate(loaded)
+        # (epoch, mac_index, position) is unique, so the order is fully determined
+        merged = merged[np.lexsort((merged['position'], merged['mac'], merged['t']))]
+        logger.debug(f"Merged {len(merged)} points of {sum(1 for w in loaded if len(w))} devices on {day}")
+        for first in range(0, len(merged), chunk_size):
+            yield day, merged[first:first + chunk_size]
+
+
+def take(chunks, limit):
+    """
+    The first ``limit`` points of ``merged_points`` and where the next page starts.
+
+    :return: ``(page, following)`` with ``page`` a list of ``(day, chunk)`` and ``following``
+             the ``(day, row)`` of the first point left out, or None
+    """
+    page = []
+    taken = 0
+    for day, chunk in chunks:
+        if taken + len(chunk) > limit:
+            cut = limit - taken
+            if cut:
+                page.append((day, chunk[:cut]))
+            return page, (day, chunk[cut])
+        page.append((day, chunk))
+        taken += len(chunk)
+    return page, None
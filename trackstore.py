@@ -0,0 +1,595 @@
+# trackstore.py
+import os
+import logging
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from logwriter import mac_to_file_key, parse_log_file_name
+
+logger = logging.getLogger(__name__)
+
+# Fixed-width little-endian record: epoch seconds, lat/lng as int32 scaled by 1e7
+TRACK_DTYPE = np.dtype([('t', '<i8'), ('lat', '<i4'), ('lng', '<i4')])
+COORD_SCALE = 10_000_000
+TRACK_FILE_SUFFIX = '.trk'
+
+EMPTY_TRACK = np.zeros(0, dtype=TRACK_DTYPE)
+
+# Sidecar time index: for every minute of the day, the [first, end) record range of the
+# points in that minute. The extra last row holds the number of records indexed so far.
+INDEX_FILE_SUFFIX = '.idx'
+INDEX_BUCKET_SECONDS = 60
+INDEX_BUCKETS = 86400 // INDEX_BUCKET_SECONDS
+INDEX_DTYPE = np.dtype([('first', '<i8'), ('end', '<i8')])
+_NO_RECORD = np.iinfo(np.int64).max
+
+# Compacted day: the points of a closed device-day sorted by time, in zlib-compressed
+# blocks of delta-encoded t/lat/lng columns. A footer lists every block's byte range,
+# point count and time span, followed by the block count and the magic.
+COMPACT_FILE_SUFFIX = '.trz'
+COMPACT_MAGIC = b'OTZ1'
+COMPACT_BLOCK_POINTS = 4096
+COMPACT_FOOTER_DTYPE = np.dtype([('offset', '<i8'), ('length', '<i8'), ('count', '<i8'),
+                                 ('t_first', '<i8'), ('t_last', '<i8')])
+_COMPACT_TRAILER = struct.Struct('<I4s')
+
+
+def track_file_name(mac_key, day):
+    return f'{mac_key}_{day}{TRACK_FILE_SUFFIX}'
+
+
+def index_file_name(mac_key, day):
+    return f'{mac_key}_{day}{INDEX_FILE_SUFFIX}'
+
+
+def compacted_file_name(mac_key, day):
+    return f'{mac_key}_{day}{COMPACT_FILE_SUFFIX}'
+
+
+def day_start_epoch(day):
+    return int(np.datetime64(day, 's').astype('<i8'))
+
+
+def empty_index():
+    index = np.zeros(INDEX_BUCKETS + 1, dtype=INDEX_DTYPE)
+    index['first'][:INDEX_BUCKETS] = _NO_RECORD
+    return index
+
+
+def update_index(index, track, offset, day):
+    """
+    Add ``track``, stored at record ``offset`` of the device-day file, to the minute buckets of ``index``.
+
+    Records do not have to be in time order; a bucket only widens its range.
+    """
+    if len(track):
+        buckets = np.clip((track['t'] - day_start_epoch(day)) // INDEX_BUCKET_SECONDS, 0, INDEX_BUCKETS - 1)
+        positions = np.arange(offset, offset + len(track), dtype=np.int64)
+        np.minimum.at(index['first'], buckets, positions)
+        np.maximum.at(index['end'], buckets, positions + 1)
+    index['end'][INDEX_BUCKETS] = offset + len(track)
+
+
+def to_records(timestamps, lats, lngs):
+    """Pack timestamp strings and float coordinates into a TRACK_DTYPE array."""
+    records = np.empty(len(timestamps), dtype=TRACK_DTYPE)
+    records['t'] = np.array(timestamps, dtype='datetime64[s]').astype('<i8')
+    records['lat'] = np.rint(np.asarray(lats, dtype=np.float64) * COORD_SCALE)
+    records['lng'] = np.rint(np.asarray(lngs, dtype=np.float64) * COORD_SCALE)
+    return records
+
+
+def latitudes(track):
+    return track['lat'] / COORD_SCALE
+
+
+def longitudes(track):
+    return track['lng'] / COORD_SCALE
+
+
+def timestamps(track):
+    """Format the epoch column back into the ``%Y-%m-%d %H:%M:%S`` strings used by the text logs."""
+    if not len(track):
+        # np.char.replace cannot size its output for an empty array on NumPy 2
+        return np.zeros(0, dtype='<U19')
+    return np.char.replace(np.datetime_as_string(track['t'].astype('datetime64[s]')), 'T', ' ')
+
+
+def read_text_tail(path, offset=0):
+    """
+    Parse the complete ``timestamp,lat,lng[,mac]`` lines of a text log from byte ``offset``.
+
+    A last line without its newline is still being written and is left for a later call.
+
+    :return: ``(track, consumed)`` with ``consumed`` the number of bytes parsed
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    consumed = data.rfind(b'\n') + 1
+    ts, lats, lngs = [], [], []
+    for line in data[:consumed].decode('utf-8').splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 3:
+            continue
+        try:
+            lat = float(parts[1])
+            lng = float(parts[2])
+            np.datetime64(parts[0], 's')
+        except ValueError:
+            logger.debug(f"Skipping malformed log line in {path}: {line.strip()}")
+            continue
+        ts.append(parts[0])
+        lats.append(lat)
+        lngs.append(lng)
+    if not ts:
+        return EMPTY_TRACK, consumed
+    return to_records(ts, lats, lngs), consumed
+
+
+def read_track_tail(path, offset=0):
+    """
+    Load the whole records of a track file from byte ``offset`` into memory.
+
+    :return: ``(track, consumed)``; a trailing partial record is not consumed
+    """
+    count = max(0, os.path.getsize(path) - offset) // TRACK_DTYPE.itemsize
+    track = np.fromfile(path, dtype=TRACK_DTYPE, count=count, offset=offset)
+    return track, len(track) * TRACK_DTYPE.itemsize
+
+
+def read_text_track(paths, cache=None):
+    """
+    Parse text log files (``timestamp,lat,lng[,mac]`` lines) into a TRACK_DTYPE array.
+
+    Malformed lines are skipped.
+
+    :param cache: Optional ``ParsedFileCache`` that keeps each parsed part
+    """
+    tracks = [cache.load(path, read_text_tail) if cache is not None else read_text_tail(path)[0] for path in paths]
+    tracks = [track for track in tracks if len(track)]
+    if not tracks:
+        return EMPTY_TRACK
+    return tracks[0] if len(tracks) == 1 else np.concatenate(tracks)
+
+
+def write_compacted(path, track):
+    """
+    Write a time-sorted TRACK_DTYPE array as a compacted file, atomically and durably.
+
+    The file is written next to ``path``, fsynced and renamed over it, so readers
+    see either the previous file or the complete new one.
+
+    Layout: ``COMPACT_MAGIC``, then one zlib stream per block of ``COMPACT_BLOCK_POINTS``
+    points holding the ``t``, ``lat`` and ``lng`` columns one after the other as
+    little-endian int64 deltas (the first value of a block is relative to 0), then a
+    ``COMPACT_FOOTER_DTYPE`` row per block (byte offset, compressed length, point count,
+    first and last ``t``) and an 8-byte trailer of the block count (``<I``) and the magic.
+    """
+    body = bytearray(COMPACT_MAGIC)
+    footer = np.zeros((len(track) + COMPACT_BLOCK_POINTS - 1) // COMPACT_BLOCK_POINTS, dtype=COMPACT_FOOTER_DTYPE)
+    for block_index, first in enumerate(range(0, len(track), COMPACT_BLOCK_POINTS)):
+        block = track[first:first + COMPACT_BLOCK_POINTS]
+        columns = np.concatenate([np.diff(block[name].astype('<i8'), prepend=0) for name in ('t', 'lat', 'lng')])
+        data = zlib.compress(columns.tobytes(), 9)
+        footer[block_index] = (len(body), len(data), len(block), block['t'][0], block['t'][-1])
+        body += data
+    body += footer.tobytes()
+    body += _COMPACT_TRAILER.pack(len(footer), COMPACT_MAGIC)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def read_compacted(path, start=None, end=None):
+    """
+    Read a compacted file, decompressing only the blocks that overlap ``[start, end)`` when given.
+
+    :return: TRACK_DTYPE array in time order
+    :raises ValueError: if the file is not a compacted track file
+    """
+    with open(path, 'rb') as f:
+        f.seek(-_COMPACT_TRAILER.size, os.SEEK_END)
+        count, magic = _COMPACT_TRAILER.unpack(f.read(_COMPACT_TRAILER.size))
+        if magic != COMPACT_MAGIC:
+            raise ValueError(f"{path} is not a compacted track file")
+        f.seek(-_COMPACT_TRAILER.size - count * COMPACT_FOOTER_DTYPE.itemsize, os.SEEK_END)
+        footer = np.frombuffer(f.read(count * COMPACT_FOOTER_DTYPE.itemsize), dtype=COMPACT_FOOTER_DTYPE)
+        if start is not None:
+            footer = footer[(footer['t_last'] >= start) & (footer['t_first'] < end)]
+
+        blocks = []
+        for offset, length, points, _, _ in footer.tolist():
+            f.seek(offset)
+            columns = np.frombuffer(zlib.decompress(f.read(length)), dtype='<i8').reshape(3, points)
+            block = np.empty(points, dtype=TRACK_DTYPE)
+            block['t'] = np.cumsum(columns[0])
+            block['lat'] = np.cumsum(columns[1])
+            block['lng'] = np.cumsum(columns[2])
+            blocks.append(block)
+
+    track = np.concatenate(blocks) if blocks else EMPTY_TRACK
+    if start is not None:
+        lo, hi = np.searchsorted(track['t'], [start, end])
+        track = track[lo:hi]
+    return track
+
+
+def read_compacted_tail(path, offset=0):
+    # Compacted files are replaced, never appended to, so there is no tail to resume from
+    return read_compacted(path), os.path.getsize(path)
+
+
+def compact_track(track):
+    """Sort a track by time and drop exact duplicates of the previous fix (same t, lat and lng)."""
+    # Sorting on all three columns also brings together copies that were interleaved
+    track = track[np.lexsort((track['lng'], track['lat'], track['t']))]
+    if len(track) < 2:
+        return track
+    same = (track['t'][1:] == track['t'][:-1]) & (track['lat'][1:] == track['lat'][:-1]) & \
+        (track['lng'][1:] == track['lng'][:-1])
+    return track[np.concatenate([[True], ~same])]
+
+
+class TrackStore:
+    """
+    Binary columnar copy of the GPS logs, one ``<MAC>_<day>.trk`` file per device-day.
+
+    Files are appended to by the ingest path through ``write_many`` and read back
+    with ``numpy.memmap``, so a day loads as a zero-copy view instead of being
+    re-parsed from text. Days that only exist as text logs are converted the first
+    time they are read once the day is over, or seeded from text when the writer
+    first touches them.
+
+    Closed days can be compacted (``compact``) into one time-sorted, compressed
+    ``.trz`` file that replaces the text parts, track file and index; reads of a
+    compacted day decompress it, or only the blocks a time window needs.
+
+    With a ``cache`` (``ParsedFileCache``), finished days are kept in memory between
+    requests and text logs of the current day are parsed only as far as they grew.
+
+    With a ``catalog`` (``LogCatalog``), the text parts and stored days are looked
+    up there instead of listing the log and track directories.
+    """
+
+    def __init__(self, tracks_dir, log_dir, idle_timeout=300, cache=None, catalog=None):
+        self.tracks_dir = tracks_dir
+        self.log_dir = log_dir
+        self.idle_timeout = idle_timeout
+        self.cache = cache
+        self.catalog = catalog
+
+        self._lock = threading.Lock()
+        self._handles = {}  # (mac_key, day) -> [handle, last_write, index memmap]
+
+        os.makedirs(tracks_dir, exist_ok=True)
+
+    def path(self, mac_key, day):
+        return os.path.join(self.tracks_dir, track_file_name(mac_key, day))
+
+    def index_path(self, mac_key, day):
+        return os.path.join(self.tracks_dir, index_file_name(mac_key, day))
+
+    def compacted_path(self, mac_key, day):
+        return os.path.join(self.tracks_dir, compacted_file_name(mac_key, day))
+
+    def text_log_paths(self, mac_key, day):
+        """Text log parts for a device-day, in part order."""
+        if self.catalog is not None:
+            return self.catalog.text_parts(mac_key, day)
+        parts = []
+        for name in os.listdir(self.log_dir):
+            parsed = parse_log_file_name(name)
+            if parsed and parsed[0] == mac_key and parsed[1] == day:
+                parts.append((parsed[2], os.path.join(self.log_dir, name)))
+        return [path for _, path in sorted(parts)]
+
+    def _build_from_text(self, mac_key, day, text_paths):
+        path = self.path(mac_key, day)
+        track = read_text_track(text_paths)
+        compacted = self.compacted_path(mac_key, day)
+        if os.path.exists(compacted):
+            # Backfill into a compacted day: the track file starts from the compacted points
+            track = np.concatenate([read_compacted(compacted), track])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(track.tobytes())
+        os.replace(tmp_path, path)
+        logger.debug(f"Built track file {path} from text logs ({len(track)} points)")
+
+    def _build_index(self, mac_key, day):
+        path = self.index_path(mac_key, day)
+        index = empty_index()
+        update_index(index, self._map(self.path(mac_key, day)), 0, day)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(index.tobytes())
+        os.replace(tmp_path, path)
+        logger.debug(f"Built time index {path} ({index['end'][INDEX_BUCKETS]} points)")
+
+    def _handle(self, mac_key, day):
+        entry = self._handles.get((mac_key, day))
+        if entry is None:
+            path = self.path(mac_key, day)
+            if not os.path.exists(path):
+                # Seed from points logged as text before the binary store existed
+                self._build_from_text(mac_key, day, self.text_log_paths(mac_key, day))
+            index_path = self.index_path(mac_key, day)
+            if not os.path.exists(index_path) or \
+                    os.path.getsize(index_path) != INDEX_DTYPE.itemsize * (INDEX_BUCKETS + 1):
+                self._build_index(mac_key, day)
+            handle = open(path, 'ab')
+            index = np.memmap(index_path, dtype=INDEX_DTYPE, mode='r+', shape=(INDEX_BUCKETS + 1,))
+            count = handle.tell() // TRACK_DTYPE.itemsize
+            if index['end'][INDEX_BUCKETS] != count:
+                # Appended to without maintaining the index (older version, crash between writes)
+                update_index(index, self._map(path)[index['end'][INDEX_BUCKETS]:], index['end'][INDEX_BUCKETS], day)
+            entry = [handle, time.monotonic(), index]
+            self._handles[(mac_key, day)] = entry
+        return entry
+
+    def write_many(self, records, fsync=False):
+        """
+        Append a batch of ``(timestamp, lat, lng, mac)`` tuples, one write per device-day.
+
+        Must be called before the same points are committed to the text logs so
+        a file seeded from text does not contain them twice.
+        """
+        by_file = {}
+        for timestamp, lat, lng, mac in records:
+            by_file.setdefault((mac_to_file_key(mac), timestamp[:10]), []).append((timestamp, lat, lng))
+
+        with self._lock:
+            for (mac_key, day), points in by_file.items():
+                ts, lats, lngs = zip(*points)
+                entry = self._handle(mac_key, day)
+                handle, _, index = entry
+                track = to_records(ts, lats, lngs)
+                offset = handle.tell() // TRACK_DTYPE.itemsize
+                handle.write(track.tobytes())
+                handle.flush()
+                # Index after the data so a reader never sees buckets pointing past the file
+                update_index(index, track, offset, day)
+                if fsync:
+                    os.fsync(handle.fileno())
+                    index.flush()
+                entry[1] = time.monotonic()
+            self._close_stale()
+
+    def _close_stale(self):
+        now = time.monotonic()
+        today = datetime.utcnow().strftime('%Y-%m-%d')
+        for key in [k for k, (_, last, _) in self._handles.items() if k[1] != today or now - last >= self.idle_timeout]:
+            handle, _, index = self._handles.pop(key)
+            handle.close()
+            index.flush()
+
+    def close(self):
+        with self._lock:
+            for handle, _, index in self._handles.values():
+                handle.close()
+                index.flush()
+            self._handles.clear()
+
+    @staticmethod
+    def _map(path):
+        # Ignore a trailing partial record from an append in progress
+        count = os.path.getsize(path) // TRACK_DTYPE.itemsize
+        if count == 0:
+            return EMPTY_TRACK
+        return np.memmap(path, dtype=TRACK_DTYPE, mode='r', shape=(count,))
+
+    def read(self, mac, day):
+        """
+        Return the device-day as a read-only TRACK_DTYPE array backed by ``mmap``,
+        or by the parsed-file cache for past days when the store has one.
+
+        Slicing the result does not copy. Days without a track file fall back to
+        the compacted file or the text logs; finished days that only have text logs
+        are converted so later reads are mapped.
+        """
+        mac_key = mac_to_file_key(mac)
+        for attempt in range(3):
+            try:
+                return self._read_day(mac_key, day)
+            except FileNotFoundError:
+                # Compacted between the existence check and the read; look again
+                if attempt == 2:
+                    raise
+
+    def _read_day(self, mac_key, day):
+        path = self.path(mac_key, day)
+        today = datetime.utcnow().strftime('%Y-%m-%d')
+        if os.path.exists(path):
+            if self.cache is not None and day < today:
+                # Past days rarely change (backfills only append), so keep them parsed in memory
+                return self.cache.load(path, read_track_tail)
+            return self._map(path)
+        if day >= today:
+            # The writer owns today's file; never create it from the read side
+            return read_text_track(self.text_log_paths(mac_key, day), self.cache)
+
+        compacted = self.compacted_path(mac_key, day)
+        if os.path.exists(compacted):
+            if self.cache is not None:
+                return self.cache.load(compacted, read_compacted_tail)
+            return read_compacted(compacted)
+        with self._lock:
+            if not os.path.exists(path) and not os.path.exists(compacted):
+                text_paths = self.text_log_paths(mac_key, day)
+                if not text_paths:
+                    # Nothing stored for this device-day; reading must not leave files behind
+                    return EMPTY_TRACK
+                self._build_from_text(mac_key, day, text_paths)
+        return self._map(path)
+
+    def locate_range(self, mac, day, start, end, track=None):
+        """
+        Record positions of the points of a device-day with ``start <= t < end`` (epoch seconds).
+
+        The minute index narrows the search to the records of the buckets the window
+        touches plus any tail appended since the index was last updated, so a short
+        window on a long day only maps the pages it needs. Positions are in file
+        order and stay valid as the file grows, so they can be used as cursors.
+
+        :param track: The result of ``read`` for the same device-day, if the caller already has it
+        """
+        mac_key = mac_to_file_key(mac)
+        if track is None:
+            track = self.read(mac_key, day)
+        return self._locate(mac_key, day, track, start, end)
+
+    def _locate(self, mac_key, day, track, start, end):
+        if not len(track):
+            return np.zeros(0, dtype=np.int64)
+
+        index_path = self.index_path(mac_key, day)
+        if not os.path.exists(index_path) and day < datetime.utcnow().strftime('%Y-%m-%d'):
+            with self._lock:
+                if not os.path.exists(index_path) and os.path.exists(self.path(mac_key, day)):
+                    self._build_index(mac_key, day)
+        try:
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        except FileNotFoundError:
+            index = None
+        if index is None or len(index) != INDEX_BUCKETS + 1:
+            # Today's file before the writer has indexed it, or a compacted day: scan the whole day
+            return np.flatnonzero((track['t'] >= start) & (track['t'] < end))
+
+        day_start = day_start_epoch(day)
+        first_bucket = max(0, (start - day_start) // INDEX_BUCKET_SECONDS)
+        last_bucket = min(INDEX_BUCKETS - 1, (end - 1 - day_start) // INDEX_BUCKET_SECONDS)
+        indexed = min(int(index['end'][INDEX_BUCKETS]), len(track))
+
+        ranges = []
+        if first_bucket <= last_bucket:
+            buckets = index[first_bucket:last_bucket + 1]
+            lo = int(buckets['first'].min())
+            hi = min(int(buckets['end'].max()), indexed)
+            if lo < hi:
+                ranges.append((lo, hi))
+        if indexed < len(track):
+            ranges.append((indexed, len(track)))
+
+        positions = []
+        for lo, hi in ranges:
+            t = track['t'][lo:hi]
+            positions.append(np.flatnonzero((t >= start) & (t < end)) + lo)
+        return np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64)
+
+    def read_range(self, mac, day, start, end):
+        """Points of a device-day with ``start <= t < end`` (epoch seconds), in file order."""
+        mac_key = mac_to_file_key(mac)
+        compacted = self.compacted_path(mac_key, day)
+        if not os.path.exists(self.path(mac_key, day)) and os.path.exists(compacted):
+            # The footer lets a window decompress only the blocks it overlaps
+            try:
+                return read_compacted(compacted, start, end)
+            except FileNotFoundError:
+                pass
+        track = self.read(mac_key, day)
+        positions = self._locate(mac_key, day, track, start, end)
+        if not len(positions):
+            return EMPTY_TRACK
+        return track[positions]
+
+    def device_days(self):
+        """Sorted ``(mac_key, day)`` pairs with points in the text logs, the track store or a compacted file."""
+        if self.catalog is not None:
+            # Every track file is written next to text parts, so the catalog covers them too
+            return self.catalog.device_days()
+        pairs = set()
+        for name in os.listdir(self.log_dir):
+            parsed = parse_log_file_name(name)
+            if parsed:
+                pairs.add(parsed[:2])
+        with os.scandir(self.tracks_dir) as entries:
+            for entry in entries:
+                # Reading a day without points leaves an empty track file behind
+                if entry.name.endswith(TRACK_FILE_SUFFIX) and entry.stat().st_size:
+                    mac_key, _, day = entry.name[:-len(TRACK_FILE_SUFFIX)].rpartition('_')
+                    pairs.add((mac_key, day))
+                elif entry.name.endswith(COMPACT_FILE_SUFFIX):
+                    mac_key, _, day = entry.name[:-len(COMPACT_FILE_SUFFIX)].rpartition('_')
+                    pairs.add((mac_key, day))
+        return sorted(pairs)
+
+    def devices_for_day(self, day):
+        """MAC keys that have points on ``day``."""
+        return sorted(mac_key for mac_key, d in self.device_days() if d == day)
+
+    def uncompacted_days(self, before):
+        """Sorted ``(mac_key, day)`` pairs before ``before`` that still have text parts or a track file."""
+        if self.catalog is not None:
+            return self.catalog.uncompacted_days(before)
+        pairs = set()
+        for name in os.listdir(self.log_dir):
+            parsed = parse_log_file_name(name)
+            if parsed and parsed[1] < before:
+                pairs.add(parsed[:2])
+        for name in os.listdir(self.tracks_dir):
+            if name.endswith(TRACK_FILE_SUFFIX):
+                mac_key, _, day = name[:-len(TRACK_FILE_SUFFIX)].rpartition('_')
+                if day < before:
+                    pairs.add((mac_key, day))
+        return sorted(pairs)
+
+    def compact(self, mac_key, day):
+        """
+        Merge a closed device-day into its compacted file and remove its text parts, track file and index.
+
+        The source is the track file when there is one, since it holds every point of
+        the text parts; otherwise the previous compacted file plus the text parts. The
+        sources are removed only once the new file is durable, and compacting the same
+        inputs again gives the same file, so an interrupted run is finished by the next.
+        The caller keeps writers of the day out while this runs.
+
+        :return: ``(points read, points kept)``
+        """
+        path = self.path(mac_key, day)
+        compacted = self.compacted_path(mac_key, day)
+        with self._lock:
+            entry = self._handles.pop((mac_key, day), None)
+            if entry is not None:
+                entry[0].close()
+                entry[2].flush()
+
+            parts = self.text_log_paths(mac_key, day)
+            if os.path.exists(path):
+                source = np.array(self._map(path))
+            else:
+                tracks = [read_compacted(compacted)] if os.path.exists(compacted) else []
+                tracks.append(read_text_track(parts))
+                source = np.concatenate(tracks)
+            track = compact_track(source)
+            if len(track):
+                write_compacted(compacted, track)
+
+            for stale in (self.index_path(mac_key, day), path, *parts):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+                if self.cache is not None:
+                    self.cache.discard(stale)
+            if self.catalog is not None:
+                self.catalog.forget(parts)
+                if len(track):
+                    self.catalog.replace(compacted, track)
+
+        logger.info(f"Compacted {mac_key} {day}: {len(source)} points, {len(track)} kept, {len(parts)} text parts")
+        return len(source), len(track)
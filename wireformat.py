@@ -0,0 +1,118 @@
+# wireformat.py
+import gzip
+import json
+
+import numpy as np
+
+from trackstore import COORD_SCALE
+
+# Compact encodings for track responses; t is always epoch seconds (UTC)
+#   objects   [{"lat", "lng", "timestamp"}, ...] (the default)
+#   columnar  {"t": [...], "lat": [...], "lng": [...]}
+#   polyline  {"polyline": <Google encoded polyline>, "t": [...]}
+#   binary    little-endian, every field 4-byte aligned: uint32 n | uint32 t[n] | int32 lat[n] | int32 lng[n]
+#             with coordinates in 1e-7 degrees, so the browser can wrap each column in a typed array
+FORMAT_OBJECTS = 'objects'
+FORMAT_COLUMNAR = 'columnar'
+FORMAT_POLYLINE = 'polyline'
+FORMAT_BINARY = 'binary'
+
+MIMETYPES = {
+    FORMAT_OBJECTS: 'application/json',
+    FORMAT_COLUMNAR: 'application/vnd.oriiona.columnar+json',
+    FORMAT_POLYLINE: 'application/vnd.oriiona.polyline+json',
+    FORMAT_BINARY: 'application/octet-stream',
+}
+
+POLYLINE_PRECISION = 5
+GZIP_MIN_SIZE = 1024
+
+
+def negotiate(format_arg, accept_mimetypes):
+    """
+    Pick the response format from an explicit ``?format=`` or the ``Accept`` header.
+
+    :raises ValueError: if ``format_arg`` names an unknown format
+    """
+    if format_arg:
+        if format_arg not in MIMETYPES:
+            raise ValueError(f"Unknown format '{format_arg}', expected one of {', '.join(MIMETYPES)}")
+        return format_arg
+    by_mimetype = {mimetype: name for name, mimetype in MIMETYPES.items()}
+    best = accept_mimetypes.best_match(list(by_mimetype), default=MIMETYPES[FORMAT_OBJECTS])
+    return by_mimetype[best]
+
+
+def encode_polyline(lats, lngs, precision=POLYLINE_PRECISION):
+    """Google encoded polyline of the coordinates, built without a per-point Python loop."""
+    if not len(lats):
+        return ''
+    factor = 10 ** precision
+    scaled = np.empty((len(lats), 2), dtype=np.int64)
+    scaled[:, 0] = np.rint(np.asarray(lats, dtype=np.float64) * factor)
+    scaled[:, 1] = np.rint(np.asarray(lngs, dtype=np.float64) * factor)
+    deltas = np.diff(scaled, axis=0, prepend=0).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)  # zigzag: sign in the lowest bit
+
+    # Split each value into 5-bit chunks, lowest first; all but the last carry the 0x20 flag
+    shifts = np.arange(7, dtype=np.int64) * 5
+    chunks = (values[:, None] >> shifts) & 0x1F
+    lengths = 1 + ((values[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    used = np.arange(7) < lengths[:, None]
+    continued = np.arange(7) < (lengths - 1)[:, None]
+    chars = chunks + 63 + np.where(continued, 0x20, 0)
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+def pack_binary(epochs, lat_e7, lng_e7):
+    n = len(epochs)
+    body = np.empty(1 + 3 * n, dtype='<u4')
+    body[0] = n
+    body[1:1 + n] = np.asarray(epochs, dtype=np.int64)
+    body[1 + n:].view('<i4')[:n] = lat_e7
+    body[1 + 2 * n:].view('<i4')[:n] = lng_e7
+    return body.tobytes()
+
+
+def render(fmt, epochs, lat_e7, lng_e7, macs=None):
+    """
+    Encode a track given as epoch seconds and 1e-7 degree integer columns.
+
+    :param macs: Optional per-point MAC, added as a ``mac`` field (objects) or column (columnar)
+    :return: ``(body, mimetype)``
+    """
+    epochs = np.asarray(epochs, dtype=np.int64)
+    if fmt == FORMAT_BINARY:
+        return pack_binary(epochs, lat_e7, lng_e7), MIMETYPES[fmt]
+
+    lats = np.asarray(lat_e7) / COORD_SCALE
+    lngs = np.asarray(lng_e7) / COORD_SCALE
+    if fmt == FORMAT_COLUMNAR:
+        body = {'t': epochs.tolist(), 'lat': lats.tolist(), 'lng': lngs.tolist()}
+        if macs is not None:
+            body['mac'] = list(macs)
+    elif fmt == FORMAT_POLYLINE:
+        body = {'polyline': encode_polyline(lats, lngs), 'precision': POLYLINE_PRECISION, 't': epochs.tolist()}
+    else:
+        # np.char.replace cannot size its output for an empty array on NumPy 2
+        stamps = np.char.replace(np.datetime_as_string(epochs.astype('datetime64[s]')), 'T', ' ').tolist() \
+            if len(epochs) else []
+        body = [{'lat': lat, 'lng': lng, 'timestamp': ts}
+                for lat, lng, ts in zip(lats.tolist(), lngs.tolist(), stamps)]
+        if macs is not None:
+            for point, mac in zip(body, macs):
+                point['mac'] = mac
+    return json.dumps(body, separators=(',', ':')), MIMETYPES[fmt]
+
+
+def compress(body, accept_encodings):
+    """
+    Gzip a finished body if the client accepts it and it is worth it.
+
+    :return: ``(body, content_encoding or None)``
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if len(body) < GZIP_MIN_SIZE or not accept_encodings['gzip']:
+        return body, None
+    return gzip.compress(body, compresslevel=5), 'gzip'
@@ -0,0 +1,229 @@
+# writequeue.py
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+FSYNC_NEVER = 'never'
+FSYNC_BATCH = 'batch'
+FSYNC_INTERVAL = 'interval'
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+
+# How often an idle writer thread (and a producer blocked on a full queue) looks at the stop flag
+_WAKEUP_SECONDS = 0.1
+
+
+class WriteQueue:
+    """
+    Bounded ingest queue drained by a single background writer thread.
+
+    Producers (the MQTT callback, HTTP handlers) only enqueue. The writer thread
+    waits for the first point, keeps collecting for up to ``flush_interval``
+    seconds or ``max_batch`` points, and hands the whole batch to
+    ``write_many`` of the storage backend so every file is written once per batch.
+
+    With ``overflow='block'`` a producer waits for room as long as the writer runs,
+    so no point is lost to a full queue; only once ``stop`` was called are points
+    that still find the queue full dropped (and counted). The drop modes never wait.
+
+    :param writer: Storage (or LogWriter) the batches are committed to
+    :param maxsize: Maximum number of queued points
+    :param flush_interval: Seconds to keep collecting after the first point of a batch
+    :param max_batch: Maximum number of points per batch
+    :param fsync: ``never``, ``batch`` (fsync every commit) or ``interval`` (at most every ``fsync_interval``)
+    :param fsync_interval: Seconds between fsyncs when ``fsync`` is ``interval``
+    :param overflow: ``block``, ``drop_newest`` or ``drop_oldest`` when the queue is full
+    :param latency_samples: Number of recent enqueue-to-disk latencies kept for the percentiles in ``stats``
+    """
+
+    def __init__(self, writer, maxsize=10000, flush_interval=0.05, max_batch=5000,
+                 fsync=FSYNC_INTERVAL, fsync_interval=1.0, overflow=OVERFLOW_BLOCK,
+                 latency_samples=10000):
+        if fsync not in (FSYNC_NEVER, FSYNC_BATCH, FSYNC_INTERVAL):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+
+        self.writer = writer
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.overflow = overflow
+
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._last_fsync = time.monotonic()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_samples)
+        self._stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'blocked': 0,
+            'written': 0,
+            'batches': 0,
+            'files_written': 0,
+            'max_queue_depth': 0,
+            'last_batch_size': 0,
+            'last_commit_ms': 0.0,
+            'max_commit_ms': 0.0,
+            'total_commit_ms': 0.0,
+            'errors': 0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='log-writer')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def put(self, mac, lat, lng, timestamp):
+        """
+        Enqueue one point for the writer thread.
+
+        :return: True if the point was queued, False if it was dropped by the overflow policy
+        """
+        record = ((timestamp, lat, lng, mac), time.perf_counter())
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self._put_blocking(record)
+            else:
+                self._put_nowait(record)
+        except queue.Full:
+            self._count('dropped')
+            logger.warning(f"Write queue full ({self.maxsize}), dropping point for {mac}")
+            return False
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+        return True
+
+    def _put_blocking(self, record):
+        try:
+            self._queue.put_nowait(record)
+            return
+        except queue.Full:
+            self._count('blocked')
+        # Wait for the writer to make room; give up only once it is stopping
+        while True:
+            try:
+                self._queue.put(record, timeout=_WAKEUP_SECONDS)
+                return
+            except queue.Full:
+                if self._stopping.is_set() or self._thread is None:
+                    raise
+
+    def _put_nowait(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                raise
+            # drop_oldest: make room by discarding the head of the queue
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._count('dropped')
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(record)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _next_batch(self):
+        """The next batch to commit, or None once ``stop`` was called and the queue is drained."""
+        while True:
+            try:
+                first = self._queue.get(timeout=_WAKEUP_SECONDS)
+                break
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return None
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _should_fsync(self):
+        if self.fsync == FSYNC_BATCH:
+            return True
+        if self.fsync == FSYNC_INTERVAL and time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._last_fsync = time.monotonic()
+            return True
+        return False
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        try:
+            files = self.writer.write_many([record for record, _ in batch], fsync=self._should_fsync())
+        except Exception:
+            logger.exception(f"Failed to commit batch of {len(batch)} points")
+            self._count('errors')
+            files = []
+        committed = time.perf_counter()
+        elapsed_ms = (committed - started) * 1000
+
+        with self._stats_lock:
+            self._latencies.extend((committed - enqueued) * 1000 for _, enqueued in batch)
+            self._stats['batches'] += 1
+            self._stats['written'] += len(batch) if files else 0
+            self._stats['files_written'] += len(files)
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_commit_ms'] = elapsed_ms
+            self._stats['total_commit_ms'] += elapsed_ms
+            if elapsed_ms > self._stats['max_commit_ms']:
+                self._stats['max_commit_ms'] = elapsed_ms
+
+        for _ in batch:
+            self._queue.task_done()
+
+    def flush(self):
+        """Block until every point queued so far has been committed."""
+        self._queue.join()
+
+    def stop(self):
+        """Commit whatever is still queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = list(self._latencies)
+        latencies.sort()
+        stats['latency_p50_ms'] = latencies[len(latencies) // 2] if latencies else 0.0
+        stats['latency_p99_ms'] = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] if latencies else 0.0
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_commit_ms'] = stats['total_commit_ms'] / stats['batches'] if stats['batches'] else 0.0
+        return stats